@@ -3,10 +3,12 @@ import os
 from io import StringIO
 
 import time
+import datetime as dt
 import wrftamer
 from wrftamer import res_path
 from wrftamer.wrftamer_paths import wrftamer_paths
 from wrftamer.main import Project, list_projects, reassociate
+from wrftamer import catalog
 
 # -----------------------------------------------------------------------------------------------------------------------
 # Variables
@@ -43,13 +45,19 @@ exp_name = st.sidebar.selectbox('Choose Experiment', options=proj.list_exp(verbo
 
 # -----------------------------------------------------------------------------------------------------------------------
 
-proj_tab, exp_tab, reass_tab, about_tab = st.tabs(['Projects', 'Experiments', 'Reassociate Experiments', 'About'])
+proj_tab, exp_tab, reass_tab, search_tab, about_tab = st.tabs(
+    ['Projects', 'Experiments', 'Reassociate Experiments', 'Search Experiments', 'About'])
 
 with proj_tab:
     col1, col2 = st.columns([0.25, 0.75])
 
     col2.markdown('**Experiments found for selected project**')
     col2.table(proj_df)
+    try:
+        # cached per directory, so this is fast for projects that did not change.
+        col2.markdown(f'**Disk use of the project:** {proj.disk_use(verbose=False) / 1024 ** 3:.2f} GB')
+    except FileNotFoundError:
+        pass
 
     col1.markdown('**Project Management**')
     new_proj_name = col1.text_input('New Project Name')
@@ -78,6 +86,13 @@ with proj_tab:
         except FileNotFoundError:
             col2.error("Selected project does not exist.")
 
+    if col1.button('Refresh disk use and runtimes', use_container_width=True):
+        try:
+            proj.update_csv()
+            st.experimental_rerun()
+        except FileNotFoundError:
+            col2.error("Selected project does not exist.")
+
     if col1.button('Remove project', use_container_width=True):
         try:
             proj.remove(force=True, verbose=verbose)
@@ -220,6 +235,25 @@ with reass_tab:
         time.sleep(1)
         st.experimental_rerun()
 
+with search_tab:
+    col1, col2 = st.columns([0.25, 0.75])
+
+    # one query over the experiments of all projects, see catalog.
+    col1.markdown('**Filter experiments of all projects**')
+    filters = dict()
+    statuses = col1.multiselect('Status', options=catalog.query().status.dropna().unique())
+    if len(statuses) > 0:
+        filters['status__in'] = statuses
+    comment = col1.text_input('Comment contains')
+    if comment:
+        filters['comment__contains'] = comment
+    start_after = col1.date_input('Start on or after', value=None)
+    if start_after is not None:
+        filters['start__gte'] = dt.datetime.combine(start_after, dt.time())
+
+    col2.markdown('**Experiments found**')
+    col2.dataframe(catalog.query(**filters), use_container_width=True)
+
 with about_tab:
     message = f"WRFtamer, Version {wrftamer.__version__}"
 
@@ -0,0 +1,155 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+import xarray as xr
+from typing import Union
+
+
+def match_times(reference: np.ndarray, times: np.ndarray, tolerance=None) -> np.ndarray:
+    """
+    Finds the nearest time step in times for each reference time, with a sorted merge (np.searchsorted) instead of
+    a reindex.
+
+    Args:
+        reference: the times to be matched (datetime64).
+        times: the times to match to (datetime64), sorted.
+        tolerance: the largest distance of matched times, i.e. "1min" or np.timedelta64(1, "m"). Default: exact
+        matches only.
+
+    Returns: the index into times of each reference time, -1 where there is none within the tolerance.
+    """
+
+    reference = np.asarray(reference, dtype="datetime64[ns]")
+    times = np.asarray(times, dtype="datetime64[ns]")
+    if len(times) == 0:
+        return np.full(len(reference), -1)
+
+    tolerance = pd.Timedelta(tolerance or 0).to_timedelta64()
+    after = np.minimum(np.searchsorted(times, reference), len(times) - 1)
+    before = np.maximum(after - 1, 0)
+    dist_after = np.abs(times[after] - reference)
+    dist_before = np.abs(reference - times[before])
+
+    # ties go to the earlier time step.
+    index = np.where(dist_after < dist_before, after, before)
+    index[np.minimum(dist_after, dist_before) > tolerance] = -1
+
+    return index
+
+
+def align(obs: Union[xr.DataArray, pd.Series], models: dict, var: str, level=None, station_name=None,
+          tolerance=None, obs_label="left", window=None) -> xr.Dataset:
+    """
+    Aligns observations and the averaged tslist data of several experiments on the time steps of the observations.
+    The model data is read once into one contiguous array with shape (mod, station_name, time), which backs all
+    model variables of the result. Statistics_xarray works on this array directly, without copying it.
+
+    Args:
+        obs: observations along time or (station_name, time), i.e. a DataArray, or a pd.Series with a time index.
+        models: the averaged data of each experiment, {name: xr.Dataset or path to an Ave*Min_tslist file}.
+        var: the variable of the models, i.e. WSP.
+        level: the model_level of var, if var has levels.
+        station_name: the station(s) of obs, if obs has no station_name dimension.
+        tolerance: the largest distance in time of matched time steps, i.e. "1min". Default: exact matches.
+        obs_label: "left" if the time stamps of obs are the start of the averaging windows (like in the Ave files)
+        or "right" if they are the end. With "right", the time stamps are moved to the start of the windows.
+        window: the averaging window of obs in minutes. Models averaged over other windows are rejected.
+
+    Returns: a Dataset with Obs and the models along (station_name, time), with the time stamps of the
+    observations (moved to the start of the windows for obs_label="right"). Use
+    aligned.sel(station_name=loc).to_pandas() to get the input of statistics().
+    """
+
+    if isinstance(obs, pd.Series):
+        obs = xr.DataArray(obs.values, coords={"time": obs.index.values}, dims=["time"])
+    if "station_name" not in obs.dims:
+        obs = obs.expand_dims(station_name=np.atleast_1d(station_name))
+    obs = obs.transpose("station_name", "time")
+
+    times = obs.time.values.astype("datetime64[ns]")
+    if obs_label == "right":
+        if window is None:
+            print("The averaging window of the observations is required for obs_label='right'.")
+            raise ValueError
+        times = times - np.timedelta64(window, "m")
+    elif obs_label != "left":
+        print(f"Unknown obs_label {obs_label}. Choose left or right.")
+        raise ValueError
+
+    stations = obs.station_name.values
+    block = np.empty((len(models), len(stations), len(times)))
+    matched = []
+    for mm, (name, model) in enumerate(models.items()):
+        data = _open_model(model)
+        model_window = _averaging_window(data, model)
+        if window is not None and model_window is not None and model_window != window:
+            print(f"{name} is averaged over {model_window} minutes, the observations over {window} minutes.")
+            raise ValueError
+        _gather(_select(data, var, level, stations), times, tolerance, block[mm], matched)
+
+    aligned = xr.Dataset(
+        {"Obs": (["station_name", "time"], obs.values.astype(float, copy=False))},
+        coords={"station_name": stations, "time": times},
+    )
+    for mm, name in enumerate(models):
+        aligned[name] = (["station_name", "time"], block[mm])
+    aligned.attrs = {"var": var}
+
+    return aligned
+
+
+def _open_model(model) -> xr.Dataset:
+    if isinstance(model, xr.Dataset):
+        return model
+    if str(model).rstrip("/").endswith(".zarr"):
+        return xr.open_zarr(model)
+    return xr.open_dataset(model)
+
+
+def _averaging_window(data: xr.Dataset, model):
+    # the averaging window (minutes) from the comment of average_ts_files or the file name, None if unknown.
+    for text, pattern in [(data.attrs.get("comment", ""), r"(\d+)-minute averaged"),
+                          (str(model) if isinstance(model, (str, os.PathLike)) else "", r"Ave(\d+)Min")]:
+        found = re.search(pattern, text)
+        if found:
+            return int(found.group(1))
+    return None
+
+
+def _select(data: xr.Dataset, var: str, level, stations) -> xr.DataArray:
+    # the data of var at the stations (and level), not read yet.
+    selected = data[var]
+    if level is not None:
+        selected = selected.sel(model_level=level)
+    return selected.sel(station_name=stations).transpose("station_name", "time")
+
+
+def _gather(data: xr.DataArray, times: np.ndarray, tolerance, out: np.ndarray, matched: list):
+    """
+    Writes the time steps of data that match times (see match_times) into out, with shape (station, time). Only the
+    range of time steps that is matched is read. Time steps without a match are NaN.
+
+    matched holds the matches of previous calls, which are reused for models with the same time steps.
+    """
+
+    model_times = data.time.values
+    if not np.all(model_times[1:] > model_times[:-1]):
+        data = data.sortby("time")
+        model_times = data.time.values
+
+    for previous, index in matched:
+        if np.array_equal(previous, model_times):
+            break
+    else:
+        index = match_times(times, model_times, tolerance)
+        matched.append((model_times, index))
+    found = index >= 0
+    if not found.any():
+        out[...] = np.nan
+        return
+
+    first, last = index[found].min(), index[found].max()
+    values = data.isel(time=slice(first, last + 1)).values.astype(float, copy=False)
+    np.take(values, np.where(found, index - first, 0), axis=1, out=out)
+    out[:, ~found] = np.nan
@@ -0,0 +1,143 @@
+"""
+Queries over the experiments of all projects, i.e.
+
+    catalog.query(status="post processed", start__gte=dt.datetime(2020, 1, 1), project__in=["P1", "P2"])
+
+Filters are given as <field>__<lookup>=value, with the fields project, name, time, comment, start, end, disk_use,
+runtime and status and the lookups eq (default), ne, gt, gte, lt, lte, in and contains. Dates are compared as text
+in the format of the database ("2020-05-17 00:00:00"), which sorts like the dates.
+
+With the sqlite backend (see experiment_db), a query is a single indexed SELECT over all projects. With the csv
+backend, the List_of_Experiments.csv files of the projects are read and filtered with pandas.
+"""
+
+import operator
+from pathlib import Path
+from contextlib import closing
+import numpy as np
+import pandas as pd
+
+from wrftamer import cfg
+from wrftamer.wrftamer_paths import wrftamer_paths
+from wrftamer.experiment_db import COLUMNS, CSVBackend, SQLiteBackend, connect_sqlite, _db_value
+
+FIELDS = {
+    "project": "project",
+    "name": "Name",
+    "time": "time",
+    "comment": "comment",
+    "start": "start",
+    "end": "end",
+    "disk_use": "disk use",
+    "runtime": "runtime",
+    "status": "status",
+}
+
+# the comparisons in SQL and python
+LOOKUPS = {"eq": ("=", operator.eq), "ne": ("!=", operator.ne), "gt": (">", operator.gt), "gte": (">=", operator.ge),
+           "lt": ("<", operator.lt), "lte": ("<=", operator.le)}
+
+
+def query(backend=None, db_path=None, **filters) -> pd.DataFrame:
+    """
+    Returns the experiments of all projects that match all filters.
+
+    Args:
+        backend: csv or sqlite. Default: wrftamer_db_backend of the configuration.
+        db_path: the directory of the projects. Default: the db_path of wrftamer_paths.
+        **filters: <field>__<lookup>=value, see the module docstring.
+
+    Returns: a DataFrame with the column project and the columns of List_of_Experiments.csv, sorted by project.
+    """
+
+    if backend is None:
+        backend = cfg.get("wrftamer_db_backend", "csv")
+    if db_path is None:
+        db_path = wrftamer_paths()[1]
+    conditions = _parse(filters)
+
+    if backend == "sqlite":
+        df = _query_sqlite(Path(db_path), conditions)
+    elif backend == "csv":
+        df = _query_csv(Path(db_path), conditions)
+    else:
+        print(f"Unknown database backend {backend}. Choose csv or sqlite.")
+        raise ValueError
+
+    df[["disk use", "runtime"]] = df[["disk use", "runtime"]].astype(float)
+    return df.reset_index(drop=True)
+
+
+def _parse(filters: dict) -> list:
+    # [(column, lookup, value)] of the filters, with values as stored in the database.
+    conditions = []
+    for key, value in filters.items():
+        field, _, lookup = key.partition("__")
+        lookup = lookup or "eq"
+        if field not in FIELDS or lookup not in list(LOOKUPS) + ["in", "contains"]:
+            print(f"Unknown filter {key}. Use <field>__<lookup> with the fields {', '.join(FIELDS)} and the lookups "
+                  f"{', '.join(LOOKUPS)}, in, contains.")
+            raise ValueError
+
+        if lookup == "in":
+            value = [_db_value(item) for item in value]
+        else:
+            value = _db_value(value)
+        conditions.append((FIELDS[field], lookup, value))
+
+    return conditions
+
+
+def _query_sqlite(db_path: Path, conditions: list) -> pd.DataFrame:
+    clauses, params = [], []
+    for column, lookup, value in conditions:
+        if lookup == "in":
+            clauses.append(f'"{column}" IN ({", ".join("?" * len(value))})')
+            params.extend(value)
+        elif lookup == "contains":
+            clauses.append(f'instr("{column}", ?) > 0')
+            params.append(value)
+        else:
+            clauses.append(f'"{column}" {LOOKUPS[lookup][0]} ?')
+            params.append(value)
+
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    select = f"SELECT project, {SQLiteBackend.columns} FROM experiments{where} ORDER BY project, rowid"
+    with closing(connect_sqlite(db_path)) as con:
+        df = pd.read_sql_query(select, con, params=params)
+    return df
+
+
+def _query_csv(db_path: Path, conditions: list) -> pd.DataFrame:
+    # only the projects that may match are read.
+    projects = sorted(path.name for path in db_path.iterdir() if path.is_dir())
+    for column, lookup, value in conditions:
+        if column == "project" and lookup in ["eq", "in"]:
+            projects = [name for name in projects if name in (value if lookup == "in" else [value])]
+
+    frames = []
+    for name in projects:
+        try:
+            df = CSVBackend(name, db_path / name).read()
+        except FileNotFoundError:
+            continue
+        df.insert(0, "project", name)
+        frames.append(df)
+
+    if len(frames) == 0:
+        return pd.DataFrame(columns=["project"] + COLUMNS)
+    df = pd.concat(frames)
+
+    mask = np.ones(len(df), dtype=bool)
+    for column, lookup, value in conditions:
+        values = df[column]
+        if lookup == "in":
+            mask &= values.isin(value).to_numpy()
+        elif lookup == "contains":
+            mask &= values.astype(str).str.contains(str(value), regex=False).to_numpy() & values.notna().to_numpy()
+        else:
+            # like in SQL, missing values match no condition.
+            match = LOOKUPS[lookup][1](values, value)
+            mask &= match.to_numpy(dtype=bool, na_value=False) & values.notna().to_numpy()
+
+    return df[mask]
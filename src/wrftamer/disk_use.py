@@ -0,0 +1,122 @@
+import os
+import json
+import time
+from pathlib import Path
+
+# seconds a directory must be unchanged before its size is cached, see DiskUsage.
+SETTLE = 3600
+# the tslist products that are extended in place (raw_tslist*, Ave*Min_tslist* and the manifests .raw_tslist*).
+PRODUCTS = ("raw", "Ave", ".raw")
+
+
+class DiskUsage:
+    """
+    Sizes of directory trees: the sum of the sizes of all regular files, without symbolic links (which are not
+    followed either).
+
+    Directories are read with os.scandir, which knows the type of each entry without a stat call. Only regular files
+    are stat'ed, once each. The size of the files directly in a directory and the names of its subdirectories are
+    cached, keyed by the modification time of the directory. If a directory has not changed, a single stat call of the
+    directory replaces reading it. Changed directories are read again, their unchanged subdirectories still come from
+    the cache.
+
+    Files that grow without adding or removing entries do not change the modification time of their directory.
+    Hence, only directories that had not been modified for settle seconds when they were read are cached. The
+    directories of a running experiment are read every time. The tslist products (see PRODUCTS), which incremental
+    post-processing extends long after the run, are stat'ed every time, and directories of products (zarr stores)
+    are never cached.
+    """
+
+    def __init__(self, filename=None, settle=SETTLE):
+        """
+        Args:
+            filename: the json file of the cache. Default: no file, the cache lives as long as this object.
+            settle: seconds a directory must be unchanged before its size is cached.
+        """
+
+        self.filename = filename
+        self.settle = settle
+        self.cache = dict()
+        self.roots = set()
+        self.visited = set()
+
+        if filename is not None and os.path.isfile(filename):
+            try:
+                with open(filename) as f:
+                    self.cache = json.load(f)
+            except json.JSONDecodeError:
+                pass
+
+    def size(self, *paths) -> int:
+        """
+        Returns: the total size of the directory trees in paths in bytes. Paths that do not exist have size 0.
+        """
+
+        total = 0
+        for path in paths:
+            path = os.path.abspath(path)
+            self.roots.add(path)
+            total += self._size(path)
+        return total
+
+    def _size(self, path: str, product=False) -> int:
+        # product: path is (in) a directory of a tslist product, which is not cached.
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return 0
+        self.visited.add(path)
+
+        # entries: modification time, size of the files except for products, subdirectories, products.
+        entry = None if product else self.cache.get(path)
+        if entry is not None and len(entry) == 4 and entry[0] == stat.st_mtime_ns:
+            own, subdirs, products = entry[1:]
+            total = own + sum(_file_size(os.path.join(path, name)) for name in products)
+        else:
+            own, total, subdirs, products = 0, 0, [], []
+            with os.scandir(path) as entries:
+                for item in entries:
+                    if item.is_dir(follow_symlinks=False):
+                        subdirs.append(item.name)
+                    elif item.is_file(follow_symlinks=False):
+                        size = item.stat(follow_symlinks=False).st_size
+                        total += size
+                        if item.name.startswith(PRODUCTS):
+                            products.append(item.name)
+                        else:
+                            own += size
+
+            if not product and time.time() - stat.st_mtime >= self.settle:
+                self.cache[path] = [stat.st_mtime_ns, own, subdirs, products]
+            else:
+                self.cache.pop(path, None)
+
+        return total + sum(self._size(os.path.join(path, name), product or name.startswith(PRODUCTS))
+                           for name in subdirs)
+
+    def save(self):
+        """
+        Writes the cache to filename. Entries of directories below the measured paths that no longer exist are
+        removed.
+        """
+
+        if self.filename is None or not Path(self.filename).parent.is_dir():
+            return
+
+        prefixes = tuple(root + os.sep for root in self.roots)
+        stale = [path for path in self.cache
+                 if (path in self.roots or path.startswith(prefixes)) and path not in self.visited]
+        for path in stale:
+            del self.cache[path]
+
+        tmp = f"{self.filename}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.cache, f)
+        os.replace(tmp, self.filename)
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.stat(path, follow_symlinks=False).st_size
+    except FileNotFoundError:
+        return 0
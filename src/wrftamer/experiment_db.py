@@ -0,0 +1,351 @@
+"""
+The database of the experiments of the projects. Two backends are available:
+
+- csv: one List_of_Experiments.csv per project (default). Every change reads and rewrites the file, while holding
+  an fcntl lock on List_of_Experiments.csv.lock. The file is replaced atomically, so readers need no lock.
+- sqlite: one table of the experiments of all projects in db_path/experiments.sqlite, with the primary key
+  (project, Name). Lookups and changes of single experiments use the index and run in one transaction each.
+
+The backend is chosen with wrftamer_db_backend in the configuration. convert_db copies the experiments from one
+backend to the other.
+"""
+
+import os
+import sqlite3
+import datetime as dt
+from contextlib import closing, contextmanager
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+COLUMNS = ["Name", "time", "comment", "start", "end", "disk use", "runtime", "status"]
+
+
+def get_csv(filename):
+    df = pd.read_csv(
+        filename,
+        index_col="index",
+        usecols=["index"] + COLUMNS,
+    )
+    return df
+
+
+def open_db(backend: str, proj_name: str, tamer_path: Path):
+    """
+    Returns the database of the experiments of a project.
+
+    Args:
+        backend: csv or sqlite
+        proj_name: the name of the project
+        tamer_path: the directory of the project in db_path
+
+    Returns: a CSVBackend or SQLiteBackend
+    """
+
+    if backend == "csv":
+        return CSVBackend(proj_name, tamer_path)
+    elif backend == "sqlite":
+        return SQLiteBackend(proj_name, tamer_path)
+    else:
+        print(f"Unknown database backend {backend}. Choose csv or sqlite.")
+        raise ValueError
+
+
+def convert_db(db_path: Path, source: str, target: str, verbose=True):
+    """
+    Copies the experiments of all projects in db_path from one backend to the other, i.e. imports all
+    List_of_Experiments.csv files into the sqlite database. The entries of the projects in target are replaced.
+
+    Args:
+        db_path: the directory of the projects
+        source: the backend to read from (csv or sqlite)
+        target: the backend to write to (csv or sqlite)
+        verbose: speak with user
+
+    Returns: None
+    """
+
+    for tamer_path in sorted(path for path in Path(db_path).iterdir() if path.is_dir()):
+        try:
+            df = open_db(source, tamer_path.name, tamer_path).read()
+        except FileNotFoundError:
+            continue
+
+        if verbose:  # pragma: no cover
+            print(f"Copying {len(df)} experiments of {tamer_path.name} from {source} to {target}")
+
+        open_db(target, tamer_path.name, tamer_path).replace(df)
+
+
+def _db_value(value):
+    # the value of a row as stored in the database: datetimes as text like in the csv files, NaN as None (NULL).
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (dt.datetime, np.datetime64)):
+        return str(pd.Timestamp(value))
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class ExperimentDB:
+    """
+    The common interface of the backends. Rows are dicts with the keys COLUMNS. Methods that read raise a
+    FileNotFoundError if the project does not exist.
+    """
+
+    def __init__(self, proj_name: str, tamer_path: Path):
+        self.proj_name = proj_name
+        self.tamer_path = Path(tamer_path)
+
+    def create(self):
+        raise NotImplementedError
+
+    def read(self, name=None) -> pd.DataFrame:
+        """
+        Returns the experiments of the project (or only experiment name) in the layout of List_of_Experiments.csv.
+        """
+        raise NotImplementedError
+
+    def replace(self, df: pd.DataFrame):
+        """
+        Replaces all experiments of the project by the rows of df (layout of read).
+        """
+        raise NotImplementedError
+
+    def get(self, name: str):
+        """
+        Returns the row of experiment name, or None if it does not exist.
+        """
+        df = self.read(name)
+        if len(df) == 0:
+            return None
+        return df.iloc[0].to_dict()
+
+    def exists(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def names(self) -> list:
+        return self.read().Name.to_list()
+
+    def add(self, row: dict):
+        raise NotImplementedError
+
+    def update(self, name: str, updates: dict):
+        self.update_many({name: updates})
+
+    def update_many(self, updates: dict):
+        """
+        Changes several experiments at once, updates = {name: {column: value}}.
+        """
+        raise NotImplementedError
+
+    def remove(self, names: list):
+        raise NotImplementedError
+
+    def rename(self, old_name: str, new_name: str):
+        self.update(old_name, {"Name": new_name})
+
+    def drop(self):
+        """
+        Removes all experiments of the project, after the project has been removed.
+        """
+        pass
+
+    def move(self, new_name: str):
+        """
+        Moves all experiments of the project to project new_name, when the project is renamed.
+        """
+        pass
+
+    def import_csv(self, filename):
+        self.replace(get_csv(filename))
+
+    def export_csv(self, filename):
+        self.read().to_csv(filename)
+
+
+class CSVBackend(ExperimentDB):
+    """
+    The experiments of a project in tamer_path/List_of_Experiments.csv.
+    """
+
+    @property
+    def filename(self):
+        return self.tamer_path / "List_of_Experiments.csv"
+
+    @contextmanager
+    def locked(self):
+        """
+        Holds an exclusive fcntl lock on List_of_Experiments.csv.lock, so that changes of concurrent processes (i.e.
+        the watchdog and the GUI) are serialized instead of overwriting each other. The lock is released when the
+        process dies. Without fcntl (not POSIX), changes are not locked.
+        """
+
+        with open(f"{self.filename}.lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.lockf(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(lock, fcntl.LOCK_UN)
+
+    def _read_for_change(self) -> pd.DataFrame:
+        # as objects, since empty columns are read as float and would not take text.
+        return get_csv(self.filename).astype(object)
+
+    def _write(self, df: pd.DataFrame):
+        # write to a temporary file and rename, so that readers never see a partially written file.
+        tmp = f"{self.filename}.tmp"
+        df.to_csv(tmp)
+        os.replace(tmp, self.filename)
+
+    def create(self):
+        df = pd.DataFrame(columns=["index"] + COLUMNS)
+        df.set_index("index")
+        with self.locked():
+            self._write(df)
+
+    def read(self, name=None) -> pd.DataFrame:
+        df = get_csv(self.filename)
+        if name is not None:
+            df = df[df.Name == name]
+        return df
+
+    def replace(self, df: pd.DataFrame):
+        df = df[COLUMNS].reset_index(drop=True)
+        df.index.name = "index"
+        with self.locked():
+            self._write(df)
+
+    def add(self, row: dict):
+        with self.locked():
+            df = self._read_for_change()
+            if row["Name"] in df.Name.values:
+                raise FileExistsError
+
+            # a new index, since removed rows leave gaps.
+            df.loc[df.index.max() + 1 if len(df) > 0 else 0] = [_db_value(row.get(item)) for item in COLUMNS]
+            self._write(df)
+
+    def update_many(self, updates: dict):
+        with self.locked():
+            df = self._read_for_change()
+            for name, values in updates.items():
+                rows = df.Name == name
+                for item in COLUMNS:
+                    if item in values:
+                        df.loc[rows, item] = _db_value(values[item])
+            self._write(df)
+
+    def remove(self, names: list):
+        with self.locked():
+            df = get_csv(self.filename)
+            self._write(df[~df.Name.isin(names)])
+
+
+class SQLiteBackend(ExperimentDB):
+    """
+    The experiments of a project in the table experiments of db_path/experiments.sqlite, which holds all projects.
+    Every change is one transaction; sqlite serializes concurrent writers with its own file locks.
+    """
+
+    columns = ", ".join(f'"{item}"' for item in COLUMNS)
+    schema = """
+        CREATE TABLE IF NOT EXISTS experiments (
+            project TEXT NOT NULL, "Name" TEXT NOT NULL, "time" TEXT, "comment" TEXT, "start" TEXT, "end" TEXT,
+            "disk use" REAL, "runtime" REAL, "status" TEXT, PRIMARY KEY (project, "Name")
+        );
+        CREATE INDEX IF NOT EXISTS experiments_status ON experiments ("status");
+        CREATE INDEX IF NOT EXISTS experiments_start ON experiments ("start");
+    """
+
+    @property
+    def filename(self):
+        return self.tamer_path.parent / "experiments.sqlite"
+
+    def connect(self, check=True):
+        """
+        Opens the database. With check, a FileNotFoundError is raised if the project does not exist.
+        """
+
+        if check and not self.tamer_path.is_dir():
+            raise FileNotFoundError
+
+        return connect_sqlite(self.tamer_path.parent)
+
+    def create(self):
+        self.connect(check=False).close()
+
+    def read(self, name=None) -> pd.DataFrame:
+        query = f"SELECT {self.columns} FROM experiments WHERE project = ?"
+        params = [self.proj_name]
+        if name is not None:
+            query += ' AND "Name" = ?'
+            params.append(name)
+
+        with closing(self.connect()) as con:
+            df = pd.read_sql_query(query + " ORDER BY rowid", con, params=params)
+
+        df[["disk use", "runtime"]] = df[["disk use", "runtime"]].astype(float)
+        df.index.name = "index"
+        return df
+
+    def replace(self, df: pd.DataFrame):
+        rows = [[self.proj_name] + [_db_value(value) for value in row] for row in df[COLUMNS].itertuples(index=False)]
+        with closing(self.connect(check=False)) as con, con:
+            con.execute("DELETE FROM experiments WHERE project = ?", (self.proj_name,))
+            con.executemany(f"INSERT INTO experiments (project, {self.columns}) VALUES (?{', ?' * len(COLUMNS)})",
+                            rows)
+
+    def add(self, row: dict):
+        values = [self.proj_name] + [_db_value(row.get(item)) for item in COLUMNS]
+        try:
+            with closing(self.connect()) as con, con:
+                con.execute(f"INSERT INTO experiments (project, {self.columns}) VALUES (?{', ?' * len(COLUMNS)})",
+                            values)
+        except sqlite3.IntegrityError:
+            raise FileExistsError
+
+    def update_many(self, updates: dict):
+        # all experiments in one transaction.
+        with closing(self.connect()) as con, con:
+            for name, values in updates.items():
+                items = [item for item in COLUMNS if item in values]
+                if len(items) == 0:
+                    continue
+
+                assignments = ", ".join(f'"{item}" = ?' for item in items)
+                params = [_db_value(values[item]) for item in items] + [self.proj_name, name]
+                con.execute(f'UPDATE experiments SET {assignments} WHERE project = ? AND "Name" = ?', params)
+
+    def remove(self, names: list):
+        with closing(self.connect()) as con, con:
+            con.executemany('DELETE FROM experiments WHERE project = ? AND "Name" = ?',
+                            [(self.proj_name, name) for name in names])
+
+    def drop(self):
+        with closing(self.connect(check=False)) as con, con:
+            con.execute("DELETE FROM experiments WHERE project = ?", (self.proj_name,))
+
+    def move(self, new_name: str):
+        with closing(self.connect(check=False)) as con, con:
+            con.execute("UPDATE experiments SET project = ? WHERE project = ?", (new_name, self.proj_name))
+
+
+def connect_sqlite(db_path: Path) -> sqlite3.Connection:
+    """
+    Opens db_path/experiments.sqlite, the experiments of all projects (see SQLiteBackend). The table and its indices
+    are created if needed.
+    """
+
+    os.makedirs(db_path, exist_ok=True)
+    con = sqlite3.connect(Path(db_path) / "experiments.sqlite", timeout=60)
+    con.executescript(SQLiteBackend.schema)
+    return con
@@ -1,12 +1,13 @@
-import pandas as pd
 import os
 import glob
+import json
 import shutil
 import datetime as dt
 import numpy as np
 from pathlib import Path
 import yaml
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from typing import Union
 import re
@@ -14,6 +15,9 @@ import re
 from wrftamer.wrftamer_paths import wrftamer_paths
 import wrftamer.wrftamer_functions as wtfun
 from wrftamer.process_tslist_files import merge_tslist_files, average_ts_files
+from wrftamer.statistics import StatisticsCache
+from wrftamer.experiment_db import COLUMNS, open_db
+from wrftamer.disk_use import DiskUsage
 
 from wrftamer import res_path, cfg
 
@@ -45,25 +49,6 @@ def list_projects(verbose=True) -> list:
     return list_of_projects
 
 
-def get_csv(filename):
-    df = pd.read_csv(
-        filename,
-        index_col="index",
-        usecols=[
-            "index",
-            "Name",
-            "time",
-            "comment",
-            "start",
-            "end",
-            "disk use",
-            "runtime",
-            "status",
-        ],
-    )
-    return df
-
-
 def reassociate(proj_old, proj_new, exp_name: str):
     """
     Associate <exp_name> with <proj_new>. Unassociate this exp with <proj_old>
@@ -76,27 +61,19 @@ def reassociate(proj_old, proj_new, exp_name: str):
 
     # --------------------------------------------------------------------------------------------------------------
     # from old project
-    df = proj_old.exp_provide_all_info(exp_name)
-    name, time_of_creation, comment, start, end, du, rt, status = tuple(
-        df.to_numpy()[0]
-    )
+    row = proj_old.db.get(exp_name)
+    if row is None:
+        raise FileNotFoundError
 
     # Database update
-    df = get_csv(proj_new.filename)
     # Check if name is unique, otherwise cannot add an experiment of the same name
-    if exp_name in df.Name.values:
+    if proj_new.db.exists(exp_name):
         raise FileExistsError
 
-    # Add to new db
-    new_line = [exp_name, time_of_creation, comment, start, end, du, rt, "created"]
-    df.loc[len(df)] = new_line
-    df.to_csv(proj_new.filename)
-
-    # remove from old db
-    df = get_csv(proj_old.filename)
-    idx = df.index[df.Name == exp_name].values
-    df = df.drop(idx)
-    df.to_csv(proj_old.filename)
+    # Add to new db, remove from old db
+    row["status"] = "created"
+    proj_new.db.add(row)
+    proj_old.db.remove([exp_name])
 
     # move actual experiment
     old_workdir = proj_old.get_workdir(exp_name)
@@ -108,6 +85,7 @@ class Project:
     def __init__(self, name: Union[str, None] = None):
 
         self.make_submit = cfg['wrftamer_make_submit']
+        self.db_backend = cfg.get('wrftamer_db_backend', 'csv')
 
         if name is None:
             name = "Unassociated_Experiments"
@@ -137,11 +115,26 @@ class Project:
         filename = self.tamer_path / "List_of_Experiments.csv"
         return filename
 
+    @property
+    def db(self):
+        # the database of the experiments, see experiment_db.
+        return open_db(self.db_backend, self.name, self.tamer_path)
+
+    @property
+    def disk_usage(self):
+        # sizes of the directories of the project, with cached totals per directory, see DiskUsage.
+        return DiskUsage(self.tamer_path / "du_cache.json")
+
+    @property
+    def statistics_cache(self):
+        # statistics of the experiments, see StatisticsCache.
+        return StatisticsCache(self.tamer_path / "statistics.csv")
+
     # ------------------------------------------------------------------------------------------------------------------
     # Project related methods
     def create(self, verbose=True):
         """
-        Creates a directory and an empty csv file named List_of_Experiments.csv
+        Creates a directory and an empty database of experiments (List_of_Experiments.csv with the csv backend)
         Creates a directory in run_path named proj_name. Runs should be created there
 
         Drops an error if proj_name already exists.
@@ -155,22 +148,7 @@ class Project:
 
             self.proj_path.mkdir(parents=True)
             self.tamer_path.mkdir(parents=True)
-
-            df = pd.DataFrame(
-                columns=[
-                    "index",
-                    "Name",
-                    "time",
-                    "comment",
-                    "start",
-                    "end",
-                    "disk use",
-                    "runtime",
-                    "status",
-                ]
-            )
-            df.set_index("index")
-            df.to_csv(self.tamer_path / "List_of_Experiments.csv")
+            self.db.create()
 
         namelist_template = res_path / 'namelist.template'
         wrftamer_conf = res_path / 'configure_template.yaml'
@@ -215,6 +193,7 @@ class Project:
                 print("Removing", self.archive_path)
 
             shutil.rmtree(self.tamer_path)
+            self.db.drop()
             if self.proj_path.is_dir():
                 shutil.rmtree(self.proj_path)
             if self.archive_path.is_dir():
@@ -260,6 +239,7 @@ class Project:
         if old_archive_path.is_dir():
             os.rename(old_archive_path, new_archive_path)
 
+        self.db.move(new_name)
         self.name = new_name
 
     def disk_use(self, verbose=True):
@@ -278,19 +258,9 @@ class Project:
                 print("This project does not exist")
             raise FileNotFoundError
 
-        proj_size1 = sum(
-            os.path.getsize(f)
-            for f in self.proj_path.rglob("**")
-            if (os.path.isfile(f) and not os.path.islink(f))
-        )
-
-        proj_size2 = sum(
-            os.path.getsize(f)
-            for f in self.archive_path.rglob("**")
-            if (os.path.isfile(f) and not os.path.islink(f))
-        )
-
-        proj_size = proj_size1 + proj_size2
+        disk_usage = self.disk_usage
+        proj_size = disk_usage.size(self.proj_path, self.archive_path)
+        disk_usage.save()
 
         if verbose:  # pragma: no cover
             print("Size of the project", self.name, ": ", proj_size, "bytes")
@@ -303,52 +273,76 @@ class Project:
     def list_exp(self, verbose=True):
 
         # Fails with a FileNotFoundError if project does not exist.
-        df = get_csv(self.filename)
+        df = self.db.read()
 
         if verbose:
             print(df.Name)
 
         return df.Name.to_list()
 
-    def update_csv(self):
+    def update_csv(self, workers=8, force=False):
         """
         Calculation of rt, du etc is rather slow, so instead of calling this in the GUI, just call it from time to
         time and write the data into the csv file.
+
+        The experiments are refreshed in a pool of threads, since the work is mostly waiting for the file system.
+        Experiments whose files have not changed since the last refresh are skipped (see _exp_signature). All rows are
+        written at once.
+
+        Args:
+            workers: number of threads
+            force: refresh all experiments, changed or not
+
+        Returns: the names of the experiments that were refreshed.
         """
 
-        df = get_csv(self.filename)
+        signature_file = self.tamer_path / "signatures.json"
+        try:
+            with open(signature_file) as f:
+                previous = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            previous = dict()
 
-        exp_list = df.Name.to_list()
+        # taken before the refresh, so changes during the refresh are found next time.
+        signatures = {exp_name: self._exp_signature(exp_name) for exp_name in self.db.names()}
+        changed = [exp_name for exp_name in signatures if force or previous.get(exp_name) != signatures[exp_name]]
 
-        for idx, exp_name in enumerate(exp_list):
+        # one cache of directory sizes for all threads, saved once.
+        disk_usage = self.disk_usage
+
+        def refresh(exp_name):
             start, end = self.exp_start_end(exp_name, verbose=False)
-            du = self.exp_du(exp_name, False)
+            du = self.exp_du(exp_name, False, disk_usage=disk_usage)
             rt = self.exp_runtime(exp_name, verbose=False)
+            return {"start": start, "end": end, "disk use": du, "runtime": rt}
 
-            time = df.time[idx]
-            comment = df.comment[idx]
-            status = df.status[idx]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            updates = dict(zip(changed, executor.map(refresh, changed)))
+        disk_usage.save()
 
-            new_line = [exp_name, time, comment, start, end, du, rt, status]
-            df.loc[idx] = new_line
+        # only these columns are written, so changes of the status in the meantime are kept.
+        self.db.update_many(updates)
 
-        df.to_csv(self.filename)
+        tmp = f"{signature_file}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(signatures, f)
+        os.replace(tmp, signature_file)
 
-    def cleanup_db(self, verbose=True):
+        return changed
 
-        df = get_csv(self.filename)
+    def cleanup_db(self, verbose=True):
 
-        for exp_name in df["Name"]:
+        missing = []
+        for exp_name in self.db.names():
             if (self.proj_path / exp_name).is_dir():
                 if verbose:  # pragma: no cover
                     print("Experiment", exp_name, "exists")
             else:
                 if verbose:  # pragma: no cover
                     print("Experiment", exp_name, "does not exist and is removed from db")
-                idx = df.index[df.Name == exp_name].values
-                df = df.drop(idx)
+                missing.append(exp_name)
 
-        df.to_csv(self.filename)
+        self.db.remove(missing)
 
     # ------------------------------------------------------------------------------------------------------------------
     def exp_create(
@@ -383,10 +377,8 @@ class Project:
             self.create()  # always create a project, even if proj_name is None.
 
         # Check Database
-        df = get_csv(self.filename)
-
         # Check if name is unique, otherwise cannot add an experiment of the same name
-        if exp_name in df.Name.values:
+        if self.db.exists(exp_name):
             if verbose:  # pragma: no cover
                 print("Directories of the experiment do not exist, but an entry in the database does.")
                 print("This can happen, if a folder has been removed manually.")
@@ -423,8 +415,7 @@ class Project:
 
         new_line = [exp_name, time_of_creation, comment, start, end, du, rt, "created"]
 
-        df.loc[len(df)] = new_line
-        df.to_csv(self.filename)
+        self.db.add(dict(zip(COLUMNS, new_line)))
 
     def exp_copy(self, old_exp_name: str, new_exp_name: str, comment: str, verbose=True):
         """
@@ -444,7 +435,6 @@ class Project:
 
         old_exp_path = self.proj_path / old_exp_name
         new_exp_path = self.proj_path / new_exp_name
-        df = get_csv(self.filename)
 
         status = self.exp_get_status(old_exp_name)
         if status == "archived":
@@ -460,7 +450,7 @@ class Project:
 
         # check Database
         # Check if name is unique, otherwise cannot add an experiment of the same name
-        if new_exp_name in df.Name.values:
+        if self.db.exists(new_exp_name):
             if verbose:  # pragma: no cover
                 print("Directories of the new experiment do not exist, but an entry in the database does.")
                 print("This can happen, if a folder has been removed manually.")
@@ -495,8 +485,7 @@ class Project:
             "added",
         ]
 
-        df.loc[len(df)] = new_line
-        df.to_csv(self.filename)
+        self.db.add(dict(zip(COLUMNS, new_line)))
 
         self._update_db_entry(new_exp_name, {"status": "created"})
 
@@ -519,8 +508,6 @@ class Project:
         archive_path = self.archive_path / exp_name
         status = self.exp_get_status(exp_name)
 
-        df = get_csv(self.filename)
-
         if exp_path.is_dir() or archive_path.is_dir():
             remove_dirs = True
         else:
@@ -528,7 +515,7 @@ class Project:
                 print("Directories of experiment not found.")
             remove_dirs = False
 
-        if exp_name in df.Name.values:
+        if self.db.exists(exp_name):
             remove_db_entry = True
         else:
             if verbose:  # pragma: no cover
@@ -558,9 +545,7 @@ class Project:
                     shutil.rmtree(exp_path)  # raises FileNotFoundError on failure
 
             if remove_db_entry:
-                idx = df.index[df.Name == exp_name].values
-                df = df.drop(idx)
-                df.to_csv(self.filename)
+                self.db.remove([exp_name])
         else:
             print("Abort. (Yes must be capitalized)")
             return
@@ -573,21 +558,21 @@ class Project:
         old_workdir = self.get_workdir(old_exp_name)
         new_workdir = old_workdir.parent / new_exp_name
         # I do not call get_workdir (because this one would be a run dir, so it would fail with archived runs)
-        df = get_csv(self.filename)
+        names = self.db.names()
 
         if new_workdir.is_dir():
             if verbose:  # pragma: no cover
                 print(f"Cannot rename, experiment {new_exp_name} exists.")
             raise FileExistsError
 
-        if old_exp_name not in df.Name.values:
+        if old_exp_name not in names:
             print(
                 f"Directories of the experiment {old_exp_name} do not exist, but an entry in the database does."
             )
             print("This can happen, if a folder has been removed manually.")
             print("Run cleanup_db to resolve this issue.")
             raise FileNotFoundError
-        elif new_exp_name in df.Name.values:  # pragma: no cover
+        elif new_exp_name in names:  # pragma: no cover
             print(f"Directories of the experiment {new_exp_name} do not exist, but an entry in the database does.")
             print("This can happen, if a folder has been removed manually.")
             print("Run cleanup_db to resolve this issue.")
@@ -602,10 +587,7 @@ class Project:
 
         # --------------------------------------------------------------------------------------------------------------
         # Database update
-        idx = df.index[df.Name == old_exp_name].values
-        df.Name.values[idx] = new_exp_name
-
-        df.to_csv(self.filename)
+        self.db.rename(old_exp_name, new_exp_name)
 
     def exp_run_wps(self, exp_name, verbose=True):
 
@@ -674,7 +656,8 @@ class Project:
                 print("No files to move")
 
     def exp_process_tslist(
-            self, exp_name: str, location: str, domain: str, timeavg: list, verbose=True
+            self, exp_name: str, location: str, domain: str, timeavg: list, verbose=True, workers=1,
+            streaming=False, incremental=False, chunks=None, cache=False, backend="netcdf", encoding=None
     ):
 
         workdir = self.get_workdir(exp_name)
@@ -688,14 +671,26 @@ class Project:
                 print(f"The directory {workdir}/out/tsfiles*' does not exist")
             return
 
-        merge_tslist_files(idir, outdir, location, domain, self.name, exp_name)
+        changed = merge_tslist_files(
+            idir, outdir, location, domain, self.name, exp_name, workers=workers, streaming=streaming,
+            incremental=incremental, cache=cache, backend=backend, encoding=encoding
+        )
+
+        if incremental:
+            # only the averages of raw files with new data need to be updated.
+            for rawfile, since in tqdm(changed.items()):
+                average_ts_files(rawfile, timeavg, since=since, chunks=chunks, encoding=encoding)
+        else:
+            # if tslists exists
+            rawlist = list(outdir.glob("raw*.zarr" if backend == "zarr" else "raw*.nc"))
 
-        # if tslists exists
-        rawlist = list(outdir.glob("raw*"))
+            total = len(rawlist)
+            for i, rawfile in tqdm(enumerate(rawlist)):
+                average_ts_files(str(rawfile), timeavg, chunks=chunks, encoding=encoding)
 
-        total = len(rawlist)
-        for i, rawfile in tqdm(enumerate(rawlist)):
-            average_ts_files(str(rawfile), timeavg)
+        # zarr stores are extended inside their directories. Touching out marks the experiment as changed for
+        # update_csv (see _exp_signature).
+        os.utime(outdir)
 
         self._update_db_entry(exp_name, {"status": "post processed"})
 
@@ -779,11 +774,21 @@ class Project:
                         location = ppp[item].get("location", None)
                         domain = ppp[item].get("domain", None)
                         timeavg = ppp[item].get("timeavg", None)
+                        workers = ppp[item].get("workers", 1)
+                        streaming = ppp[item].get("streaming", False)
+                        incremental = ppp[item].get("incremental", False)
+                        chunks = ppp[item].get("chunks", None)
+                        cache = ppp[item].get("cache", False)
+                        backend = ppp[item].get("backend", "netcdf")
+                        encoding = ppp[item].get("encoding", None)
                     else:
                         location, domain, timeavg = None, None, None
+                        workers, streaming, incremental, chunks, cache = 1, False, False, None, False
+                        backend, encoding = "netcdf", None
 
                     self.exp_process_tslist(
-                        exp_name, location, domain, timeavg, verbose
+                        exp_name, location, domain, timeavg, verbose, workers=workers, streaming=streaming,
+                        incremental=incremental, chunks=chunks, cache=cache, backend=backend, encoding=encoding
                     )
 
             elif item == "create_maps":
@@ -792,15 +797,18 @@ class Project:
 
         self._update_db_entry(exp_name, {"status": "post processed"})
 
-    def exp_du(self, exp_name: str, verbose=True):
+    def exp_du(self, exp_name: str, verbose=True, disk_usage=None):
+        """
+        The size of the experiment in megabytes. disk_usage: a DiskUsage shared by several calls, which the caller
+        saves (i.e. in update_csv). Default: the cache of the project.
+        """
 
         workdir = self.get_workdir(exp_name)
 
-        exp_size = sum(
-            os.path.getsize(f)
-            for f in workdir.rglob("**")
-            if (os.path.isfile(f) and not os.path.islink(f))
-        ) / (1024 * 1024)
+        usage = self.disk_usage if disk_usage is None else disk_usage
+        exp_size = usage.size(workdir) / (1024 * 1024)
+        if disk_usage is None:
+            usage.save()
 
         if verbose:  # pragma: no cover
             print("Size of the experiment", exp_name, ": ", exp_size, "megabytes")
@@ -895,14 +903,11 @@ class Project:
 
     def exp_provide_info(self, exp_name=None):
 
-        df = get_csv(self.filename)
+        df = self.db.read(exp_name)
 
         select = list(np.repeat(False, len(df)))
         df["select"] = select
 
-        if exp_name is not None:
-            df = df[df.Name == exp_name]
-
         # Change datatypes of start and end to string, since the GUI-Tabulator widget throws an error with timestamps!
         df["start"] = df["start"].astype(str)
         df["end"] = df["end"].astype(str)
@@ -911,22 +916,18 @@ class Project:
 
     def exp_provide_all_info(self, exp_name=None):
 
-        df = get_csv(self.filename)
-
-        if exp_name is not None:
-            df = df[df.Name == exp_name]
+        df = self.db.read(exp_name)
 
         return df
 
     def exp_get_status(self, exp_name):
 
-        df = get_csv(self.filename)
-        df = df[df.Name == exp_name]
+        row = self.db.get(exp_name)
 
-        try:
-            status = df.status.values[0]
-        except IndexError:
+        if row is None:
             status = "Uncreated"
+        else:
+            status = row["status"]
 
         return status
 
@@ -987,33 +988,41 @@ class Project:
 
         return workdir
 
-    def _update_db_entry(self, exp_name: str, updates: dict):
+    def _exp_signature(self, exp_name) -> list:
         """
-        A small helper function to update the data base entries. may go to another file at some point.
+        The state of the files that update_csv reads: modification times and sizes of the directories of the
+        experiment, the namelist, rsl.error.0000 and the files in out. New or removed files change the directories.
+        Files that grow during a run are found through rsl.error.0000, which WRF writes at every time step. The
+        tslist products in out are extended in place after the run (see exp_process_tslist), which changes the
+        files in out or, for zarr stores, the modification time of out.
         """
 
-        df = get_csv(self.filename)
-
-        line = df[df.Name == exp_name]
-
-        new_line = []
-        for item in [
-            "Name",
-            "time",
-            "comment",
-            "start",
-            "end",
-            "disk use",
-            "runtime",
-            "status",
-        ]:
-            if item in updates:
-                new_line.append(updates[item])
-            else:
-                new_line.append(line[item].values[0])
+        workdir = self.get_workdir(exp_name)
+        signature = [str(workdir)]
+        for path in [workdir, workdir / "wrf", workdir / "log", workdir / "out", workdir / "wrf/namelist.input",
+                     workdir / "wrf/rsl.error.0000", workdir / "log/rsl.error.0000"]:
+            try:
+                stat = os.stat(path)
+                signature.append([stat.st_mtime_ns, stat.st_size])
+            except FileNotFoundError:
+                signature.append(None)
+
+        try:
+            with os.scandir(workdir / "out") as entries:
+                files = sorted((item.name, item.stat(follow_symlinks=False)) for item in entries
+                               if item.is_file(follow_symlinks=False))
+            signature.append([[name, stat.st_mtime_ns, stat.st_size] for name, stat in files])
+        except FileNotFoundError:
+            signature.append(None)
+
+        return signature
+
+    def _update_db_entry(self, exp_name: str, updates: dict):
+        """
+        A small helper function to update the data base entries, see experiment_db.
+        """
 
-        df[df.Name == exp_name] = new_line
-        df.to_csv(self.filename)
+        self.db.update(exp_name, updates)
 
     def _determine_status(self, exp_name):
 
@@ -1,16 +1,40 @@
 #!/usr/bin/env python3
-import glob
+import io
 import pandas as pd
 import datetime as dt
 import xarray as xr
 import numpy as np
 import os
 import itertools
+import collections
+import contextlib
+import functools
+import math
+import hashlib
+import netCDF4
+from concurrent.futures import ProcessPoolExecutor
 from typing import Union
 import yaml
 
 from wrftamer import res_path
 
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+# file extension of the tslist products per output backend
+_EXTENSIONS = {"netcdf": ".nc", "zarr": ".zarr"}
+# encoding of the data variables of the tslist products (see _build_encoding). Each chunk holds one station, so the
+# time series of one station is read from len(time) / 8192 chunks and no data of other stations is read.
+_DEFAULT_ENCODING = {"complevel": 1, "shuffle": True, "float32": False, "chunks": {"station_name": 1, "time": 8192}}
+# the ts-files of a location that are read, and the names of the columns of the TS-file per version.
+_VARLIST = ["UU", "VV", "PH", "WW", "TH", "QV", "PR", "TS"]
+_TS_NAMES = {
+    "old": ["Time", "U10", "V10", "PSFC", "GLW", "GSW", "HFX", "LH", "TSK"],
+    "new": ["Time", "T2", "Q2", "U10", "V10", "PSFC", "GLW", "GSW", "HFX", "LH", "TSK"],
+}
+
 
 def assign_cf_attributes_tslist(
         data: xr.Dataset,
@@ -131,51 +155,239 @@ def uv_to_FFDD(u, v):
     return ff, dd
 
 
-def read_files(fiile, var_element, version: str):
+# Byte translation used by the fixed width parser. Blanks become zeros, the minus sign becomes a flag byte ("p")
+# and decimal points and newlines become ":", which must only appear at known positions. Anything else is marked
+# with "X" and sends the file to the generic parser.
+_FW_TRANSLATION = bytearray(b"X" * 256)
+for _char in b"0123456789":
+    _FW_TRANSLATION[_char] = _char
+_FW_TRANSLATION[ord(" ")] = ord("0")
+_FW_TRANSLATION[ord("-")] = ord("p")
+_FW_TRANSLATION[ord(".")] = ord(":")
+_FW_TRANSLATION[ord("\n")] = ord(":")
+_FW_TRANSLATION = bytes(_FW_TRANSLATION)
+
+_ZEROS = 0x3030303030303030
+
+
+def _fold_digits(words):
+    """
+    Converts words of eight digits (one digit per byte, the first digit in the lowest byte) to integers.
+    """
+    words = (words * np.uint64(10) + (words >> np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    words = (words * np.uint64(100) + (words >> np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    return (words * np.uint64(10000) + (words >> np.uint64(32))) & np.uint64(0x00000000FFFFFFFF)
+
+
+def _parse_words(words, nbytes: int, dot):
+    """
+    Parses the last <nbytes> bytes of translated 8-byte words. The byte at position <dot> (if any) is the decimal
+    point and counts as a zero. Returns the integer value and the sign, or None if a byte is not a digit.
+    """
+    keep = ((1 << (8 * nbytes)) - 1) << (8 * (8 - nbytes))
+    if dot is not None:
+        keep &= ~(0xFF << (8 * dot))
+
+    words = (words & np.uint64(keep)) | np.uint64(_ZEROS & ~keep)
+    words -= np.uint64(_ZEROS)
+    negative = (words & np.uint64(0x4040404040404040)) != 0
+    words &= np.uint64(0x0F0F0F0F0F0F0F0F)
+    if ((words + np.uint64(0x0606060606060606)) & np.uint64(0x1010101010101010)).any():
+        return None, None
+
+    return _fold_digits(words), negative
+
+
+def _parse_fixed_width(content: bytes, start: int, use_cols=None, block=16384):
+    """
+    A parser for the fixed width layout of the tslist files. WRF writes all rows with the same fortran format,
+    so the position of each field and its decimal point is known from the first data line. The fields are read
+    as 8-byte words directly from the file content, which avoids tokenizing the text.
+
+    Args:
+        content: the content of a tslist file.
+        start: position of the first data line (i.e. the length of the header).
+        use_cols: the columns to return. All columns are returned if None.
+        block: number of lines that are processed at once.
+
+    Returns: a 2-D array of floats or None, if the content does not follow a fixed width layout. In this case,
+    the generic parser should be used.
+    """
+
+    rowlen = content.find(b"\n", start) + 1 - start
+    if rowlen <= 1 or start < 16 or (len(content) - start) % rowlen:
+        return None
+    nrows = (len(content) - start) // rowlen
+
+    # end of each field, its width and the number of decimals (-1 for integers)
+    first = content[start:start + rowlen - 1]
+    fields = []
+    pos = 0
+    for token in first.split():
+        end = first.index(token, pos) + len(token)
+        dot = token.rfind(b".")
+        fields.append((end, end - pos, len(token) - dot - 1 if dot >= 0 else -1))
+        pos = end
+
+    if use_cols is not None:
+        fields = [fields[i] for i in use_cols]
+
+    # Neighbouring fields with the same format are processed together.
+    # Up to 15 digits can be converted to floats without loss of precision.
+    groups = []
+    for end, width, ndec in fields:
+        if width > 16 or (ndec < 0 and width > 15):
+            return None
+        if groups and groups[-1][1:3] == [width, ndec] and end - groups[-1][0] == width * groups[-1][3]:
+            groups[-1][3] += 1
+        else:
+            groups.append([end, width, ndec, 1])
+
+    check_cols = [rowlen - 1] + [end - ndec - 1 for end, width, ndec in fields if ndec >= 0]
+
+    values = np.empty((nrows, len(fields)), order="F")
+    for row in range(0, nrows, block):
+        n = min(block, nrows - row)
+
+        # The 16 bytes in front of the block belong to the previous line (or header) and are masked.
+        offset = start + row * rowlen - 16
+        chunk = content[offset:offset + 16 + n * rowlen].translate(_FW_TRANSLATION)
+        if chunk.find(b"X", 16) >= 0:
+            return None
+
+        lines = np.frombuffer(chunk, np.uint8, offset=16).reshape(n, rowlen)
+        for col in check_cols:
+            if not (lines[:, col] == ord(":")).all():
+                return None
+
+        col = 0
+        for end, width, ndec, nfields in groups:
+            words = np.ndarray((n, nfields), "<u8", chunk, 16 + end - 8, (rowlen, width))
+            number, negative = _parse_words(words, min(width, 8), 7 - ndec if 0 <= ndec < 8 else None)
+            if number is None:
+                return None
+
+            if width > 8:
+                words = np.ndarray((n, nfields), "<u8", chunk, 16 + end - 16, (rowlen, width))
+                upper, negative2 = _parse_words(words, width - 8, 15 - ndec if ndec >= 8 else None)
+                if upper is None:
+                    return None
+                number += upper * np.uint64(100000000)
+                negative |= negative2
+
+            if ndec >= 0:
+                # the decimal point has been read as a zero.
+                scale = 10 ** ndec
+                number -= (number // np.uint64(10 * scale)) * np.uint64(9 * scale)
+
+            out = values[row:row + n, col:col + nfields]
+            np.copyto(out, number, casting="unsafe")
+            if ndec > 0:
+                out /= 10.0 ** ndec
+            np.negative(out, out=out, where=negative)
+            col += nfields
+
+    return values
+
+
+def read_files(fiile, var_element, version: str, offset: int = 0, cache_dir=None, startdate=None):
     # TS files have surface variables, all other files vertical levels. Thus columns and names need to specified
+    # offset: position (in bytes) of the first line to read. Lines before are skipped, but the header is always read.
+    # cache_dir: if given, the parsed file is stored in this directory and reused as long as the file is unchanged.
+    # startdate: the start date from the header (see _station_index). Parsed from the header if not given.
 
     if version == "old":
         use_cols = [1, 7, 8, 9, 10, 11, 12, 13, 14] if var_element == "TS" else None
-        names = (
-            ["Time", "U10", "V10", "PSFC", "GLW", "GSW", "HFX", "LH", "TSK"]
-            if var_element == "TS"
-            else None
-        )
+        names = _TS_NAMES[version] if var_element == "TS" else None
     elif version == "new":
         use_cols = (
             [1, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14] if var_element == "TS" else None
         )
-        names = (
-            ["Time", "T2", "Q2", "U10", "V10", "PSFC", "GLW", "GSW", "HFX", "LH", "TSK"]
-            if var_element == "TS"
-            else None
-        )
+        names = _TS_NAMES[version] if var_element == "TS" else None
     else:
         print("version unknown")
         raise IndexError
 
-    with open(fiile, "r") as myfile:
-        # head contains information like station height, station name, startdate
-        head = myfile.readline().rstrip("\n")
-        # this adds the timezone info. DLeuk, 30.08.2021
-        startdate = dt.datetime.strptime(head.split(" ")[-1] + "-+0000", "%Y-%m-%d_%H:%M:%S-%z")
-        data = pd.read_csv(myfile, sep=r"\s+", header=None, index_col=0, usecols=use_cols, names=names)
+    cachefile = _cache_file(fiile, version, cache_dir) if cache_dir is not None and offset == 0 else None
+    if cachefile is not None and os.path.isfile(cachefile):
+        # column 0 holds the time in seconds since 1970, all others the data.
+        table = np.load(cachefile, mmap_mode="r")
+        columns = names[1:] if names is not None else list(range(1, table.shape[1]))
+        data = pd.DataFrame(table[:, 1:], columns=columns, copy=False)
+        data.index = table[:, 0].astype(np.int64).astype("datetime64[s]")
+        return data
 
-        # Make a new index for the dataframe, by taking the starttime into account.
+    with open(fiile, "rb") as myfile:
+        if offset > 0:
+            content = myfile.readline()
+            myfile.seek(max(offset, len(content)))
+            content += myfile.read()
+        else:
+            content = myfile.read()
+
+    # head contains information like station height, station name, startdate
+    start = content.find(b"\n") + 1
+    if startdate is None:
+        startdate = _parse_startdate(content[:start].decode().rstrip("\n"))
+
+    values = _parse_fixed_width(content, start, use_cols)
+    if values is not None:
+        columns = names[1:] if names is not None else list(range(1, values.shape[1]))
+        index = values[:, 0]
+        data = pd.DataFrame(values[:, 1:], columns=columns, copy=False)
+    else:
+        # Not the layout written by WRF (i.e. overflowing fields or NaNs). Use the (slower) generic parser.
+        data = pd.read_csv(io.BytesIO(content[start:]), sep=r"\s+", header=None, index_col=0, usecols=use_cols,
+                           names=names)
+        index = data.index.to_numpy()
 
-        seconds = np.round(data.index * 3600 + startdate.timestamp()).astype(int)
-        # I am converting the index to datetime64, since xarray will do this anyway when writing to a netcdf
-        # This way, it is cleaner and I can use the same cf_table.
-        seconds = seconds.to_numpy()
-        seconds = seconds.astype("datetime64[s]")
-        data.index = seconds
-        data.index.name = None
+    # Make a new index for the dataframe, by taking the starttime into account.
 
-        # olc code:
-        # data.index = np.round(data.index * 3600 + startdate.timestamp()).astype(int)
-        # data.index.name = None
+    seconds = np.round(index * 3600 + startdate.timestamp()).astype(int)
+    if cachefile is not None:
+        _write_cache(cachefile, np.column_stack([seconds, data.to_numpy()]))
 
-        return data
+    # I am converting the index to datetime64, since xarray will do this anyway when writing to a netcdf
+    # This way, it is cleaner and I can use the same cf_table.
+    seconds = seconds.astype("datetime64[s]")
+    data.index = seconds
+    data.index.name = None
+
+    # olc code:
+    # data.index = np.round(data.index * 3600 + startdate.timestamp()).astype(int)
+    # data.index.name = None
+
+    return data
+
+
+def _cache_file(fiile, version: str, cache_dir) -> str:
+    """
+    The name of the cache file of a ts-file, <source>-<state>.npy. The source part is the same for all versions of
+    the ts-file (path), the state part changes with the size and modification time of the file.
+    """
+
+    stat = os.stat(fiile)
+    source = hashlib.sha1(f"{os.path.abspath(fiile)}:{version}".encode()).hexdigest()
+    state = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+    return f"{cache_dir}/{source}-{state}.npy"
+
+
+def _write_cache(cachefile: str, table: np.ndarray):
+    # write to a temporary file first, so that other processes never read a partially written file.
+    os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+    tmpfile = f"{cachefile}.{os.getpid()}.tmp"
+    with open(tmpfile, "wb") as f:
+        np.save(f, table)
+    os.replace(tmpfile, cachefile)
+
+    # remove the entries of older versions of the same ts-file.
+    name = os.path.basename(cachefile)
+    source = name.split("-")[0]
+    with os.scandir(os.path.dirname(cachefile)) as entries:
+        for entry in entries:
+            if entry.name.startswith(f"{source}-") and entry.name.endswith(".npy") and entry.name != name:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(entry.path)
 
 
 def read_headinfo(tsfile1):
@@ -183,25 +395,511 @@ def read_headinfo(tsfile1):
         head = myfile.readline().rstrip(
             "\n"
         )  # contains information like station height, station name, startdate
-        head_elements = [x for x in head.split(" ") if x]
-        hgt = head_elements[-3]
-
-        if len(head_elements) == 18:
-            lat = head_elements[7].strip(",")
-            lon = head_elements[8].strip(")")
-            version = "new"
-        elif len(head_elements) == 17:
-            lat = head_elements[6].strip(",")
-            lon = head_elements[7].strip(")")
-            version = "old"
+
+    return _parse_header(head)
+
+
+def _parse_header(head: str):
+    head_elements = [x for x in head.split(" ") if x]
+    hgt = head_elements[-3]
+
+    if len(head_elements) == 18:
+        lat = head_elements[7].strip(",")
+        lon = head_elements[8].strip(")")
+        version = "new"
+    elif len(head_elements) == 17:
+        lat = head_elements[6].strip(",")
+        lon = head_elements[7].strip(")")
+        version = "old"
+    else:
+        print("The Version of the tslist-file is unknown")
+        raise IndexError
+
+    return {"hgt": hgt, "lat": lat, "lon": lon}, version
+
+
+def _parse_startdate(head: str) -> dt.datetime:
+    # this adds the timezone info. DLeuk, 30.08.2021
+    return dt.datetime.strptime(head.split(" ")[-1] + "-+0000", "%Y-%m-%d_%H:%M:%S-%z")
+
+
+def _station_index(directory) -> dict:
+    """
+    Lists the ts-files of one tsfiles* folder and reads the header of each location and domain once.
+
+    Returns: a dictionary {(location, domain): station}. Each station holds the files per variable ("files"),
+    the header information (hgt, lat, lon), the version of the files and the start date.
+    """
+
+    index = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            parts = entry.name.split(".")
+            if len(parts) != 3 or not entry.is_file():
+                continue
+            loc, dom, var_element = parts
+            station = index.setdefault((loc, dom), {"files": {}})
+            station["files"][var_element] = f"{directory}/{entry.name}"
+
+    for station in index.values():
+        with open(min(station["files"].values()), "r") as myfile:
+            head = myfile.readline().rstrip("\n")
+        attrs, station["version"] = _parse_header(head)
+        station.update(attrs)
+        station["startdate"] = _parse_startdate(head)
+
+    return index
+
+
+def _read_location(stations: list, offsets: Union[dict, None] = None, cache_dir=None) -> dict:
+    """
+    Reads all ts-files of one location and domain.
+
+    Args:
+        stations: the entries of the station index (see _station_index) of this location and domain, one for each
+        tsfiles* folder that contains data of the location.
+        offsets: if given, only the files in offsets are read, starting at the offset (in bytes) of each file.
+        cache_dir: see read_files.
+
+    Returns: a dictionary with one DataFrame (profile variables) or Series (surface variables) per variable.
+    Variables without any data are left out.
+    """
+
+    # now read all files belonging to the same loc+dom and write into the dictionary
+    data = {}
+    for var_element in _VARLIST:
+        all_files = [
+            (station["files"][var_element], station) for station in stations if var_element in station["files"]
+        ]
+        if offsets is not None:
+            all_files = [(i, station) for i, station in all_files if i in offsets]
+        if len(all_files) == 0:
+            continue
+
+        data_df = pd.concat(
+            [
+                read_files(i, var_element, station["version"], offsets[i] if offsets else 0, cache_dir,
+                           station["startdate"])
+                for i, station in all_files
+            ]
+        )
+        data_df = data_df[~data_df.index.duplicated(keep="first")].sort_index()
+        if var_element == "TS":  # for surface file: variables are written into columns
+            for col in data_df.columns:
+                data[col] = data_df[col]
+        else:
+            data[var_element] = data_df
+
+    return data
+
+
+def _variable_layout(all_stations: list) -> dict:
+    """
+    Collects the columns of all variables that any of the locations has files for. The profile variables are sized
+    from the first data line of one file each.
+
+    Args:
+        all_stations: list with the stations of each location and domain (see _read_location).
+
+    Returns: a dictionary with the columns of each variable, i.e. {"UU": [1, ..., 30], "TS": ["T2", ...]}.
+    """
+
+    layout = {}
+    for station in itertools.chain(*all_stations):
+        for var_element, fiile in station["files"].items():
+            if var_element == "TS":
+                columns = layout.setdefault("TS", [])
+                columns.extend(item for item in _TS_NAMES[station["version"]][1:] if item not in columns)
+            elif var_element in _VARLIST and var_element not in layout:
+                with open(fiile, "r") as myfile:
+                    myfile.readline()
+                    layout[var_element] = list(range(1, len(myfile.readline().split())))
+    return layout
+
+
+def _pad_location(data: dict, layout: dict) -> dict:
+    """
+    Adds the variables in layout that are missing in the data of one location (see _read_location), filled with NaN.
+    """
+
+    time = next(iter(data.values())).index
+    for var_element, columns in layout.items():
+        if var_element == "TS":
+            for col in columns:
+                if col not in data:
+                    data[col] = pd.Series(np.nan, index=time)
+        elif var_element not in data:
+            data[var_element] = pd.DataFrame(np.nan, index=time, columns=columns)
+    return data
+
+
+def _iter_locations(pool, all_stations: list, prefetch: int = 1, offsets=None, cache_dir=None):
+    """
+    Yields the data of each location and domain in all_stations, in this order.
+
+    Args:
+        pool: a ProcessPoolExecutor or None to read serially.
+        all_stations: list with the stations of each location and domain (see _read_location).
+        prefetch: number of locations that are read ahead. Limits the memory in use.
+        offsets, cache_dir: see _read_location.
+    """
+
+    if pool is None:
+        for stations in all_stations:
+            yield _read_location(stations, offsets, cache_dir)
+        return
+
+    pending = collections.deque()
+    for stations in all_stations:
+        pending.append(pool.submit(_read_location, stations, offsets, cache_dir))
+        if len(pending) >= prefetch:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _read_times(stations: list, cache_dir=None) -> pd.Index:
+    """
+    Reads the times of one location and domain from the (small) TS-files.
+    """
+
+    times = [
+        read_files(station["files"]["TS"], "TS", station["version"], cache_dir=cache_dir,
+                   startdate=station["startdate"]).index
+        for station in stations
+    ]
+    return functools.reduce(pd.Index.union, times)
+
+
+def _station_dataset(data: dict, metadata: dict, cf_table) -> xr.Dataset:
+    """
+    Converts the data of one location (see _read_location) into a dataset with cf attributes.
+    """
+
+    xxa = xr.Dataset(data)
+    if "UU" in xxa and "VV" in xxa:
+        ff, dd = uv_to_FFDD(xxa["UU"], xxa["VV"])
+        xxa = xxa.assign({"WSP": ff})
+        xxa = xxa.assign({"DIR": dd})
+
+    if "U10" in xxa and "V10" in xxa:
+        ff10, dd10 = uv_to_FFDD(xxa["U10"], xxa["V10"])
+        xxa = xxa.assign({"WSP10": ff10})
+        xxa = xxa.assign({"DIR10": dd10})
+
+    names = {
+        "UU": "U",
+        "VV": "V",
+        "PH": "ALT",
+        "PR": "PRES",
+        "WW": "W",
+        "TH": "PT",
+        "dim_0": "time",
+        "dim_1": "model_level",
+    }
+    # variables without files are not in data.
+    xxa = xxa.rename({key: value for key, value in names.items() if key in xxa.variables or key in xxa.dims})
+
+    return assign_cf_attributes_tslist(xxa, metadata, cf_table)
+
+
+def _expand_station_dim(xxa: xr.Dataset) -> xr.Dataset:
+    """
+    Turns the scalar station_name coordinate into a dimension of length one. lat, lon and station_elevation
+    are stored along this dimension as well.
+    """
+
+    return _broadcast_station_coords(xxa.expand_dims("station_name"))
+
+
+def _broadcast_station_coords(xxa: xr.Dataset) -> xr.Dataset:
+    """
+    Stores lat, lon and station_elevation along station_name, if they are scalars.
+    """
+
+    for item in ["lat", "lon", "station_elevation"]:
+        if "station_name" not in xxa[item].dims:
+            values = np.full(xxa.sizes["station_name"], xxa[item].item())
+            xxa = xxa.assign_coords({item: ("station_name", values, xxa[item].attrs)})
+    return xxa
+
+
+def _concat_stations(all_xxa: list) -> xr.Dataset:
+    """
+    Concatenates the datasets of all stations (see _station_dataset) along station_name.
+    """
+
+    all_data = xr.concat(all_xxa, dim="station_name", join="outer")
+    all_data = all_data.set_index({"station_name": "station_name"})
+    all_data = all_data.set_coords(
+        ["lat", "lon", "station_elevation", "station_name"]
+    )
+    return all_data
+
+
+def _append_along_dim(filename: Union[str, os.PathLike], data: xr.Dataset, dim: str, start=None):
+    """
+    Appends data to an existing ncdf file along the unlimited dimension dim. All variables in the file that have
+    the dimension dim are extended, all other dimensions of data must match the file.
+
+    Args:
+        filename: the ncdf file, created with unlimited_dims=[dim]
+        data: dataset with the same variables as the file.
+        dim: the unlimited dimension.
+        start: index along dim at which data is written. Existing values are overwritten. Default: the end of dim.
+    """
+
+    if _is_zarr(filename):
+        _append_zarr(filename, data, dim, start)
+        return
+
+    with netCDF4.Dataset(filename, mode="a") as nc:
+        start = nc.dimensions[dim].size if start is None else start
+        for name, var in nc.variables.items():
+            if dim not in var.dimensions or name not in data.variables:
+                continue
+            values = data[name].transpose(*var.dimensions).values
+            if values.dtype.kind == "M":
+                values = _encode_times(values, var.units)
+                if var.dtype.kind in "iu" and not np.all(values == np.round(values)):
+                    raise ValueError(f"The times cannot be stored in {name} of {filename} ({var.units}).")
+            index = tuple(
+                slice(start, start + values.shape[i]) if item == dim else slice(None)
+                for i, item in enumerate(var.dimensions)
+            )
+            var[index] = values
+
+
+def _is_zarr(filename: Union[str, os.PathLike]) -> bool:
+    return str(filename).endswith(_EXTENSIONS["zarr"])
+
+
+def _is_unlimited(filename: Union[str, os.PathLike], dim: str) -> bool:
+    """
+    Checks if data can be appended to filename along dim. All dimensions of a zarr store can be extended.
+    """
+
+    if _is_zarr(filename):
+        return True
+
+    with netCDF4.Dataset(filename, mode="r") as nc:
+        return nc.dimensions[dim].isunlimited()
+
+
+def _to_file(data: xr.Dataset, filename: Union[str, os.PathLike], unlimited_dims=None, encoding=None,
+             settings=None):
+    """
+    Writes data to a new ncdf file or, if filename ends with .zarr, a zarr store. Existing files are replaced.
+
+    Args:
+        data: the dataset.
+        filename: the ncdf file or zarr store.
+        unlimited_dims: unlimited dimensions of the ncdf file. Ignored for zarr stores.
+        encoding: encoding per variable, i.e. {"time": {"units": "minutes since 2020-05-17"}}.
+        settings: compression and chunks of the data variables, see _build_encoding.
+    """
+
+    zarr_store = _is_zarr(filename)
+    unlimited_dims = unlimited_dims or []
+    encoding = encoding or {}
+    default = _build_encoding(data, settings, zarr_store, [] if zarr_store else unlimited_dims)
+    encoding = {name: {**default.get(name, {}), **encoding.get(name, {})} for name in set(default) | set(encoding)}
+
+    if zarr_store:
+        _zarr_strings(data).to_zarr(filename, mode="w", encoding=encoding)
+    else:
+        data.to_netcdf(filename, mode="w", unlimited_dims=unlimited_dims, encoding=encoding)
+
+
+def _build_encoding(data: xr.Dataset, settings=None, zarr_store=False, unlimited_dims=()) -> dict:
+    """
+    Translates the encoding settings into the encoding of each data variable, for to_netcdf or to_zarr.
+
+    Args:
+        data: the dataset.
+        settings: a dictionary with
+            complevel: compression level (0-9). 0 means no compression.
+            shuffle: if True, the bytes are shuffled before compression.
+            float32: if True, floats are stored in single precision.
+            chunks: chunk length per dimension, i.e. {"station_name": 1, "time": 8192}. Dimensions that are not
+            listed (or None) are not split.
+            variables: settings for single variables, i.e. {"U": {"float32": True}}.
+        Missing entries are taken from _DEFAULT_ENCODING.
+        zarr_store: if True, the encoding is built for zarr (Blosc/zstd compression), otherwise for ncdf (zlib).
+        unlimited_dims: dimensions that grow later. All other chunks are limited to the size of the dimension.
+
+    Returns: the encoding of each data variable.
+    """
+
+    settings = settings or {}
+    if zarr_store and zarr is None:
+        print("The zarr backend requires the package zarr. Install zarr or use the netcdf backend.")
+        raise ImportError
+
+    encoding = {}
+    for name, var in data.data_vars.items():
+        if var.ndim == 0:
+            continue
+        item = {**_DEFAULT_ENCODING, **settings, **settings.get("variables", {}).get(name, {})}
+        item["chunks"] = {**_DEFAULT_ENCODING["chunks"], **(item["chunks"] or {})}
+
+        chunks = []
+        for dim in var.dims:
+            length = item["chunks"].get(dim) or var.sizes[dim]
+            if dim not in unlimited_dims and not zarr_store:
+                length = min(length, var.sizes[dim])
+            chunks.append(max(int(length), 1))
+
+        encoding[name] = {"dtype": "float32"} if item["float32"] and var.dtype.kind == "f" else {}
+        if not zarr_store:
+            encoding[name].update(zlib=item["complevel"] > 0, complevel=item["complevel"], shuffle=item["shuffle"],
+                                  chunksizes=tuple(chunks))
+            continue
+
+        encoding[name]["chunks"] = tuple(chunks)
+        if int(zarr.__version__.split(".")[0]) >= 3:
+            codec = zarr.codecs.BloscCodec(cname="zstd", clevel=item["complevel"],
+                                           shuffle="shuffle" if item["shuffle"] else "noshuffle")
+            encoding[name]["compressors"] = [codec] if item["complevel"] > 0 else None
         else:
-            print("The Version of the tslist-file is unknown")
-            raise IndexError
+            import numcodecs
+            codec = numcodecs.Blosc(cname="zstd", clevel=item["complevel"],
+                                    shuffle=numcodecs.Blosc.SHUFFLE if item["shuffle"] else numcodecs.Blosc.NOSHUFFLE)
+            encoding[name]["compressor"] = codec if item["complevel"] > 0 else None
+
+    return encoding
+
+
+def _zarr_strings(data: xr.Dataset) -> xr.Dataset:
+    # fixed width strings cannot be extended by longer strings, i.e. station names. Store these with variable width.
+    strings = {name: data[name].astype(object) for name in data.coords if data[name].dtype.kind == "U"}
+    return data.assign_coords(strings)
+
+
+def _append_zarr(filename: Union[str, os.PathLike], data: xr.Dataset, dim: str, start=None):
+    """
+    Same as _append_along_dim for zarr stores. Values from start to the end of dim are overwritten, the remaining
+    values are appended. Only the chunks that contain these values are written.
+    """
+
+    with xr.open_dataset(filename, engine="zarr") as old:
+        size = old.sizes[dim]
+    start = size if start is None else start
+
+    data = _zarr_strings(data)
+    data = data.drop_vars([name for name in data.variables if dim not in data[name].dims])
+    overlap = min(max(size - start, 0), data.sizes[dim])
+    if overlap > 0:
+        data.isel({dim: slice(0, overlap)}).to_zarr(filename, region={dim: slice(start, start + overlap)})
+    if data.sizes[dim] > overlap:
+        data.isel({dim: slice(overlap, None)}).to_zarr(filename, append_dim=dim)
+
+
+def _encode_times(values: np.ndarray, units: str) -> np.ndarray:
+    """
+    Converts datetime64 values to numbers, i.e. for units = 'seconds since 2020-05-17 00:00:03'.
+    """
+
+    step, reference = units.split(" since ")
+    step = {"days": "D", "hours": "h", "minutes": "m", "seconds": "s", "milliseconds": "ms",
+            "microseconds": "us", "nanoseconds": "ns"}[step]
+    return (values - np.datetime64(pd.Timestamp(reference))) / np.timedelta64(1, step)
 
-        return {"hgt": hgt, "lat": lat, "lon": lon}, version
 
+def _read_manifest(filename: Union[str, os.PathLike]) -> dict:
+    """
+    The manifest lists the size (in bytes) of all ts-files that have been merged, per tsfiles* folder.
+    """
+
+    if not os.path.isfile(filename):
+        return {}
+
+    with open(filename, "r") as f:
+        return yaml.safe_load(f) or {}
 
-def merge_tslist_files(indir, outdir, location, domain, proj_name: str, exp_name: str, institution="-"):
+
+def _new_offsets(indir: list, index: list, keys: list, manifest: dict):
+    """
+    Compares the ts-files of the locations and domains in keys with the manifest.
+
+    Returns: the offsets of all files with data that has not been merged yet and the updated manifest.
+    """
+
+    offsets = {}
+    new_manifest = dict(manifest)
+    for directory, stations in zip(indir, index):
+        dirname = os.path.basename(str(directory))
+        merged = manifest.get(dirname, {})
+        sizes = dict(merged)
+        for key in keys:
+            for fiile in stations.get(key, {"files": {}})["files"].values():
+                name = os.path.basename(fiile)
+                sizes[name] = os.path.getsize(fiile)
+                if sizes[name] > merged.get(name, 0):
+                    offsets[fiile] = merged.get(name, 0)
+        new_manifest[dirname] = sizes
+
+    return offsets, new_manifest
+
+
+def _has_data(data: xr.Dataset) -> xr.DataArray:
+    """
+    Returns: True for each station and time step at which any variable of data has a value.
+    """
+
+    valid = [
+        var.notnull().any([dim for dim in var.dims if dim not in ["station_name", "time"]])
+        for var in data.data_vars.values() if "time" in var.dims
+    ]
+    return functools.reduce(np.logical_or, valid).transpose("station_name", "time")
+
+
+def _merge_increment(outfile: str, new: xr.Dataset, encoding=None):
+    """
+    Merges new data into an existing raw file. Data that is already in the file is kept. Stations that are not in
+    the file yet are added with all their time steps. New time steps after the end of the file are appended,
+    otherwise the file is rewritten.
+
+    Returns: the first time step that changed, or None.
+    """
+
+    unlimited = _is_unlimited(outfile, "time")
+
+    with xr.open_dataset(outfile) as old:
+        old_time = old.time.values
+        stations = old.station_name.values
+
+        # a time step has been merged for a station if the file holds data of the station at this time. Other
+        # stations may have extended the time axis of the file before, so the time axis alone does not tell.
+        known = new.station_name.values[np.isin(new.station_name.values, stations)]
+        overlap = new.time.values[np.isin(new.time.values, old_time)]
+        merged = _has_data(old.sel(station_name=known, time=overlap)).reindex(
+            station_name=new.station_name, time=new.time, fill_value=False
+        )
+        new = new.isel(time=(_has_data(new) & ~merged).any("station_name").values)
+        if new.sizes["time"] == 0:
+            return None
+        since = new.time.values.min()
+
+        append = unlimited and since > old_time[-1] and np.isin(new.station_name.values, stations).all()
+        if not append:
+            old = old.load()
+
+    if append:
+        _append_along_dim(outfile, new.reindex(station_name=stations), "time")
+        return since
+
+    if old.lat.dims != new.lat.dims:
+        old, new = _broadcast_station_coords(old), _broadcast_station_coords(new)
+
+    all_data = old.combine_first(new)
+    _to_file(all_data, outfile, ["time"], settings=encoding)
+
+    return since
+
+
+def merge_tslist_files(indir, outdir, location, domain, proj_name: str, exp_name: str, institution="-", workers=1,
+                       streaming=False, incremental=False, cache=False, backend="netcdf", encoding=None):
     """
     This function will take all ts-files and merge all variables belonging one domain into a ncdf.
     This is done for all stations (locations). These files are concated together.
@@ -215,8 +913,22 @@ def merge_tslist_files(indir, outdir, location, domain, proj_name: str, exp_name
         proj_name: name of the project. May be None. For metadata
         exp_name: name of the experiment. For metadata
         institution: for metadata.
-
-    Returns: None.
+        workers: number of processes used to read the ts-files. Each process reads all files of one location and
+        domain. The output does not depend on this number.
+        streaming: if True, the stations are written to the ncdf one at a time, so that only one station per
+        worker is kept in memory. lat, lon and station_elevation are always stored along station_name.
+        incremental: if True, the size of all merged ts-files is recorded in a manifest (.raw_tslist_dXX.yaml)
+        next to the ncdf. In the next call, only data that has been added since is read and merged into the ncdf.
+        This assumes that ts-files only grow, i.e. merged data is not changed afterwards.
+        cache: if True, parsed ts-files are stored in outdir/.tscache and reused in later calls, as long as the
+        size and modification time of the ts-file are unchanged. The cache may be deleted at any time.
+        backend: "netcdf" or "zarr". Zarr stores (raw_tslist_dXX.zarr) are chunked per station and along time, so
+        new data is appended without rewriting the store and single stations are read quickly. Requires zarr.
+        encoding: compression, shuffle, single precision and chunks of the data variables, for all variables or
+        per variable, i.e. {"complevel": 4, "variables": {"U": {"float32": True}}}. See _build_encoding. By
+        default, data is compressed and chunked per station, so a time series of one station is read quickly.
+
+    Returns: a dictionary with the ncdf files that have been written and the first time step that changed in each.
     Ncdf is written to outdir
     """
 
@@ -236,163 +948,285 @@ def merge_tslist_files(indir, outdir, location, domain, proj_name: str, exp_name
 
     cf_table = res_path / 'cf_table_wrfdata.yaml'
 
+    if backend not in _EXTENSIONS:
+        print(f"Unknown backend {backend}. Use one of {list(_EXTENSIONS)}.")
+        raise ValueError
+
     # check if indir is one folder or a list of folders
     indir = indir if isinstance(indir, list) else list(indir)
     if len(indir) == 0:
-        return
-
-    # find all files in given folder
-    ts_files = [glob.glob(f"{directory}/*") for directory in indir]
-    ts_files = list(itertools.chain(*ts_files))  # put these files into a list
-    loclist = (
-        [f.split("/")[-1].split(".")[0] for f in ts_files]
-        if location is None
-        else [location]
-    )
-    loclist = list(set(loclist))
-    domainlist = (
-        [f.split("/")[-1].split(".")[1] for f in ts_files]
-        if domain is None
-        else [domain]
-    )
-    domainlist = list(set(domainlist))
-
-    varlist = ["UU", "VV", "PH", "WW", "TH", "TS", "PR", "QV"]
-
-    # initialize empty dictionary to write data to
-    all_xxr = {}
-    attrs_dict = {}
-    for loc in loclist:
-        # read one file for header information
-        fi = str(indir[0]) + f"/{loc}.d01.UU"
-        attrs_dict[f"{loc}"], version = read_headinfo(fi)
-
+        return {}
+
+    # find all files in given folders. The header of each location and domain is read only once per folder.
+    index = [_station_index(directory) for directory in indir]
+    all_keys = set(itertools.chain(*index))
+    loclist = sorted({loc for loc, dom in all_keys}) if location is None else [location]
+    domainlist = sorted({dom for loc, dom in all_keys}) if domain is None else [domain]
+
+    # read all files belonging to the same loc+dom, in parallel if desired, and write out one ncdf per domain.
+    cache_dir = f"{outdir}/.tscache" if cache else None
+    changed = {}
+    with ProcessPoolExecutor(max_workers=workers) if workers > 1 else contextlib.nullcontext() as pool:
         for dom in domainlist:
-            all_xxr[f"{loc}.{dom}"] = {
-                "UU": None,
-                "VV": None,
-                "PH": None,
-                "WW": None,
-                "TH": None,
-                "QV": None,
-                "PR": None,
-                "U10": None,
-                "V10": None,
-                "PSFC": None,
-                "GLW": None,
-                "GSW": None,
-                "HFX": None,
-                "LH": None,
-                "TSK": None,
-            }
-
-            # now read all files belonging to the same loc+dom and write into the dictionary
-            for var_element in varlist:
-                all_files = [
-                    f"{directory}/{loc}.{dom}.{var_element}" for directory in indir
-                ]
-                data_df = pd.concat(
-                    [read_files(i, var_element, version) for i in all_files]
-                )
-                data_df = data_df[~data_df.index.duplicated(keep="first")].sort_index()
-                all_xxr[f"{loc}.{dom}"][var_element] = data_df
-                if (
-                        var_element == "TS"
-                ):  # for surface file: variables are written into columns
-                    for col in data_df.columns:
-                        all_xxr[f"{loc}.{dom}"][col] = data_df[col]
-
-                    all_xxr[f"{loc}.{dom}"].pop(
-                        "TS"
-                    )  # drop the TS, because it has been splitted
-
-    # writing out ncdf for all combinations of location and domain.
-
-    for dom in domainlist:
-
-        metadata = dict()
-        metadata["Conventions"] = "CF-1.8"
-        metadata["featureType"] = "timeSeriesProfile"
-
-        metadata["title"] = "time series extracted from model"
-        metadata["institution"] = institution
-        metadata["source"] = "WRF-Model"
-        metadata[
-            "references"
-        ] = f"Project {proj_name}, Experiment {exp_name}, domain {dom}"
-        metadata["comment"] = "raw data"
-
-        all_xxa = []
-        for loc in loclist:
-
-            metadata["station_name"] = loc
-            metadata["lat"] = float(attrs_dict[f"{loc}"]["lat"])
-            metadata["lon"] = float(attrs_dict[f"{loc}"]["lon"])
-            metadata["station_elevation"] = float(attrs_dict[f"{loc}"]["hgt"])
-
-            xxa = xr.Dataset(all_xxr[f"{loc}.{dom}"])
-            if "UU" in xxa and "VV" in xxa:
-                ff, dd = uv_to_FFDD(xxa["UU"], xxa["VV"])
-                xxa = xxa.assign({"WSP": ff})
-                xxa = xxa.assign({"DIR": dd})
-
-            if "U10" in xxa and "V10" in xxa:
-                ff10, dd10 = uv_to_FFDD(xxa["U10"], xxa["V10"])
-                xxa = xxa.assign({"WSP10": ff10})
-                xxa = xxa.assign({"DIR10": dd10})
-
-            xxa = xxa.rename(
-                {
-                    "UU": "U",
-                    "VV": "V",
-                    "PH": "ALT",
-                    "PR": "PRES",
-                    "WW": "W",
-                    "TH": "PT",
-                    "dim_0": "time",
-                    "dim_1": "model_level",
-                }
-            )
-
-            xxa = assign_cf_attributes_tslist(xxa, metadata, cf_table)
-            all_xxa.append(xxa)
 
-        all_data = xr.concat(all_xxa, dim="station_name")
-        all_data = all_data.set_index({"station_name": "station_name"})
-        all_data = all_data.set_coords(
-            ["lat", "lon", "station_elevation", "station_name"]
-        )
-
-        all_data.to_netcdf(f"{outdir}/raw_tslist_{dom}.nc", mode="w")
-
-    return
-
-
-def average_ts_files(infile: str, timeavg: list):
+            keys = [(loc, dom) for loc in loclist if (loc, dom) in all_keys]
+            if len(keys) == 0:
+                continue
+            stations = {key: [item[key] for item in index if key in item] for key in keys}
+
+            metadata = dict()
+            metadata["Conventions"] = "CF-1.8"
+            metadata["featureType"] = "timeSeriesProfile"
+
+            metadata["title"] = "time series extracted from model"
+            metadata["institution"] = institution
+            metadata["source"] = "WRF-Model"
+            metadata[
+                "references"
+            ] = f"Project {proj_name}, Experiment {exp_name}, domain {dom}"
+            metadata["comment"] = "raw data"
+
+            outfile = f"{outdir}/raw_tslist_{dom}{_EXTENSIONS[backend]}"
+            manifest_file = f"{outdir}/.raw_tslist_{dom}.yaml"
+
+            # In incremental mode, only data that is not listed in the manifest is read (offsets).
+            # Without a manifest (or raw file), everything is read and the raw file is written from scratch.
+            offsets, manifest = None, None
+            if incremental:
+                manifest = _read_manifest(manifest_file) if os.path.exists(outfile) else {}
+                offsets, new_manifest = _new_offsets(indir, index, keys, manifest)
+                if len(offsets) == 0:
+                    continue
+                offsets = offsets if manifest else None
+                manifest = new_manifest
+
+            unlimited_dims = ["time"] if incremental else []
+            all_stations = [stations[key] for key in keys]
+            station_data = _iter_locations(pool, all_stations, max(workers, 1), offsets, cache_dir)
+
+            time = None
+            if streaming and offsets is None:
+                # the time axis and the variables of the file must be known before the first station is written.
+                layout = _variable_layout(all_stations)
+                args = [(item, cache_dir) for item in all_stations]
+                times = pool.map(_read_times, *zip(*args)) if pool else itertools.starmap(_read_times, args)
+                time = functools.reduce(pd.Index.union, times)
+
+            all_xxa = []
+            for (loc, dom), data in zip(keys, station_data):
+
+                if len(data) == 0:  # no new data for this location
+                    continue
+
+                metadata["station_name"] = loc
+                metadata["lat"] = float(stations[(loc, dom)][0]["lat"])
+                metadata["lon"] = float(stations[(loc, dom)][0]["lon"])
+                metadata["station_elevation"] = float(stations[(loc, dom)][0]["hgt"])
+
+                if time is not None:
+                    data = _pad_location(data, layout)
+                xxa = _station_dataset(data, metadata, cf_table)
+                del data
+
+                if time is None:
+                    all_xxa.append(xxa)
+                    continue
+
+                xxa = _expand_station_dim(xxa.reindex(time=time))
+                if (loc, dom) == keys[0]:
+                    _to_file(xxa, outfile, ["station_name"] + unlimited_dims, settings=encoding)
+                else:
+                    _append_along_dim(outfile, xxa, "station_name")
+
+            if offsets is not None:
+                since = _merge_increment(outfile, _concat_stations(all_xxa), encoding) if all_xxa else None
+            elif time is None:
+                all_data = _concat_stations(all_xxa)
+                _to_file(all_data, outfile, unlimited_dims, settings=encoding)
+                since = all_data.time.values[0]
+            else:
+                since = time.values[0]
+
+            if incremental:
+                with open(manifest_file, "w") as f:
+                    yaml.safe_dump(manifest, f)
+            if since is not None:
+                changed[outfile] = since
+
+    return changed
+
+
+def average_ts_files(infile: str, timeavg: list, since=None, chunks=None, encoding=None):
     """
     Averaging of the raw-files. Closed is right, but labels are left.
     This works since the raw*file usually miss the very first value.
     I.e. raw file from 00:00:03 to 00:15:00. Then the 5 min. mean
     takes from 00:00:03 to 00:04:59 and labels this to 00:00:00.
     Be careful when the first value is available!
+
+    The raw file is read only once for all averaging intervals (see _cascaded_means).
     Args:
-        infile: raw_tslist_dXX.nc file
+        infile: raw_tslist_dXX.nc file or raw_tslist_dXX.zarr store. The averages are written in the same format.
         timeavg: list of times in minutes
+        since: first time step of infile that changed (see merge_tslist_files). If given, only the averages from
+        this time on are recomputed and written into the existing files. These are written with an unlimited time
+        dimension.
+        chunks: if given, the raw file is read in blocks of about this many time steps, which are averaged and
+        written one after the other. Blocks are aligned to all averaging windows. Use this for raw files that do not
+        fit into memory. Files are written with an unlimited time dimension.
+        encoding: compression and chunks of the averaged data, see merge_tslist_files.
 
     Returns:
         netcdf with averaged data.
     """
 
     if len(timeavg) > 0:
-        for time in timeavg:
-            xxa = xr.open_dataset(infile)
-            xxatme = xxa.resample(time=f"{time}Min", label="left", closed="right").mean(
-                keep_attrs=True
-            )
-            xxatme.attrs = xxa.attrs
-            xxatme.attrs["comment"] = f"{time}-minute averaged data"
-            xxatme.time.attrs = {"standard_name": "time", "long_name": "time"}
-            xxatme.to_netcdf(infile.replace("raw", f"Ave{time}Min"), mode="w")
-            xxa.close()
+        # windows may be given as strings, i.e. from the command line.
+        timeavg = [int(time) for time in timeavg]
+        outfiles = {time: infile.replace("raw", f"Ave{time}Min") for time in timeavg}
+
+        # label and index of the next window to be written, per averaging interval. New files are not listed.
+        position = {}
+        if since is not None:
+            for time in timeavg:
+                window = _first_changed_window(outfiles[time], since, time)
+                if window is not None:
+                    position[time] = window
+
+        xxa = xr.open_dataset(infile)
+        # windows are aligned to the start of the first day, like xarray's resample does.
+        origin = xxa.time.values[0].astype("datetime64[D]")
+
+        # only read the raw data that is needed for the first window that changed.
+        if len(position) == len(timeavg):
+            start = min(label for label, index in position.values())
+            xxa = xxa.isel(time=slice(np.searchsorted(xxa.time.values, start, side="right"), None))
+
+        unlimited_dims = ["time"] if since is not None or chunks is not None or _is_zarr(infile) else []
+        for block in _time_blocks(xxa.time.values, timeavg, origin, chunks):
+            for time, xxatme in _cascaded_means(xxa.isel(time=block), timeavg, origin).items():
+                xxatme.attrs = xxa.attrs
+                xxatme.attrs["comment"] = f"{time}-minute averaged data"
+                xxatme.time.attrs = {"standard_name": "time", "long_name": "time"}
+                step = np.timedelta64(time, "m")
+
+                if time not in position:
+                    # the time units must fit all windows that are appended later, not just the ones of this block.
+                    first = pd.Timestamp(xxatme.time.values[0])
+                    units = {"time": {"units": f"minutes since {first}"}} if unlimited_dims else None
+                    _to_file(xxatme, outfiles[time], unlimited_dims, units, encoding)
+                    position[time] = (xxatme.time.values[-1] + step, xxatme.sizes["time"])
+                    continue
+
+                # windows without any data between two blocks are filled with missing values.
+                label, index = position[time]
+                xxatme = xxatme.reindex(time=np.arange(label, xxatme.time.values[-1] + step, step))
+                if xxatme.sizes["time"] > 0:
+                    _append_along_dim(outfiles[time], xxatme, "time", start=index)
+                    position[time] = (xxatme.time.values[-1] + step, index + xxatme.sizes["time"])
+        xxa.close()
 
     return
+
+
+def _time_blocks(times: np.ndarray, timeavg: list, origin: np.datetime64, chunks=None) -> list:
+    """
+    Splits the time axis into blocks of about chunks time steps. Blocks start at the beginning of a window of the
+    least common multiple of timeavg, so no averaging window is split between two blocks.
+
+    Returns: a list of slices.
+    """
+
+    if chunks is None or len(times) == 0:
+        return [slice(None)]
+
+    length = np.timedelta64(functools.reduce(math.lcm, timeavg), "m").astype("timedelta64[ns]").astype(np.int64)
+    elapsed = (times - origin).astype("timedelta64[ns]").astype(np.int64)
+    windex = (elapsed - 1) // length
+    starts = np.flatnonzero(np.r_[True, windex[1:] != windex[:-1]])
+
+    # a new block begins with the first window that starts after another chunks time steps.
+    starts = starts[np.r_[True, np.diff(starts // chunks) > 0]]
+    edges = np.r_[starts, len(times)]
+    return [slice(int(first), int(last)) for first, last in zip(edges[:-1], edges[1:])]
+
+
+def _cascaded_means(xxa: xr.Dataset, timeavg: list, origin: np.datetime64) -> dict:
+    """
+    Averages all variables with a time dimension over windows of each length in timeavg (in minutes), with
+    windows closed right and labeled left, aligned to origin. Missing values are skipped.
+
+    Sums and counts are computed in a single pass over the data for the finest window (the greatest common divisor
+    of timeavg). Since the windows nest, all other windows are built from these sums and counts.
+
+    Returns: a dictionary with one dataset per entry in timeavg.
+    """
+
+    fine = functools.reduce(math.gcd, timeavg)
+    step = np.timedelta64(fine, "m").astype("timedelta64[ns]").astype(np.int64)
+
+    # window index k of each time step: origin + k * step < time <= origin + (k + 1) * step
+    elapsed = (xxa.time.values - origin).astype("timedelta64[ns]").astype(np.int64)
+    windex = (elapsed - 1) // step
+    first = int(windex[0])
+    windex = windex - first
+    starts = np.flatnonzero(np.r_[True, windex[1:] != windex[:-1]])
+    nwin = int(windex[-1]) + 1
+
+    sums, counts = {}, {}
+    for name, var in xxa.data_vars.items():
+        if "time" not in var.dims:
+            continue
+        values = np.moveaxis(var.values, var.get_axis_num("time"), 0)
+        valid = ~np.isnan(values)
+        sums[name] = np.zeros((nwin,) + values.shape[1:])
+        counts[name] = np.zeros((nwin,) + values.shape[1:], dtype=np.int64)
+        sums[name][windex[starts]] = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+        counts[name][windex[starts]] = np.add.reduceat(valid, starts, axis=0, dtype=np.int64)
+
+    template = xxa.drop_dims("time")
+    all_means = {}
+    for time in timeavg:
+        factor = time // fine
+        # pad the fine windows, so that groups of factor windows start on a multiple of the (coarse) window length.
+        lead = first % factor
+        trail = -(lead + nwin) % factor
+        nout = (lead + nwin + trail) // factor
+        labels = origin + ((first - lead) // factor + np.arange(nout)) * np.timedelta64(time, "m")
+
+        xxatme = template.assign_coords(time=labels.astype("datetime64[ns]"))
+        for name in sums:
+            var = xxa[name]
+            pad = [(lead, trail)] + [(0, 0)] * (var.ndim - 1)
+            shape = (nout, factor) + sums[name].shape[1:]
+            total = np.pad(sums[name], pad).reshape(shape).sum(axis=1)
+            count = np.pad(counts[name], pad).reshape(shape).sum(axis=1)
+            mean = np.divide(total, count, out=np.full(total.shape, np.nan), where=count > 0)
+            # like resample, time becomes the first dimension.
+            dims = ("time",) + tuple(dim for dim in var.dims if dim != "time")
+            xxatme[name] = xr.DataArray(mean, dims=dims, attrs=var.attrs)
+        all_means[time] = xxatme
+
+    return all_means
+
+
+def _first_changed_window(outfile: str, since, time: int):
+    """
+    Finds the first averaging window of an existing Ave-file that contains the time step since.
+
+    Returns: the label of this window and its index in outfile, or None if outfile must be recomputed as a whole.
+    """
+
+    if not os.path.exists(outfile) or not _is_unlimited(outfile, "time"):
+        return None
+
+    with xr.open_dataset(outfile) as ave:
+        labels = ave.time.values
+
+    # windows are closed right: a time step on the edge of a window belongs to the window before.
+    step = np.timedelta64(time, "m")
+    index = int(np.ceil((np.datetime64(since) - labels[0]) / step)) - 1
+    if index < 0 or index > len(labels):
+        return None
+
+    return labels[0] + index * step, index
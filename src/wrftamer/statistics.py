@@ -1,57 +1,622 @@
+import os
+import math
+import hashlib
+import threading
+import warnings
 import numpy as np
 import pandas as pd
 import xarray as xr
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-def _stat_calc(obs, mod):
-    bias = np.nanmean(mod - obs)
-    std_err = np.nanstd(mod - obs)
-    mae = np.nanmean(abs(mod - obs))
-    # mape = np.nanmean(abs((obs - mod) / mod)) * 100. # old def. leads to inf if mod==0.
 
-    tmp = abs((obs - mod) / mod)
-    tmp[np.isinf(tmp)] = np.nan
-    mape = np.nanmean(tmp) * 100
+def _stat_calc(obs, mod, work=None):
+    """
+    Statistics of one model time series vs. one observed time series. Time steps that are missing (NaN) in either
+    time series are left out.
 
-    # both obs and mod time series may contain Nan.
-    # For correlation calculation, sett all data to NaN that is NaN in either timeseries.
+    Args:
+        obs: observations.
+        mod: model data.
+        work: optional buffer with shape (4, n) with n >= len(obs), which is reused by consecutive calls (see
+        _work_buffer). Avoids allocating temporary arrays in every call.
 
-    tmp_obs = np.copy(obs)
-    tmp_mod = np.copy(mod)
+    Returns: bias, std_err, mae, r, mape and rmse.
+    """
 
-    tmp_obs[np.isnan(tmp_mod)] = np.nan
-    tmp_mod[np.isnan(tmp_obs)] = np.nan
+    obs, mod, diff, tmp = _joint_valid(obs, mod, work)
+    n = len(diff)
 
-    a = np.nansum((tmp_mod - np.nanmean(tmp_mod)) * (tmp_obs - np.nanmean(tmp_obs)))
-    b = np.sqrt(np.nansum((tmp_mod - np.nanmean(tmp_mod)) ** 2))
-    c = np.sqrt(np.nansum((tmp_obs - np.nanmean(tmp_obs)) ** 2))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bias = diff.sum() / n
+        np.subtract(diff, bias, out=tmp)
+        std_err = np.sqrt(np.dot(tmp, tmp) / n)
+        rmse = np.sqrt(np.dot(diff, diff) / n)
+        np.abs(diff, out=tmp)
+        mae = tmp.sum() / n
 
-    r = a / (b * c) * 100.0  # Pearson correlation coeff.
+        # mape = np.nanmean(abs((obs - mod) / mod)) * 100. # old def. leads to inf if mod==0.
+        # the relative error is left out where mod == 0.
+        np.abs(mod, out=diff)
+        np.divide(tmp, diff, out=tmp)
+        finite = np.isfinite(tmp)
+        mape = np.sum(tmp, where=finite) / np.count_nonzero(finite) * 100
 
-    rmse = np.sqrt(np.nanmean((tmp_obs - tmp_mod) ** 2))
+        obs -= obs.sum() / n
+        mod -= mod.sum() / n
+        a = np.dot(mod, obs)
+        b = np.sqrt(np.dot(mod, mod))
+        c = np.sqrt(np.dot(obs, obs))
+        r = a / (b * c) * 100.0  # Pearson correlation coeff.
 
     return bias, std_err, mae, r, mape, rmse
 
 
-def _stat_calc_dir(obs, mod):
-    tmp = mod - obs
-    tmp[tmp > 180] -= 360.0
-    tmp[tmp < -180] += 360.0
-    bias = np.nanmean(tmp)
-    std_err = np.nanstd(tmp)
-    mae = np.nanmean(abs(tmp))
+def _stat_calc_dir(obs, mod, work=None):
+    """
+    Same as _stat_calc for wind directions. The difference mod - obs is wrapped to [-180, 180] and used for all
+    statistics. r and mape are not defined.
+    """
+
+    obs, mod, diff, tmp = _joint_valid(obs, mod, work)
+    n = len(diff)
+
+    np.subtract(diff, 360.0, out=diff, where=diff > 180)
+    np.add(diff, 360.0, out=diff, where=diff < -180)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bias = diff.sum() / n
+        np.subtract(diff, bias, out=tmp)
+        std_err = np.sqrt(np.dot(tmp, tmp) / n)
+        rmse = np.sqrt(np.dot(diff, diff) / n)
+        np.abs(diff, out=tmp)
+        mae = tmp.sum() / n
 
     mape = np.nan
     r = np.nan
 
-    rmse = np.sqrt(np.nanmean((obs - mod) ** 2))
-
     return bias, std_err, mae, r, mape, rmse
 
 
+def _work_buffer(n: int) -> np.ndarray:
+    # buffer for _stat_calc and _stat_calc_dir for time series of up to n values
+    return np.empty((4, n))
+
+
+def _joint_valid(obs, mod, work=None):
+    """
+    Copies the time steps that are valid in both obs and mod to the work buffer.
+
+    Returns: views of the buffer: obs, mod, their difference mod - obs and a free row, all of the same length.
+    """
+
+    obs = np.asarray(obs, dtype=float)
+    mod = np.asarray(mod, dtype=float)
+    if work is None or work.shape[1] < len(obs):
+        work = _work_buffer(len(obs))
+
+    diff = np.subtract(mod, obs, out=work[2, : len(obs)])
+    valid = ~np.isnan(diff)
+    n = np.count_nonzero(valid)
+
+    np.compress(valid, obs, out=work[0, :n])
+    np.compress(valid, mod, out=work[1, :n])
+    np.subtract(work[1, :n], work[0, :n], out=work[2, :n])
+
+    return work[0, :n], work[1, :n], work[2, :n], work[3, :n]
+
+
+def _stat_calc_nd(obs: np.ndarray, mod: np.ndarray, is_dir=False, block=2 ** 16) -> np.ndarray:
+    """
+    Same as _stat_calc (or _stat_calc_dir if is_dir) for many time series at once. The statistics are computed
+    along the last axis (time), with the same handling of missing values as in _stat_calc.
+
+    All statistics follow from a few sums per time series (see _stat_sums), which are accumulated over blocks of
+    stations and time steps. The blocks are small enough to stay in the cache.
+
+    Args:
+        obs: observations, i.e. with shape (station, time).
+        mod: model data with the shape of obs and any leading dimensions, i.e. (mod, station, time).
+        is_dir: if True, the data is a wind direction.
+        block: number of values (of mod) that are processed at once.
+
+    Returns: an array with bias, std, mae, r, mape and rmse along the first axis, i.e. with shape (6, mod, station).
+    """
+
+    return StatAccumulator(is_dir).update(obs, mod, block).result()
+
+
+class StatAccumulator:
+    """
+    Accumulates the sums from which bias, std, mae, r, mape and rmse of model vs observation time series follow
+    (see _SUMS), in a single pass over the data. The data may be added in pieces along time, i.e. while tslist
+    data streams in, and accumulators of different pieces (chunks, workers, restart segments) may be merged.
+
+    Sums of squares and products are taken relative to a shift per station (the mean of the first observations),
+    which keeps them as accurate as the two-pass formulas of _stat_calc.
+
+    Additional metric sets (see _metric_settings) add their own sums, which are accumulated in the same pass.
+
+    Example:
+        acc = StatAccumulator()
+        for obs, mod in pieces:  # obs with shape (station, time), mod with shape (mod, station, time)
+            acc.update(obs, mod)
+        bias, std, mae, r, mape, rmse = acc.result()
+    """
+
+    def __init__(self, is_dir=False, shift=None, metrics=None):
+        """
+        Args:
+            is_dir: if True, the data is a wind direction (see _stat_calc_dir).
+            shift: the shift of each station. Default: the mean of the observations of the first update.
+            metrics: additional metric sets, see _metric_settings. Settings that depend on the data are taken from
+            the observations of the first update. Accumulators are only merged if their settings are the same, so
+            accumulators of different data that are merged later need explicit bins for the quantiles.
+        """
+
+        self.is_dir = is_dir
+        self.shift = None if shift is None else np.asarray(shift, dtype=float)
+        self.settings = _metric_settings(metrics)
+        self.sums = None
+        self.shape = None
+
+    def update(self, obs: np.ndarray, mod: np.ndarray, block=2 ** 16, groups=None, n_groups=None):
+        """
+        Adds time steps. obs has the shape (station, time) or (time, ), mod the shape of obs with any leading
+        dimensions, i.e. (mod, station, time). All updates must have the same shape except for time.
+
+        Optional: groups, an integer array with the shape of obs, assigns each time step to one of n_groups groups
+        (-1: none), for which the sums are accumulated separately. The results then have an additional last
+        dimension with n_groups groups.
+
+        Returns: the accumulator.
+        """
+
+        obs = np.asarray(obs, dtype=float)
+        mod = np.asarray(mod, dtype=float)
+        shape = mod.shape[:-1]
+        obs = obs.reshape(-1, obs.shape[-1])
+        mod = mod.reshape((-1,) + obs.shape)
+        if groups is not None:
+            groups = np.asarray(groups).reshape(obs.shape)
+            n_groups = int(groups.max()) + 1 if n_groups is None else n_groups
+            shape = shape + (n_groups,)
+
+        if self.shape is not None and shape != self.shape:
+            print(f"The shape {shape} does not match the shape {self.shape} of the accumulated data.")
+            raise ValueError
+        self.shape = shape
+
+        if self.shift is None:
+            total, count = _obs_sums(obs)
+            self.shift = total / np.maximum(count, 1)
+        if "quantiles" in self.settings and self.settings["quantiles"]["bins"] is None:
+            self.settings = _metric_settings(self.settings, obs)
+
+        sums = _block_sums(obs, mod, self.shift.reshape(-1), self.is_dir, block, groups, n_groups, self.settings)
+        self._add(sums)
+        return self
+
+    def merge(self, other: "StatAccumulator"):
+        """
+        Adds the sums of another accumulator of the same shape, i.e. of other time steps.
+
+        Returns: the accumulator.
+        """
+
+        if other.sums is None:
+            return self
+        if self.sums is None:
+            self.shift, self.shape, self.settings = other.shift, other.shape, other.settings
+        if other.shape != self.shape or other.is_dir != self.is_dir or (
+                self.sums is not None and other.sums.keys() != self.sums.keys()):
+            print("Only accumulators of the same shape, kind of variable and metrics can be merged.")
+            raise ValueError
+        if not _same_settings(self.settings, other.settings):
+            # i.e. histograms with bins taken from different observations.
+            print("Only accumulators with the same settings of the metrics (i.e. bins) can be merged.")
+            raise ValueError
+
+        # the shift is per station, which is followed by the groups, if any.
+        delta = self.shift.reshape(-1) - other.shift.reshape(-1)
+        delta = delta.reshape(delta.shape + (1,) * (other.sums["n"].ndim - 2))
+        self._add(_shift_sums(other.sums, delta))
+        return self
+
+    def result(self) -> np.ndarray:
+        """
+        Returns: an array with bias, std, mae, r, mape and rmse along the first axis, i.e. with shape
+        (6, mod, station) or (6, mod, station, group).
+        """
+
+        if self.sums is None:
+            print("No data has been added to the accumulator.")
+            raise ValueError
+
+        return _stats_from_sums(self.sums, self.is_dir).reshape((6,) + self.shape)
+
+    def metrics(self) -> dict:
+        """
+        Returns: the additional metrics (see _metric_settings) by name, each with the shape of the accumulator.
+        """
+
+        if self.sums is None:
+            print("No data has been added to the accumulator.")
+            raise ValueError
+
+        shift = self.shift.reshape(-1)
+        shift = shift.reshape(shift.shape + (1,) * (self.sums["n"].ndim - 2))
+        metrics = _metrics_from_sums(self.sums, shift, self.settings)
+        return {name: values.reshape(self.shape) for name, values in metrics.items()}
+
+    def _add(self, sums: dict):
+        if self.sums is None:
+            self.sums = {name: np.array(values, dtype=float) for name, values in sums.items()}
+        else:
+            for name in self.sums:
+                self.sums[name] += sums[name]
+
+
+def _same_settings(a, b) -> bool:
+    # compares settings of metrics (see _metric_settings), which may contain arrays.
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same_settings(a[key], b[key]) for key in a)
+    if a is None or b is None:
+        return a is b
+    return np.array_equal(np.asarray(a), np.asarray(b))
+
+
+def _shift_sums(sums: dict, delta: np.ndarray) -> dict:
+    """
+    Converts sums relative to a shift k into sums relative to the shift k + delta (per station).
+    Differences of mod and obs do not depend on the shift.
+    """
+
+    n = sums["n"]
+    shifted = dict(sums)
+    shifted["o"] = sums["o"] - n * delta
+    shifted["m"] = sums["m"] - n * delta
+    shifted["oo"] = sums["oo"] - 2 * delta * sums["o"] + n * delta ** 2
+    shifted["mm"] = sums["mm"] - 2 * delta * sums["m"] + n * delta ** 2
+    shifted["mo"] = sums["mo"] - delta * (sums["m"] + sums["o"]) + n * delta ** 2
+
+    return shifted
+
+
+def _obs_sums(obs: np.ndarray):
+    # sum and number of the valid observations of each station
+    valid = ~np.isnan(obs)
+    return np.where(valid, obs, 0.0).sum(axis=-1), valid.sum(axis=-1)
+
+
+def _block_sums(obs: np.ndarray, mod: np.ndarray, shift: np.ndarray, is_dir: bool, block=2 ** 16, groups=None,
+                n_groups=None, settings=None) -> dict:
+    """
+    The sums (see _SUMS and _metric_sums) of obs with shape (station, time) and mod with shape (mod, station, time),
+    accumulated over blocks of about block values. If groups (see StatAccumulator.update) is given, the sums have
+    the shape (mod, station, n_groups), otherwise (mod, station), followed by the bins of histograms.
+    """
+
+    n_mod, n_station, n_time = mod.shape
+    sums = {}
+    rows = max(block // max(n_mod * n_time, 1), 1)
+    steps = max(block // max(n_mod * rows, 1), 1)
+    for first in range(0, max(n_station, 1), rows):
+        stations = slice(first, first + rows)
+        for start in range(0, max(n_time, 1), steps):
+            times = slice(start, start + steps)
+            if groups is None:
+                part = _stat_sums(obs[stations, times], mod[:, stations, times], shift[stations], is_dir,
+                                  settings=settings)
+            else:
+                # time steps without a group are left out, like missing values.
+                part_groups = groups[stations, times]
+                part_obs = np.where(part_groups >= 0, obs[stations, times], np.nan)
+                part = _stat_sums(part_obs, mod[:, stations, times], shift[stations], is_dir, part_groups, n_groups,
+                                  settings)
+            for name, values in part.items():
+                if name not in sums:
+                    sums[name] = np.zeros((n_mod, n_station) + values.shape[2:])
+                sums[name][:, stations] += values
+
+    return sums
+
+
+def _series_index(n_mod: int, n_station: int, n_time: int, groups=None, n_groups=1) -> np.ndarray:
+    """
+    Returns: the number of the time series (mod, station and group, if any) of each value of an array with shape
+    (mod, station, time), flattened.
+    """
+
+    offsets = np.arange(n_mod * n_station).reshape(n_mod, n_station, 1)
+    if groups is None:
+        return np.broadcast_to(offsets, (n_mod, n_station, n_time)).ravel()
+    return (offsets * n_groups + np.maximum(groups, 0)).ravel()
+
+
+def _segment_sum(groups: np.ndarray, n_mod: int, n_groups: int):
+    """
+    Returns: a function that sums arrays with shape (mod, station, time) over the time steps of each group, which
+    gives arrays with shape (mod, station, n_groups). All groups are summed in a single pass (np.bincount).
+    """
+
+    n_station = groups.shape[0]
+    index = _series_index(n_mod, n_station, groups.shape[1], groups, n_groups)
+    size = n_mod * n_station * n_groups
+
+    def reduce(values):
+        values = np.broadcast_to(values, (n_mod,) + groups.shape).ravel()
+        return np.bincount(index, weights=values, minlength=size).reshape(n_mod, n_station, n_groups)
+
+    return reduce
+
+
+# n: number of valid pairs, e/ee/ae: sum of the error mod - obs (wrapped to [-180, 180] for directions), of its
+# square and its absolute value, rel/n_rel: sum and number of relative errors, o/m/oo/mm/mo: sums of obs and mod,
+# their squares and products (relative to the shift).
+_SUMS = ["n", "e", "ee", "ae", "rel", "n_rel", "o", "m", "oo", "mm", "mo"]
+
+
+def _stat_sums(obs: np.ndarray, mod: np.ndarray, shift: np.ndarray, is_dir: bool, groups=None, n_groups=None,
+               settings=None) -> dict:
+    """
+    The sums along time, see _SUMS and _metric_sums. obs has the shape (station, time), mod (mod, station, time).
+    With groups, the sums are taken per group (see _segment_sum).
+    """
+
+    if groups is None:
+        def reduce(values):
+            return values.sum(axis=-1)
+
+        def dot(a, b):
+            return np.einsum("...t,...t->...", a, b)
+    else:
+        reduce = _segment_sum(groups, mod.shape[0], n_groups)
+
+        def dot(a, b):
+            return reduce(a * b)
+
+    raw_obs = obs
+
+    # both obs and mod are missing where either of them is missing.
+    valid = ~np.isnan(mod)
+    valid &= ~np.isnan(obs)
+    obs = np.where(valid, obs - shift[:, None], 0.0)
+    mod_shifted = mod - shift[:, None]
+    mod_shifted[~valid] = 0.0
+
+    sums = {"n": reduce(valid)}
+    diff = mod_shifted - obs
+    if is_dir:
+        diff[diff > 180] -= 360.0
+        diff[diff < -180] += 360.0
+    sums["e"] = reduce(diff)
+    sums["ee"] = dot(diff, diff)
+    np.abs(diff, out=diff)
+    sums["ae"] = reduce(diff)
+
+    # the relative error is not defined for mod == 0.
+    abs_mod = np.abs(mod)
+    rel_valid = valid & (abs_mod != 0)
+    sums["rel"] = reduce(np.divide(diff, abs_mod, out=np.zeros_like(diff), where=rel_valid))
+    sums["n_rel"] = reduce(rel_valid)
+
+    sums["o"] = reduce(obs)
+    sums["m"] = reduce(mod_shifted)
+    sums["oo"] = dot(obs, obs)
+    sums["mm"] = dot(mod_shifted, mod_shifted)
+    sums["mo"] = dot(mod_shifted, obs)
+
+    if settings:
+        sums.update(_metric_sums(raw_obs, mod, valid, reduce, dot, settings, groups, n_groups))
+
+    return sums
+
+
+def _stats_from_sums(sums: dict, is_dir: bool) -> np.ndarray:
+    n = sums["n"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bias = sums["e"] / n
+        std_err = np.sqrt(np.maximum(sums["ee"] / n - bias ** 2, 0.0))
+        mae = sums["ae"] / n
+        rmse = np.sqrt(sums["ee"] / n)
+
+        if is_dir:
+            r = _circular_correlation(sums) if "circ_sa" in sums else np.full(bias.shape, np.nan)
+            mape = np.full(bias.shape, np.nan)
+        else:
+            mape = sums["rel"] / sums["n_rel"] * 100
+            cov = sums["mo"] - sums["m"] * sums["o"] / n
+            var_mod = sums["mm"] - sums["m"] ** 2 / n
+            var_obs = sums["oo"] - sums["o"] ** 2 / n
+            r = cov / np.sqrt(var_mod * var_obs) * 100.0  # Pearson correlation coeff.
+
+    return np.stack([bias, std_err, mae, r, mape, rmse])
+
+
+def _metric_settings(metrics=None, obs=None) -> dict:
+    """
+    Additional metric sets, which are computed in the same pass as the usual statistics. metrics is a list of the
+    names of the sets, or a dict with the settings of each set:
+        quantiles: the errors of quantiles, P10_err, P50_err and P90_err (mod - obs). The quantiles are taken from
+            histograms, so their resolution is the width of the bins. Settings: q (default: [0.1, 0.5, 0.9]) and
+            bins (default: 2000 bins covering the range of the observations and half of this range on both sides).
+        weibull: the differences (mod - obs) of the shape k and the scale A of Weibull distributions, weibull_k_diff
+            and weibull_A_diff, fitted by the moments (k = (std / mean) ** -1.086).
+        hit_rate: the percentage of time steps where model and observation fall into the same bin, i.e. of the wind
+            speed. Settings: bins (default: bins of 1 m/s). Use groupby to get the hit rates of each bin.
+        circular: the circular correlation coefficient of wind directions (CorCo instead of NaN).
+
+    Returns: the settings of each set, with defaults. Default bins of the quantiles are taken from obs, if given.
+    """
+
+    if not metrics:
+        return {}
+    if not isinstance(metrics, dict):
+        metrics = {name: {} for name in metrics}
+
+    settings = {}
+    for name, values in metrics.items():
+        values = dict(values or {})
+        if name == "quantiles":
+            values.setdefault("q", [0.1, 0.5, 0.9])
+            values.setdefault("bins", None)
+            if values["bins"] is None and obs is not None and np.isfinite(obs).any():
+                low, high = np.nanmin(obs), np.nanmax(obs)
+                pad = 0.5 * (high - low) or 1.0
+                values["bins"] = np.linspace(low - pad, high + pad, 2001)
+        elif name == "hit_rate":
+            values.setdefault("bins", np.arange(0.0, 51.0))
+        elif name not in ["weibull", "circular"]:
+            print(f"Unknown metrics {name}. Choose from quantiles, weibull, hit_rate and circular.")
+            raise ValueError
+        settings[name] = values
+
+    return settings
+
+
+def _metric_sums(obs: np.ndarray, mod: np.ndarray, valid: np.ndarray, reduce, dot, settings: dict, groups=None,
+                 n_groups=None) -> dict:
+    """
+    The sums of the additional metric sets (see _metric_settings), with the same handling of missing values and
+    groups as the sums of _stat_sums. All of them are taken from the data as is, i.e. without a shift.
+    """
+
+    sums = {}
+    if "quantiles" in settings:
+        edges = np.asarray(settings["quantiles"]["bins"], dtype=float)
+        n_bins = len(edges) - 1
+        n_mod, n_station, n_time = mod.shape
+        if groups is not None:
+            # the histograms are not split into the blocks of the bootstrap (see _block_groups).
+            blocks = settings["quantiles"].get("blocks", 1)
+            groups, n_groups = np.where(groups >= 0, groups // blocks, -1), n_groups // blocks
+        index = _series_index(n_mod, n_station, n_time, groups, n_groups) * n_bins
+        shape = (n_mod, n_station) if groups is None else (n_mod, n_station, n_groups)
+        weights = valid.ravel()
+        for name, values in [("hist_o", obs), ("hist_m", mod)]:
+            bins = np.clip(_bin_index(values, edges) - 1, 0, n_bins - 1)
+            bins = np.broadcast_to(bins, mod.shape).ravel()
+            hist = np.bincount(index + bins, weights=weights, minlength=int(np.prod(shape)) * n_bins)
+            sums[name] = hist.reshape(shape + (n_bins,))
+
+    if "hit_rate" in settings:
+        edges = np.asarray(settings["hit_rate"]["bins"], dtype=float)
+        sums["hit"] = reduce(valid & (_bin_index(obs, edges) == _bin_index(mod, edges)))
+
+    if "circular" in settings:
+        obs = np.where(valid, np.deg2rad(obs), 0.0)
+        mod = np.where(valid, np.deg2rad(mod), 0.0)
+        sin_o, cos_o, sin_m, cos_m = np.sin(obs), np.cos(obs), np.sin(mod), np.cos(mod)
+        cos_o[~valid] = 0.0
+        cos_m[~valid] = 0.0
+        sums["circ_sa"], sums["circ_ca"] = reduce(sin_o), reduce(cos_o)
+        sums["circ_sb"], sums["circ_cb"] = reduce(sin_m), reduce(cos_m)
+        sums["circ_sasb"], sums["circ_sacb"] = dot(sin_o, sin_m), dot(sin_o, cos_m)
+        sums["circ_casb"], sums["circ_cacb"] = dot(cos_o, sin_m), dot(cos_o, cos_m)
+        sums["circ_sasa"], sums["circ_saca"] = dot(sin_o, sin_o), dot(sin_o, cos_o)
+        sums["circ_sbsb"], sums["circ_sbcb"] = dot(sin_m, sin_m), dot(sin_m, cos_m)
+
+    return sums
+
+
+def _bin_index(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """
+    Same as np.digitize(values, edges) for increasing edges, i.e. 0 below the first edge, len(edges) above the
+    last. Equally spaced edges (the default bins) are computed directly, which is much faster than a search.
+    """
+
+    width = (edges[-1] - edges[0]) / (len(edges) - 1)
+    if len(edges) < 3 or not np.allclose(np.diff(edges), width):
+        return np.digitize(values, edges)
+
+    with np.errstate(invalid="ignore"):
+        index = np.floor((values - edges[0]) / width)
+        np.clip(index, -1, len(edges) - 1, out=index)
+    index[np.isnan(index)] = len(edges) - 1
+
+    return index.astype(np.intp) + 1
+
+
+def _circular_correlation(sums: dict) -> np.ndarray:
+    """
+    The circular correlation coefficient (Jammalamadaka and SenGupta) in percent,
+    sum(sin(a - mean_a) * sin(b - mean_b)) / sqrt(sum(sin(a - mean_a) ** 2) * sum(sin(b - mean_b) ** 2)),
+    with the circular means mean_a and mean_b, expanded into sums of sines and cosines.
+    """
+
+    n = sums["n"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        norm_a = np.hypot(sums["circ_sa"], sums["circ_ca"])
+        sin_a, cos_a = sums["circ_sa"] / norm_a, sums["circ_ca"] / norm_a
+        norm_b = np.hypot(sums["circ_sb"], sums["circ_cb"])
+        sin_b, cos_b = sums["circ_sb"] / norm_b, sums["circ_cb"] / norm_b
+
+        cov = (cos_a * cos_b * sums["circ_sasb"] - cos_a * sin_b * sums["circ_sacb"]
+               - sin_a * cos_b * sums["circ_casb"] + sin_a * sin_b * sums["circ_cacb"])
+        var_a = cos_a ** 2 * sums["circ_sasa"] - 2 * cos_a * sin_a * sums["circ_saca"] + sin_a ** 2 * (
+            n - sums["circ_sasa"])
+        var_b = cos_b ** 2 * sums["circ_sbsb"] - 2 * cos_b * sin_b * sums["circ_sbcb"] + sin_b ** 2 * (
+            n - sums["circ_sbsb"])
+
+        return cov / np.sqrt(var_a * var_b) * 100.0
+
+
+def _metrics_from_sums(sums: dict, shift: np.ndarray, settings: dict) -> dict:
+    """
+    Returns: the additional metrics (see _metric_settings) by name. shift is the shift of the sums (see
+    StatAccumulator), broadcastable to the sums.
+    """
+
+    n = sums["n"]
+    metrics = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if "quantiles" in settings:
+            edges = np.asarray(settings["quantiles"]["bins"], dtype=float)
+            for q in settings["quantiles"]["q"]:
+                error = _hist_quantile(sums["hist_m"], edges, q) - _hist_quantile(sums["hist_o"], edges, q)
+                metrics[f"P{100 * q:g}_err"] = error
+
+        if "weibull" in settings:
+            gamma = np.vectorize(math.gamma, otypes=[float])
+            k, scale = [], []
+            for total, squares in [("o", "oo"), ("m", "mm")]:
+                mean = sums[total] / n
+                std = np.sqrt(np.maximum(sums[squares] / n - mean ** 2, 0.0))
+                mean = mean + shift
+                k.append((std / mean) ** -1.086)
+                scale.append(mean / gamma(1 + 1 / np.where(k[-1] > 0, k[-1], np.nan)))
+            metrics["weibull_k_diff"] = k[1] - k[0]
+            metrics["weibull_A_diff"] = scale[1] - scale[0]
+
+        if "hit_rate" in settings:
+            metrics["hit_rate"] = sums["hit"] / n * 100
+
+    return metrics
+
+
+def _hist_quantile(hist: np.ndarray, edges: np.ndarray, q: float) -> np.ndarray:
+    # the quantile q of histograms along the last axis, interpolated linearly within the bins.
+    cdf = np.cumsum(hist, axis=-1)
+    total = cdf[..., -1:]
+    target = q * total
+    k = np.minimum(np.sum(cdf < target, axis=-1, keepdims=True), hist.shape[-1] - 1)
+    below = np.take_along_axis(cdf, k, axis=-1) - np.take_along_axis(hist, k, axis=-1)
+    frac = (target - below) / np.take_along_axis(hist, k, axis=-1)
+    value = edges[k] + np.clip(frac, 0, 1) * (edges[k + 1] - edges[k])
+
+    return np.where(total > 0, value, np.nan)[..., 0]
+
+
 ##########################################################################
 def statistics(input_dataframe: pd.DataFrame, proj_name: str, loc: str, var: str, lev: str,
-               anemometer: str, expvec: list, obsvec: list, **kwargs) -> pd.DataFrame:
+               anemometer: str, expvec: list, obsvec: list, bootstrap=None, metrics=None, **kwargs) -> pd.DataFrame:
     """
     The new Statistics Function. It takes the same data as the obs_vs_mod plot
     and calculates statistics. Attention! Assumes that the first column is the OBS!
@@ -60,6 +625,11 @@ def statistics(input_dataframe: pd.DataFrame, proj_name: str, loc: str, var: str
     observation level. Future versions of this function should be able to deal with variations. Right now,
     there is little reason to add this functionality though.
 
+    bootstrap: optional settings of block-bootstrap confidence intervals (see Statistics_xarray), which are added
+    as columns BIAS_lower, BIAS_upper, ...
+
+    metrics: optional sets of additional metrics (see _metric_settings), which are added as columns.
+
     DLeuk, 30.09.2021
     """
 
@@ -73,13 +643,14 @@ def statistics(input_dataframe: pd.DataFrame, proj_name: str, loc: str, var: str
     Stats = np.zeros([6, len(modnames)])
 
     obs = input_dataframe[obsname]
+    work = _work_buffer(len(obs))
 
     for mm, modname in enumerate(modnames):
         mod = input_dataframe[modname]
         if var == "DIR":
-            Stats[:, mm] = _stat_calc_dir(obs, mod)
+            Stats[:, mm] = _stat_calc_dir(obs, mod, work)
         else:
-            Stats[:, mm] = _stat_calc(obs, mod)
+            Stats[:, mm] = _stat_calc(obs, mod, work)
 
     d = {
         "Mod": expvec,
@@ -95,6 +666,26 @@ def statistics(input_dataframe: pd.DataFrame, proj_name: str, loc: str, var: str
         "RMSE": Stats[5, :],
     }
 
+    if bootstrap or metrics:
+        groups, n_groups = None, None
+        if bootstrap:
+            block_length = _block_length(bootstrap, input_dataframe.index.values)
+            groups, n_groups, n_blocks = _block_groups(None, None, {"station_name": 1, "time": len(obs)},
+                                                       block_length)
+            metrics = _bootstrap_metrics(metrics, n_blocks)
+        mod = input_dataframe[modnames].values.T
+        acc = StatAccumulator(var == "DIR", metrics=metrics).update(obs.values, mod, groups=groups, n_groups=n_groups)
+        if bootstrap:
+            acc, block_sums = _split_blocks(acc, n_blocks)
+            ci = _bootstrap(block_sums, var == "DIR", bootstrap).reshape(2, 6, -1)
+            for ii, name in enumerate(["BIAS", "STD(ERR)", "MAE", "CorCo", "MAPE", "RMSE"]):
+                d[f"{name}_lower"] = ci[0, ii]
+                d[f"{name}_upper"] = ci[1, ii]
+        if var == "DIR" and "circular" in acc.settings:
+            d["CorCo"] = acc.result()[3].reshape(-1)
+        for name, values in acc.metrics().items():
+            d[name] = values.reshape(-1)
+
     Stats = pd.DataFrame(d)
 
     # Here is metadata that typically does not vary.
@@ -103,10 +694,129 @@ def statistics(input_dataframe: pd.DataFrame, proj_name: str, loc: str, var: str
 
     return Stats
 
+
+class StatisticsCache:
+    """
+    A table of results of statistics(), stored in a csv file (i.e. in the db directory of a project, see
+    Project.statistics_cache). Each row holds the statistics of one experiment at one station, variable, level,
+    averaging window and observation dataset, together with a signature of the input files (paths, sizes and
+    modification times of the Ave* and observation files). Statistics are only recomputed if there is no row with
+    the current signature, i.e. after an experiment has been processed again. Rows with missing statistics (i.e. no
+    overlapping data) count as computed.
+
+    Changes hold an fcntl lock on <filename>.lock, so that concurrent processes (i.e. the GUI and a script) do not
+    overwrite the rows of each other. fcntl locks belong to the process, so threads (i.e. the sessions of the GUI)
+    hold a lock of the process in addition.
+
+    Example:
+        cache = StatisticsCache(project.tamer_path / "statistics.csv")
+        stats = cache.statistics(load, proj_name, loc, var, lev, anemometer, expvec, obsvec, files, timeavg=10)
+    """
+
+    keys = ["proj_name", "Mod", "Obs", "Device", "Variable", "zlev", "timeavg", "obs_data"]
+    metrics = ["BIAS", "STD(ERR)", "MAE", "CorCo", "MAPE", "RMSE"]
+    _thread_lock = threading.Lock()
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def read(self) -> pd.DataFrame:
+        if not os.path.isfile(self.filename):
+            return pd.DataFrame(columns=self.keys + ["signature"] + self.metrics)
+        return pd.read_csv(self.filename, dtype={key: str for key in self.keys + ["signature"]},
+                           keep_default_na=False, na_values={metric: ["", "NaN", "nan"] for metric in self.metrics})
+
+    def statistics(self, data, proj_name: str, loc: str, var: str, lev: str, anemometer: str, expvec: list,
+                   obsvec: list, files: dict, timeavg=None) -> pd.DataFrame:
+        """
+        Same as statistics(), with the results of unchanged experiments taken from the table.
+
+        Args:
+            data: the input_dataframe of statistics(), or a function that returns it for a list of experiments, so
+            that only the data of the experiments to be computed is read.
+            files: the input files of each experiment and of the observations (obsvec[0]), i.e.
+            {exp_name: [path/to/Ave10Min_tslist_d01.nc], obsname: [path/to/obs.nc]}.
+            timeavg: the averaging window, as part of the key.
+            others: see statistics().
+
+        Returns: the statistics of expvec (without the metadata attributes case and device).
+        """
+
+        obsname = obsvec[0]
+        table = self.read()
+        signatures = {exp_name: _file_signature(files[exp_name], files[obsname]) for exp_name in expvec}
+        rows = pd.DataFrame({"Mod": expvec, "signature": [signatures[exp_name] for exp_name in expvec]})
+        for key, value in zip(self.keys, [proj_name, None, loc, anemometer, var, lev, timeavg, obsname]):
+            if key != "Mod":
+                rows[key] = str(value)
+
+        found = rows.merge(table, on=self.keys + ["signature"], how="left", indicator=True)
+        missing = [exp_name for exp_name, hit in zip(expvec, found["_merge"]) if hit != "both"]
+
+        if missing:
+            input_dataframe = data(missing) if callable(data) else data
+            new = statistics(input_dataframe, proj_name, loc, var, lev, anemometer, missing, obsvec)
+            rows = rows.set_index("Mod")
+            new = pd.concat([rows.loc[missing].reset_index(), new[self.metrics]], axis=1)
+
+            # rows of the same key with an old signature are replaced. The table is read again, since other
+            # processes may have changed it in the meantime.
+            with self.locked():
+                table = self.read()
+                stale = table.merge(new[self.keys], on=self.keys, how="left", indicator=True)["_merge"] == "both"
+                table = pd.concat([table[~stale.values], new[table.columns]], ignore_index=True)
+                self._write(table)
+
+            found = found.set_index("Mod")
+            found.loc[missing, self.metrics] = new.set_index("Mod")[self.metrics]
+            found = found.reset_index()
+
+        stats = pd.DataFrame({"Mod": expvec, "Obs": loc, "Device": anemometer, "Variable": var, "zlev": lev})
+        for metric in self.metrics:
+            stats[metric] = found[metric].astype(float).values
+
+        return stats
+
+    @contextmanager
+    def locked(self):
+        """
+        Holds an exclusive fcntl lock on <filename>.lock. Without fcntl (not POSIX), changes are not locked.
+        """
+
+        with self._thread_lock, open(f"{self.filename}.lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.lockf(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(lock, fcntl.LOCK_UN)
+
+    def _write(self, table: pd.DataFrame):
+        # the table is replaced at once, so readers never see a partly written file.
+        tmp = f"{self.filename}.{os.getpid()}.tmp"
+        table.to_csv(tmp, index=False)
+        os.replace(tmp, self.filename)
+
+
+def _file_signature(*filelists) -> str:
+    """
+    Returns: a hash of the paths, sizes and modification times of the files, which changes with the content.
+    """
+
+    info = []
+    for filelist in filelists:
+        for filename in [filelist] if isinstance(filelist, (str, os.PathLike)) else filelist:
+            stat = os.stat(filename)
+            info.append(f"{os.path.abspath(filename)}:{stat.st_size}:{stat.st_mtime_ns}")
+
+    return hashlib.sha1("\n".join(info).encode()).hexdigest()
+
     ##########################################################################
 
 
-def Statistics_xarray(input_ds: xr.Dataset, calc_for_ramp=0) -> xr.Dataset:
+def Statistics_xarray(input_ds: xr.Dataset, calc_for_ramp=0, chunks=None, workers=None, groupby=None,
+                      bootstrap=None, metrics=None) -> xr.Dataset:
     """
     This statistics function calculates the usual statistics for a dataset consisting of
     a number timeseries at station_name locations. These time series represent model runs.
@@ -115,6 +825,38 @@ def Statistics_xarray(input_ds: xr.Dataset, calc_for_ramp=0) -> xr.Dataset:
 
     Optional: if one of the data variables is called ramp_marker and calc_for_ramp=True, the statistics are
     calculated for ramp events.
+
+    Optional: if chunks is given, the dataset is read in blocks of chunks time steps, which are reduced one after
+    the other by workers threads (default: all cores). Only workers blocks are in memory at a time, so the dataset
+    may be larger than the memory, i.e. opened with xr.open_dataset or xr.open_mfdataset.
+
+    Optional: groupby computes the statistics separately for groups of time steps, i.e. per hour of the day, month,
+    wind sector or stability class. It maps the name of a new dimension of the result to the labels of the groups,
+    which are either the name of a variable of input_ds (i.e. "time.hour", "time.month" or a data variable with
+    stability classes, which is then not treated as a model) or a DataArray along time and/or station_name (i.e.
+    wind_sector(input_ds["Obs"])). Time steps with a missing label are left out. With several groupings, the
+    statistics are computed for all combinations of labels. All groups are computed in a single pass.
+
+    Example:
+        Statistics_xarray(input_ds, groupby={"hour": "time.hour", "sector": wind_sector(dir_ds["Obs"])})
+
+    Optional: bootstrap adds block-bootstrap confidence intervals of all statistics (variables bias_ci, std_ci, ...
+    with an additional dimension bound = [lower, upper]). It is a dict with the settings
+        n_resamples: number of resamples. Default: 1000.
+        block_length: length of the blocks in time steps. The time series are split into blocks of this length,
+            which are resampled as a whole, so that autocorrelated time steps stay together. Default: one day of
+            time steps, from the (datetime) time coordinate. Required if time holds no dates.
+            The sums of each block are kept, and a batch of 100 resamples is a matrix product of (100, blocks) and
+            (blocks, models * stations * groups * 11 sums). Time and memory grow with the number of blocks, so short
+            blocks are slow: for 10 models, 10 stations and a year of 10 minute data, 1000 resamples take about
+            0.5 s with blocks of one day, but 40 s and 1 GB with blocks of a single time step.
+        confidence: the confidence level of the intervals. Default: 0.95.
+        processes: number of processes that evaluate the resamples. Default: none, all in this process.
+        seed: the seed of the random numbers, for reproducible intervals.
+
+    Optional: metrics adds sets of metrics (quantiles, weibull, hit_rate and circular, see _metric_settings), i.e.
+    metrics=["quantiles", "weibull"] or metrics={"hit_rate": {"bins": [0, 4, 8, 12, 25]}}. They are computed in the
+    same pass over the data as the usual statistics.
     """
 
     if "exp_name" in input_ds.dims and "station_name" not in input_ds.dims:
@@ -129,7 +871,6 @@ def Statistics_xarray(input_ds: xr.Dataset, calc_for_ramp=0) -> xr.Dataset:
     mod_names = list(input_ds.data_vars.keys())
     mod_names.remove(obsname)
     if "ramp_marker" in mod_names:
-        ramp = input_ds["ramp_marker"]
         mod_names.remove("ramp_marker")
     elif calc_for_ramp:
         print("ramp_marker not found in dataset. Setting for_ramp to false.")
@@ -137,40 +878,48 @@ def Statistics_xarray(input_ds: xr.Dataset, calc_for_ramp=0) -> xr.Dataset:
 
     station_names = input_ds.station_name.values
 
-    stats = np.zeros([6, len(mod_names), len(station_names)])
+    if groupby:
+        # data variables with group labels are not models.
+        labels = [values for values in groupby.values() if isinstance(values, str)]
+        mod_names = [name for name in mod_names if name not in labels]
+    coords = {"mod_name": mod_names, "station_name": station_names}
 
-    for ss, station_name in enumerate(station_names):
+    if groupby:
+        groups, labels = _group_codes(input_ds, obsname, groupby)
+        coords.update(labels)
+        n_groups = int(np.prod([len(values) for values in labels.values()]))
+    else:
+        groups, n_groups = None, None
 
-        if calc_for_ramp:
-            obs = input_ds[obsname][ss, :][ramp[ss, :]].values
-        else:
-            obs = input_ds[obsname][ss, :].values
+    if bootstrap:
+        # the sums are accumulated per block of time steps, which are combined to the resamples later on.
+        block_length = _block_length(bootstrap, input_ds.time.values)
+        groups, n_groups, n_blocks = _block_groups(groups, n_groups, input_ds.sizes, block_length)
+        metrics = _bootstrap_metrics(metrics, n_blocks)
 
-        for mm, modname in enumerate(mod_names):
+    if chunks is None:
+        # all models and stations are computed at once, on an array (mod_name, station_name, time).
+        obs, mod = _stat_arrays(input_ds, obsname, mod_names, calc_for_ramp)
+        acc = StatAccumulator(is_dir, metrics=metrics).update(obs, mod, groups=groups, n_groups=n_groups)
+    else:
+        acc = _stat_calc_chunked(input_ds, obsname, mod_names, calc_for_ramp, is_dir, chunks, workers, groups,
+                                 n_groups, metrics)
 
-            if calc_for_ramp:
-                mod = input_ds[modname][ss, :][ramp[ss, :]].values
-            else:
-                mod = input_ds[modname][ss, :].values
+    dims = list(coords)
+    shape = tuple(len(values) for values in coords.values())
+    if bootstrap:
+        acc, block_sums = _split_blocks(acc, n_blocks)
+        ci = _bootstrap(block_sums, is_dir, bootstrap).reshape((2, 6) + shape)
 
-            if is_dir:
-                stats[:, mm, ss] = _stat_calc_dir(obs, mod)
-            else:
-                stats[:, mm, ss] = _stat_calc(obs, mod)
-
-    dims = ["mod_name", "station_name"]
-
-    stats = xr.Dataset(
-        {
-            "bias": (dims, stats[0, :, :]),
-            "std": (dims, stats[1, :, :]),
-            "mae": (dims, stats[2, :, :]),
-            "CorCo": (dims, stats[3, :, :]),
-            "mape": (dims, stats[4, :, :]),
-            "rmse": (dims, stats[5, :, :]),
-        },
-        coords={"mod_name": mod_names, "station_name": station_names},
-    )
+    names = ["bias", "std", "mae", "CorCo", "mape", "rmse"]
+    stats = acc.result().reshape((6,) + shape)
+    stats = xr.Dataset({name: (dims, stats[ii]) for ii, name in enumerate(names)}, coords=coords)
+    for name, values in acc.metrics().items():
+        stats[name] = (dims, values.reshape(shape))
+    if bootstrap:
+        for ii, name in enumerate(names):
+            stats[f"{name}_ci"] = (dims + ["bound"], np.moveaxis(ci[:, ii], 0, -1))
+        stats.coords["bound"] = ["lower", "upper"]
 
     stats.attrs = input_ds.attrs
     stats.attrs["calc_for_ramp"] = calc_for_ramp
@@ -179,3 +928,231 @@ def Statistics_xarray(input_ds: xr.Dataset, calc_for_ramp=0) -> xr.Dataset:
         stats = stats.rename({"station_name": "exp_name"})
 
     return stats
+
+
+def wind_sector(direction, sectors=12):
+    """
+    The wind sector of wind directions, as labels for the groupby option of Statistics_xarray.
+
+    Args:
+        direction: wind direction in degrees, i.e. a DataArray.
+        sectors: number of sectors. The first sector is centered on north.
+
+    Returns: the center of the sector (in degrees) of each direction, NaN where the direction is missing.
+    """
+
+    width = 360.0 / sectors
+    return np.mod(np.floor(direction / width + 0.5), sectors) * width
+
+
+def _group_codes(input_ds: xr.Dataset, obsname: str, groupby: dict):
+    """
+    Numbers the combinations of the group labels (see Statistics_xarray) of each time step.
+
+    Returns: the group of each time step with shape (station_name, time), -1 where a label is missing, and the
+    sorted labels of each grouping.
+    """
+
+    template = input_ds[obsname].transpose("station_name", "time")
+    groups = np.zeros(template.shape, dtype=np.int64)
+    missing = np.zeros(template.shape, dtype=bool)
+    labels = {}
+    for dim, values in groupby.items():
+        if isinstance(values, str):
+            try:
+                values = input_ds[values]
+            except KeyError:
+                print(f"Cannot group by {values}: no such variable in the dataset.")
+                raise ValueError
+        values = values.broadcast_like(template).transpose("station_name", "time").values
+        valid = pd.notna(values)
+        labels[dim], inverse = np.unique(values[valid], return_inverse=True)
+        groups *= len(labels[dim])
+        groups[valid] += inverse.reshape(-1)
+        missing |= ~valid
+
+    groups[missing] = -1
+
+    return groups, labels
+
+
+def _block_groups(groups, n_groups, sizes, block_length: int):
+    """
+    Splits the groups (see StatAccumulator.update, None: a single group) into blocks of block_length time steps.
+
+    Returns: the groups, the number of groups and the number of blocks, where the block is the fastest varying.
+    """
+
+    n_blocks = -(-sizes["time"] // block_length)
+    blocks = np.broadcast_to(np.arange(sizes["time"]) // block_length, (sizes["station_name"], sizes["time"]))
+    if groups is None:
+        return blocks, n_blocks, n_blocks
+
+    return np.where(groups >= 0, groups * n_blocks + blocks, -1), n_groups * n_blocks, n_blocks
+
+
+def _block_length(settings: dict, times: np.ndarray) -> int:
+    """
+    The block length of the bootstrap (see Statistics_xarray): the setting block_length or one day of time steps.
+    """
+
+    if settings.get("block_length") is not None:
+        return int(settings["block_length"])
+
+    times = np.asarray(times)
+    if times.dtype.kind != "M" or len(times) < 2:
+        print("The block length of the bootstrap cannot be taken from the time coordinate. Set block_length.")
+        raise ValueError
+
+    step = np.median(np.diff(times)) / np.timedelta64(1, "s")
+    return max(int(round(86400 / step)), 1)
+
+
+def _bootstrap_metrics(metrics, n_blocks: int) -> dict:
+    # the settings of the metrics for groups that are split into n_blocks blocks (see _block_groups).
+    settings = _metric_settings(metrics)
+    if "quantiles" in settings:
+        settings["quantiles"]["blocks"] = n_blocks
+    return settings
+
+
+def _split_blocks(acc: StatAccumulator, n_blocks: int):
+    """
+    Splits an accumulator of groups that are split into blocks (see _block_groups).
+
+    Returns: an accumulator of the groups, i.e. the sums of all blocks, and the sums (see _SUMS) of each block, with
+    the block as the last dimension.
+    """
+
+    ndim = acc.sums["n"].ndim
+    total = StatAccumulator(acc.is_dir, acc.shift)
+    total.settings = acc.settings
+    total.shape = acc.shape[:-1] + (acc.shape[-1] // n_blocks,)
+    total.sums, sums = {}, {}
+    for name, values in acc.sums.items():
+        if values.ndim > ndim:
+            # histograms are accumulated without blocks and not resampled.
+            total.sums[name] = values
+        else:
+            sums[name] = values.reshape(values.shape[:-1] + (-1, n_blocks))
+            total.sums[name] = sums[name].sum(axis=-1)
+
+    return total, sums
+
+
+def _bootstrap(sums: dict, is_dir: bool, settings: dict) -> np.ndarray:
+    """
+    Block-bootstrap confidence intervals (see Statistics_xarray) from the sums (see _SUMS) of each block, which is
+    the last dimension of the sums. A resample draws as many blocks as there are, with replacement. Its sums are
+    the sums of the drawn blocks, so all resamples of a batch follow from a single matrix product.
+
+    Returns: the lower and upper bounds of bias, std, mae, r, mape and rmse, with shape (2, 6, ...).
+    """
+
+    n_resamples = settings.get("n_resamples", 1000)
+    confidence = settings.get("confidence", 0.95)
+    processes = settings.get("processes", None)
+
+    # batches of a fixed size with their own seeds give the same resamples with any number of processes.
+    batch = 100
+    sizes = [min(batch, n_resamples - start) for start in range(0, n_resamples, batch)]
+    seeds = np.random.SeedSequence(settings.get("seed", None)).spawn(len(sizes))
+    if processes:
+        # the sums are sent to each process once, only the sizes and seeds of the batches are sent per batch.
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_resample, initargs=(sums, is_dir)) as pool:
+            parts = list(pool.map(_resample_batch, sizes, seeds))
+    else:
+        parts = list(map(_resample, repeat(sums), repeat(is_dir), sizes, seeds))
+
+    alpha = (1 - confidence) / 2
+    with warnings.catch_warnings():
+        # groups without data have no statistics.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanquantile(np.concatenate(parts, axis=-1), [alpha, 1 - alpha], axis=-1)
+
+
+# the sums of the blocks in the processes of _bootstrap, see _init_resample.
+_RESAMPLE_DATA = {}
+
+
+def _init_resample(sums: dict, is_dir: bool):
+    _RESAMPLE_DATA["sums"] = sums
+    _RESAMPLE_DATA["is_dir"] = is_dir
+
+
+def _resample_batch(size: int, seed) -> np.ndarray:
+    return _resample(_RESAMPLE_DATA["sums"], _RESAMPLE_DATA["is_dir"], size, seed)
+
+
+def _resample(sums: dict, is_dir: bool, size: int, seed) -> np.ndarray:
+    """
+    Returns: the statistics of size resamples of the blocks (last dimension of sums), with shape (6, ..., size).
+    """
+
+    rng = np.random.default_rng(seed)
+    n_blocks = sums["n"].shape[-1]
+    draws = rng.integers(0, n_blocks, (size, n_blocks)) + n_blocks * np.arange(size)[:, None]
+    weights = np.bincount(draws.ravel(), minlength=size * n_blocks).reshape(size, n_blocks)
+
+    return _stats_from_sums({name: values @ weights.T.astype(float) for name, values in sums.items()}, is_dir)
+
+
+def _stat_arrays(input_ds: xr.Dataset, obsname: str, mod_names: list, calc_for_ramp):
+    """
+    Reads the observations (station_name, time) and the model data (mod_name, station_name, time) of input_ds.
+    """
+
+    obs = input_ds[obsname].transpose("station_name", "time").values
+    if calc_for_ramp:
+        # time steps outside of ramps are left out, like missing values.
+        obs = np.where(input_ds["ramp_marker"].transpose("station_name", "time").values, obs, np.nan)
+    mod = [input_ds[modname].transpose("station_name", "time").values for modname in mod_names]
+    mod = _stacked(mod) if mod else np.empty((0,) + obs.shape)
+
+    return obs.astype(float, copy=False), mod.astype(float, copy=False)
+
+
+def _stacked(arrays: list) -> np.ndarray:
+    # np.stack(arrays), without a copy if the arrays are the consecutive rows of one array (see alignment.align).
+    base = arrays[0].base
+    if isinstance(base, np.ndarray) and base.shape == (len(arrays),) + arrays[0].shape:
+        if all(array.__array_interface__ == base[ii].__array_interface__ for ii, array in enumerate(arrays)):
+            return base
+    return np.stack(arrays)
+
+
+def _stat_calc_chunked(input_ds: xr.Dataset, obsname: str, mod_names: list, calc_for_ramp, is_dir: bool,
+                       chunks: int, workers=None, groups=None, n_groups=None, metrics=None) -> "StatAccumulator":
+    """
+    Accumulates the sums of the arrays of input_ds (see _stat_arrays), reading chunks time steps at a time.
+    groups and n_groups: see StatAccumulator.update. metrics: see _metric_settings.
+
+    Returns: the StatAccumulator of all time steps.
+    """
+
+    blocks = [slice(start, start + chunks) for start in range(0, input_ds.sizes["time"], chunks)]
+
+    # the observations are read first (they are only a small part of the data) to find the shift of the sums and
+    # the range of the observations for the settings of the metrics.
+    total, count = 0.0, 0
+    extremes = []
+    for times in blocks:
+        obs = input_ds[obsname].isel(time=times).transpose("station_name", "time").values.astype(float)
+        part_total, part_count = _obs_sums(obs)
+        total, count = total + part_total, count + part_count
+        if np.isfinite(obs).any():
+            extremes.extend([np.nanmin(obs), np.nanmax(obs)])
+    shift = total / np.maximum(count, 1)
+    settings = _metric_settings(metrics, np.array(extremes))
+
+    def reduce_block(times):
+        obs, mod = _stat_arrays(input_ds.isel(time=times), obsname, mod_names, calc_for_ramp)
+        part_groups = None if groups is None else groups[:, times]
+        return StatAccumulator(is_dir, shift, settings).update(obs, mod, groups=part_groups, n_groups=n_groups)
+
+    acc = StatAccumulator(is_dir, shift, settings)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for part in pool.map(reduce_block, blocks):
+            acc.merge(part)
+
+    return acc
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+from wrftamer.alignment import align, match_times
+from wrftamer.statistics import Statistics_xarray, statistics
+
+
+def make_ave(times, stations, rng, comment="10-minute averaged data"):
+    # like an Ave10Min_tslist file: time first, WSP with model levels.
+    data = xr.Dataset(
+        {"WSP": (["time", "station_name", "model_level"], rng.gamma(2, 3, (len(times), len(stations), 3)))},
+        coords={"time": times, "station_name": stations, "model_level": [1, 2, 3]},
+    )
+    data.attrs["comment"] = comment
+    return data
+
+
+def test_match_times():
+    times = pd.date_range("2020-05-17", periods=5, freq="10min").values
+    reference = times[[0, 2, 4]] + np.array([0, 30, -70], dtype="timedelta64[s]")
+    reference = np.append(reference, times[-1] + np.timedelta64(20, "m"))
+
+    np.testing.assert_array_equal(match_times(reference, times), [0, -1, -1, -1])
+    np.testing.assert_array_equal(match_times(reference, times, "1min"), [0, 2, -1, -1])
+    np.testing.assert_array_equal(match_times(reference, times, "2min"), [0, 2, 4, -1])
+    np.testing.assert_array_equal(match_times(reference, times[:0], "2min"), [-1, -1, -1, -1])
+
+
+def test_align(tmp_path):
+    rng = np.random.default_rng(0)
+    times = pd.date_range("2020-05-17", periods=144, freq="10min")
+    stations = ["FINO", "NEST"]
+    exp1 = make_ave(times, stations, rng)
+    # the second experiment starts later and its file is read from disk.
+    exp2 = make_ave(times[30:], stations, rng)
+    exp2.to_netcdf(tmp_path / "Ave10Min_tslist_d01.nc")
+
+    # observations of FINO, labeled at the end of the windows, a few seconds off.
+    obs = pd.Series(rng.gamma(2, 3, 100), index=times[1:101] + pd.Timedelta("10min") + pd.Timedelta("3s"))
+    models = {"exp1": exp1, "exp2": tmp_path / "Ave10Min_tslist_d01.nc"}
+    aligned = align(obs, models, "WSP", level=2, station_name="FINO", tolerance="5s", obs_label="right", window=10)
+
+    np.testing.assert_array_equal(aligned.time, times[1:101] + pd.Timedelta("3s"))
+    np.testing.assert_array_equal(aligned.Obs.values[0], obs.values)
+    expect = exp1.WSP.sel(station_name="FINO", model_level=2).values[1:101]
+    np.testing.assert_array_equal(aligned.exp1.values[0], expect)
+    if not np.isnan(aligned.exp2.values[0, :29]).all():
+        raise ValueError
+    np.testing.assert_array_equal(aligned.exp2.values[0, 29:], exp2.WSP.sel(station_name="FINO", model_level=2)[:71])
+
+    # all models share one block, which the statistics use without a copy.
+    if aligned.exp1.values.base is not aligned.exp2.values.base:
+        raise ValueError
+    res = Statistics_xarray(aligned)
+    res_pd = statistics(aligned.sel(station_name="FINO").to_pandas(), "p", "FINO", "WSP", "2", "cup", ["exp1", "exp2"],
+                        ["Obs"])
+    np.testing.assert_allclose(res.bias.values[:, 0], res_pd.BIAS.values)
+
+    with pytest.raises(ValueError):
+        align(obs, models, "WSP", level=2, station_name="FINO", obs_label="right", window=5)
+
+
+def test_align_stations():
+    rng = np.random.default_rng(1)
+    times = pd.date_range("2020-05-17", periods=50, freq="10min")
+    exp = make_ave(times, ["FINO", "NEST", "ALPHA"], rng)
+    obs = xr.DataArray(rng.gamma(2, 3, (2, 50)), coords={"station_name": ["NEST", "FINO"], "time": times},
+                       dims=["station_name", "time"])
+
+    aligned = align(obs, {"exp": exp}, "WSP", level=1)
+    np.testing.assert_array_equal(aligned.station_name, ["NEST", "FINO"])
+    np.testing.assert_array_equal(aligned.exp.values, exp.WSP.sel(model_level=1, station_name=["NEST", "FINO"]).T)
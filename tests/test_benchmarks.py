@@ -0,0 +1,186 @@
+"""
+Benchmarks of the hot paths of tslist processing and statistics, on synthetic tslist trees.
+
+The benchmarks are marked slow and run with
+
+    pytest -m slow tests/test_benchmarks.py
+
+Environment variables:
+    WRFTAMER_BENCHMARK_SIZE: size of the synthetic tree, i.e. "stations=4,levels=12,days=1,segments=2,step=3"
+    (step: time step of the tslist data in seconds).
+    WRFTAMER_BENCHMARK_DIR: directory of the results (benchmarks.json). Default: a temporary directory.
+    WRFTAMER_BENCHMARK_BASELINE: results of an earlier run. A benchmark fails if it is slower than the baseline by
+    more than WRFTAMER_BENCHMARK_TOLERANCE (default: 1.5).
+
+Each benchmark runs in a new process, which records its best time of a few repeats and its peak RSS.
+"""
+
+import os
+import json
+import time
+import resource
+import datetime as dt
+import multiprocessing
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+from wrftamer import test_res_path
+from wrftamer.process_tslist_files import merge_tslist_files, average_ts_files, read_files
+from wrftamer.statistics import Statistics_xarray, statistics
+
+SIZE = {"stations": 4, "levels": 12, "days": 1, "segments": 2, "step": 3}
+SIZE.update({key: int(value) for key, value in (item.split("=") for item in
+                                                os.environ.get("WRFTAMER_BENCHMARK_SIZE", "").split(",") if item)})
+
+RESULTS = {}
+
+
+def write_tslist_tree(directory, stations: int, levels: int, days: int, segments: int, step: int, seed=0) -> list:
+    """
+    Writes a synthetic tslist tree in the format of WRF: one tsfiles_* folder per restart segment, each with the
+    files of all stations (FINO.d01.UU, ...).
+
+    Returns: the tsfiles_* folders.
+    """
+
+    rng = np.random.default_rng(seed)
+    with open(test_res_path / "model_data/tsfiles_20211206_094418/FINO.d01.UU", "r") as f:
+        header = f.readline()
+
+    start = dt.datetime(2020, 5, 17)
+    steps = days * 86400 // step // segments
+    hours = np.arange(1, steps + 1) * step / 3600
+    profile_fmt = "%13.6f" + "%14.5f" * levels
+    surface_fmt = "%2d%13.6f%5d%5d%5d" + "%14.5f" * 14
+
+    folders = []
+    for segment in range(segments):
+        date = start + dt.timedelta(seconds=segment * steps * step)
+        folder = directory / f"tsfiles_{date:%Y%m%d_%H%M%S}"
+        folder.mkdir(parents=True)
+        folders.append(str(folder))
+        for station in range(stations):
+            name = f"B{station:03d}"
+            head = header.replace("FINO", name).replace("2020-05-17_00:00:00", f"{date:%Y-%m-%d_%H:%M:%S}")
+            for var, mean in [("UU", 6), ("VV", 2), ("WW", 0), ("PH", 100), ("TH", 283), ("QV", 0.007), ("PR", 1e5)]:
+                values = mean + rng.normal(size=(steps, levels))
+                np.savetxt(folder / f"{name}.d01.{var}", np.column_stack([hours, values]), fmt=profile_fmt,
+                           header=head.rstrip("\n"), comments="")
+            ids = np.tile([1, 1, 126, 100], (steps, 1))
+            values = 283 + rng.normal(size=(steps, 14))
+            table = np.column_stack([ids[:, :1], hours, ids[:, 1:], values])
+            np.savetxt(folder / f"{name}.d01.TS", table, fmt=surface_fmt, header=head.rstrip("\n"), comments="")
+
+    return folders
+
+
+def _run(func, args, repeat, queue):
+    # runs in a new process: the best time of repeat calls and the peak RSS of the process (kB on Linux).
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    queue.put({"seconds": min(timings), "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+               "baseline_rss_mb": baseline / 1024})
+
+
+def benchmark(name: str, func, *args, repeat=3):
+    """
+    Times func(*args) in a new process and records the result. Fails if a baseline is given and func became slower.
+    """
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run, args=(func, args, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    assert process.exitcode == 0
+
+    result.update(size=SIZE)
+    RESULTS[name] = result
+    print(f"{name}: {result['seconds']:.3f} s, peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    baseline = os.environ.get("WRFTAMER_BENCHMARK_BASELINE")
+    if baseline:
+        with open(baseline) as f:
+            previous = json.load(f).get(name)
+        tolerance = float(os.environ.get("WRFTAMER_BENCHMARK_TOLERANCE", 1.5))
+        if previous is not None and previous["size"] == SIZE:
+            assert result["seconds"] <= tolerance * previous["seconds"], f"{name} is slower than the baseline"
+
+    return result
+
+
+@pytest.fixture(scope="module")
+def tslist_tree(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("benchmark")
+    folders = write_tslist_tree(directory / "out", **SIZE)
+
+    yield directory, folders
+
+    outdir = os.environ.get("WRFTAMER_BENCHMARK_DIR", str(directory))
+    with open(f"{outdir}/benchmarks.json", "w") as f:
+        json.dump(RESULTS, f, indent=2)
+
+
+def make_stats_dataset(n_mod: int, n_station: int, n_time: int) -> xr.Dataset:
+    rng = np.random.default_rng(1)
+    obs = rng.gamma(2, 3, (n_station, n_time))
+    obs[rng.random(obs.shape) < 0.02] = np.nan
+    data = {"Obs": (["station_name", "time"], obs)}
+    for mm in range(n_mod):
+        data[f"exp{mm}"] = (["station_name", "time"], obs + rng.normal(size=obs.shape))
+    stats_ds = xr.Dataset(data, coords={"station_name": [f"S{ss}" for ss in range(n_station)],
+                                        "time": pd.date_range("2020-01-01", periods=n_time, freq="10min")})
+    stats_ds.attrs = {"var": "WSP"}
+    return stats_ds
+
+
+def _statistics_pd(stats_ds: xr.Dataset):
+    exps = [name for name in stats_ds.data_vars if name != "Obs"]
+    for station_name in stats_ds.station_name.values:
+        df = stats_ds.sel(station_name=station_name).to_pandas()
+        statistics(df, "bench", station_name, "WSP", "100", "cup", exps, ["Obs"])
+
+
+@pytest.mark.slow
+def test_benchmark_read_files(tslist_tree):
+    directory, folders = tslist_tree
+    benchmark("read_files UU", read_files, f"{folders[0]}/B000.d01.UU", "UU", "new")
+    benchmark("read_files TS", read_files, f"{folders[0]}/B000.d01.TS", "TS", "new")
+
+
+@pytest.mark.slow
+def test_benchmark_merge_tslist_files(tslist_tree):
+    directory, folders = tslist_tree
+    outdir = directory / "out"
+    benchmark("merge_tslist_files", merge_tslist_files, folders, str(outdir), None, None, "BENCH", "EXP", repeat=1)
+    benchmark("merge_tslist_files workers=2", merge_tslist_files, folders, str(outdir), None, None, "BENCH", "EXP",
+              "-", 2, repeat=1)
+    assert (outdir / "raw_tslist_d01.nc").is_file()
+
+
+@pytest.mark.slow
+def test_benchmark_average_ts_files(tslist_tree):
+    directory, folders = tslist_tree
+    rawfile = directory / "out/raw_tslist_d01.nc"
+    if not rawfile.is_file():
+        merge_tslist_files(folders, str(directory / "out"), None, None, "BENCH", "EXP")
+
+    benchmark("average_ts_files", average_ts_files, str(rawfile), [5, 10, 30], repeat=1)
+    assert (directory / "out/Ave10Min_tslist_d01.nc").is_file()
+
+
+@pytest.mark.slow
+def test_benchmark_statistics(tslist_tree):
+    # 40 experiments at SIZE["stations"] stations, one year of 10-minute averages per day of the tslist tree.
+    stats_ds = make_stats_dataset(40, SIZE["stations"], 52560 * SIZE["days"])
+
+    benchmark("Statistics_xarray", Statistics_xarray, stats_ds)
+    benchmark("Statistics_xarray metrics", Statistics_xarray, stats_ds, 0, None, None, None, None,
+              ["quantiles", "weibull", "hit_rate"])
+    benchmark("statistics", _statistics_pd, stats_ds)
@@ -0,0 +1,37 @@
+import datetime as dt
+import numpy as np
+import pandas as pd
+import pytest
+from wrftamer.experiment_db import open_db
+from wrftamer.catalog import query
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_query(tmp_path, backend):
+    for proj_name, statuses in [("P1", ["created", "moved", "moved"]), ("P2", ["moved", "archived"])]:
+        (tmp_path / proj_name).mkdir()
+        df = pd.DataFrame({
+            "Name": [f"E{ii}" for ii in range(len(statuses))],
+            "time": "2020.01.01 00:00:00",
+            "comment": [f"run {ii}" for ii in range(len(statuses))],
+            "start": [str(dt.datetime(2020, 1 + ii, 1)) for ii in range(len(statuses))],
+            "end": "2021-01-01 00:00:00",
+            "disk use": np.arange(len(statuses), dtype=float),
+            "runtime": np.nan,
+            "status": statuses,
+        })
+        open_db(backend, proj_name, tmp_path / proj_name).replace(df)
+
+    res = query(backend, tmp_path)
+    assert res.project.to_list() == ["P1", "P1", "P1", "P2", "P2"]
+
+    res = query(backend, tmp_path, status="moved", start__gte=dt.datetime(2020, 2, 1))
+    assert list(zip(res.project, res.Name)) == [("P1", "E1"), ("P1", "E2")]
+
+    res = query(backend, tmp_path, project__in=["P2"], disk_use__lt=1, comment__contains="run")
+    assert list(zip(res.project, res.Name)) == [("P2", "E0")]
+
+    assert len(query(backend, tmp_path, status__ne="moved", runtime__gt=0)) == 0
+
+    with pytest.raises(ValueError):
+        query(backend, tmp_path, colour="red")
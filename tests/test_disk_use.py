@@ -0,0 +1,61 @@
+import os
+from wrftamer.disk_use import DiskUsage
+
+
+def test_disk_usage(tmp_path, monkeypatch):
+    for sub, size in [("wrf", 100), ("out/tsfiles_1", 2000), ("out/tsfiles_2", 30)]:
+        (tmp_path / "exp" / sub).mkdir(parents=True)
+        with open(tmp_path / "exp" / sub / "data", "wb") as f:
+            f.write(b"x" * size)
+    # links are not counted.
+    os.symlink(tmp_path / "exp/wrf/data", tmp_path / "exp/wrf/link")
+    os.symlink(tmp_path / "exp/out", tmp_path / "exp/wrf/out_link")
+
+    scanned = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        scanned.append(os.path.relpath(path, tmp_path))
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+
+    cache_file = tmp_path / "du_cache.json"
+    disk_usage = DiskUsage(cache_file, settle=0)
+    assert disk_usage.size(tmp_path / "exp", tmp_path / "missing") == 2130
+    disk_usage.save()
+    assert len(scanned) == 5
+
+    # nothing changed: no directory is read again.
+    scanned.clear()
+    assert DiskUsage(cache_file, settle=0).size(tmp_path / "exp") == 2130
+    assert scanned == []
+
+    # only the changed directory is read again, removed directories leave the cache.
+    with open(tmp_path / "exp/out/tsfiles_1/more", "wb") as f:
+        f.write(b"x" * 5)
+    os.remove(tmp_path / "exp/out/tsfiles_2/data")
+    os.rmdir(tmp_path / "exp/out/tsfiles_2")
+    disk_usage = DiskUsage(cache_file, settle=0)
+    assert disk_usage.size(tmp_path / "exp") == 2105
+    assert sorted(scanned) == ["exp/out", "exp/out/tsfiles_1"]
+    disk_usage.save()
+    assert str(tmp_path / "exp/out/tsfiles_2") not in DiskUsage(cache_file).cache
+
+    # tslist products that grow in place are measured again, the rest of the directory comes from the cache.
+    (tmp_path / "exp/out/raw_tslist_d01.zarr/U").mkdir(parents=True)
+    for name in ["raw_tslist_d01.nc", "raw_tslist_d01.zarr/U/0"]:
+        with open(tmp_path / "exp/out" / name, "wb") as f:
+            f.write(b"x" * 10)
+    disk_usage = DiskUsage(cache_file, settle=0)
+    assert disk_usage.size(tmp_path / "exp") == 2125
+    disk_usage.save()
+    for name in ["raw_tslist_d01.nc", "raw_tslist_d01.zarr/U/0"]:
+        with open(tmp_path / "exp/out" / name, "ab") as f:
+            f.write(b"x" * 10)
+    scanned.clear()
+    assert DiskUsage(cache_file, settle=0).size(tmp_path / "exp") == 2145
+    assert sorted(scanned) == ["exp/out/raw_tslist_d01.zarr", "exp/out/raw_tslist_d01.zarr/U"]
+
+    # directories that changed recently are not cached.
+    assert DiskUsage(settle=3600).size(tmp_path / "exp") == 2145
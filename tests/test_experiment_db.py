@@ -0,0 +1,39 @@
+import multiprocessing
+import pytest
+from wrftamer.experiment_db import open_db
+
+
+def add_experiments(backend, tamer_path, worker):
+    db = open_db(backend, "P", tamer_path)
+    for ii in range(10):
+        db.add({"Name": f"W{worker}_{ii}", "status": "created"})
+        db.update(f"W{worker}_{ii}", {"status": "moved"})
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_concurrent_writers(tmp_path, backend):
+    tamer_path = tmp_path / "P"
+    tamer_path.mkdir()
+    db = open_db(backend, "P", tamer_path)
+    db.create()
+
+    # no change of one writer may be lost by the others.
+    processes = [multiprocessing.Process(target=add_experiments, args=(backend, tamer_path, worker))
+                 for worker in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    df = db.read()
+    assert len(df) == 30 and df.Name.is_unique
+    assert (df.status == "moved").all()
+
+    with pytest.raises(FileExistsError):
+        db.add({"Name": "W0_0"})
+
+    db.update_many({"W0_0": {"status": "archived"}, "W1_0": {"status": "archived", "disk use": 2.0}})
+    assert db.get("W0_0")["status"] == "archived"
+    assert db.get("W1_0")["disk use"] == 2.0
+    assert list(tamer_path.glob("*.tmp")) == []
@@ -1,4 +1,12 @@
-from wrftamer.process_tslist_files import merge_tslist_files, average_ts_files
+import time
+import shutil
+import datetime as dt
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+from wrftamer import test_res_path
+from wrftamer.process_tslist_files import merge_tslist_files, average_ts_files, read_files
 
 # TODO: I should add tests for other variant of tsfiles...
 #  Also, test the Failure if the format of the tsfiles is wrong...
@@ -38,3 +46,336 @@ def test_tslist_processing(tslist_environment):
     rawfile.unlink()
     avefile1.unlink()
     avefile2.unlink()
+
+
+def test_tslist_processing_parallel(tmp_path):
+    indir = [str(item) for item in sorted((test_res_path / "model_data").glob("tsfiles*"))]
+
+    serial_dir = tmp_path / "serial"
+    parallel_dir = tmp_path / "parallel"
+    serial_dir.mkdir()
+    parallel_dir.mkdir()
+
+    merge_tslist_files(indir, serial_dir, None, None, "WRFTAMER_TEST", "TEST1")
+    merge_tslist_files(indir, parallel_dir, None, None, "WRFTAMER_TEST", "TEST1", workers=2)
+
+    serial = (serial_dir / "raw_tslist_d01.nc").read_bytes()
+    parallel = (parallel_dir / "raw_tslist_d01.nc").read_bytes()
+    assert serial == parallel
+
+
+def test_tslist_processing_streaming(tmp_path):
+    # a second location that misses the last 100 values of each restart, so that the time axes differ.
+    indir = []
+    for directory in sorted((test_res_path / "model_data").glob("tsfiles*")):
+        newdir = tmp_path / directory.name
+        newdir.mkdir()
+        indir.append(str(newdir))
+        for fiile in directory.glob("FINO.*"):
+            lines = fiile.read_text().splitlines(keepends=True)
+            (newdir / fiile.name).write_text("".join(lines))
+            (newdir / fiile.name.replace("FINO", "TEST")).write_text("".join(lines[:-100]))
+
+    memory_dir = tmp_path / "memory"
+    streaming_dir = tmp_path / "streaming"
+    memory_dir.mkdir()
+    streaming_dir.mkdir()
+
+    merge_tslist_files(indir, memory_dir, None, None, "WRFTAMER_TEST", "TEST1")
+    merge_tslist_files(indir, streaming_dir, None, None, "WRFTAMER_TEST", "TEST1", workers=2, streaming=True)
+
+    coords = ["lat", "lon", "station_elevation"]
+    with xr.open_dataset(memory_dir / "raw_tslist_d01.nc") as expected:
+        with xr.open_dataset(streaming_dir / "raw_tslist_d01.nc") as actual:
+            assert list(actual.station_name.values) == ["FINO", "TEST"]
+            assert actual.lat.dims == ("station_name",)
+            xr.testing.assert_identical(actual.drop_vars(coords), expected.drop_vars(coords))
+            assert int(actual.U10.sel(station_name="TEST").isnull().sum()) == 200
+
+
+def test_tslist_processing_missing_variable(tmp_path):
+    # a second location without a file of the u-component.
+    indir = []
+    for directory in sorted((test_res_path / "model_data").glob("tsfiles*")):
+        newdir = tmp_path / directory.name
+        shutil.copytree(directory, newdir)
+        indir.append(str(newdir))
+        for fiile in directory.glob("FINO.*"):
+            if not fiile.name.endswith(".UU"):
+                shutil.copy(fiile, newdir / fiile.name.replace("FINO", "TEST"))
+
+    merge_tslist_files(indir, tmp_path, None, None, "WRFTAMER_TEST", "TEST1")
+
+    with xr.open_dataset(tmp_path / "raw_tslist_d01.nc") as raw:
+        assert list(raw.station_name.values) == ["FINO", "TEST"]
+        assert raw.U.sel(station_name="TEST").isnull().all()
+        assert raw.WSP.sel(station_name="TEST").isnull().all()
+        xr.testing.assert_equal(raw.V.sel(station_name="TEST").drop_vars(["station_name", "lat", "lon"]),
+                                raw.V.sel(station_name="FINO").drop_vars(["station_name", "lat", "lon"]))
+
+
+def test_tslist_processing_streaming_variables(tmp_path):
+    # the first location has no QV-file, the second one has all files.
+    indir = []
+    for directory in sorted((test_res_path / "model_data").glob("tsfiles*")):
+        newdir = tmp_path / directory.name
+        shutil.copytree(directory, newdir)
+        indir.append(str(newdir))
+        for fiile in directory.glob("FINO.*"):
+            if not fiile.name.endswith(".QV"):
+                shutil.copy(fiile, newdir / fiile.name.replace("FINO", "AAA"))
+
+    memory_dir = tmp_path / "memory"
+    streaming_dir = tmp_path / "streaming"
+    memory_dir.mkdir()
+    streaming_dir.mkdir()
+
+    merge_tslist_files(indir, memory_dir, None, None, "WRFTAMER_TEST", "TEST1")
+    merge_tslist_files(indir, streaming_dir, None, None, "WRFTAMER_TEST", "TEST1", streaming=True)
+
+    coords = ["lat", "lon", "station_elevation"]
+    with xr.open_dataset(memory_dir / "raw_tslist_d01.nc") as expected:
+        with xr.open_dataset(streaming_dir / "raw_tslist_d01.nc") as actual:
+            assert actual.QV.sel(station_name="AAA").isnull().all()
+            assert actual.QV.sel(station_name="FINO").notnull().all()
+            xr.testing.assert_identical(actual.drop_vars(coords), expected.drop_vars(coords))
+
+
+def test_tslist_processing_domains(tmp_path):
+    # a nest (d02) with an additional location that does not exist in d01.
+    indir = []
+    for directory in sorted((test_res_path / "model_data").glob("tsfiles*")):
+        newdir = tmp_path / directory.name
+        shutil.copytree(directory, newdir)
+        indir.append(str(newdir))
+        for fiile in directory.glob("FINO.d01.*"):
+            shutil.copy(fiile, newdir / fiile.name.replace("d01", "d02"))
+            shutil.copy(fiile, newdir / fiile.name.replace("FINO.d01", "NEST.d02"))
+
+    outdir = tmp_path / "out"
+    outdir.mkdir()
+    changed = merge_tslist_files(indir, outdir, None, None, "WRFTAMER_TEST", "TEST1")
+    assert list(changed) == [f"{outdir}/raw_tslist_d01.nc", f"{outdir}/raw_tslist_d02.nc"]
+
+    with xr.open_dataset(outdir / "raw_tslist_d01.nc") as d01:
+        with xr.open_dataset(outdir / "raw_tslist_d02.nc") as d02:
+            assert list(d01.station_name.values) == ["FINO"]
+            assert list(d02.station_name.values) == ["FINO", "NEST"]
+            xr.testing.assert_equal(d02.U.sel(station_name="FINO"), d01.U.sel(station_name="FINO"))
+
+
+def test_tslist_processing_incremental(tmp_path):
+    segments = sorted((test_res_path / "model_data").glob("tsfiles*"))
+
+    full_dir = tmp_path / "full"
+    full_dir.mkdir()
+    merge_tslist_files([str(item) for item in segments], full_dir, None, None, "WRFTAMER_TEST", "TEST1")
+    average_ts_files(str(full_dir / "raw_tslist_d01.nc"), [5, 10])
+
+    # process the restart segments one after the other, as the watchdog does.
+    outdir = tmp_path / "out"
+    outdir.mkdir()
+    for segment in segments:
+        shutil.copytree(segment, outdir / segment.name)
+        changed = merge_tslist_files(
+            sorted(outdir.glob("tsfiles*")), outdir, None, None, "WRFTAMER_TEST", "TEST1", incremental=True
+        )
+        assert list(changed) == [f"{outdir}/raw_tslist_d01.nc"]
+        for rawfile, since in changed.items():
+            average_ts_files(rawfile, [5, 10], since=since)
+
+    # the second segment starts 12 hours into the run. Only this data has been merged in the last call.
+    assert changed[f"{outdir}/raw_tslist_d01.nc"] == np.datetime64("2020-05-17T12:00:03")
+    assert merge_tslist_files(
+        sorted(outdir.glob("tsfiles*")), outdir, None, None, "WRFTAMER_TEST", "TEST1", incremental=True
+    ) == {}
+
+    for name in ["raw_tslist_d01.nc", "Ave5Min_tslist_d01.nc", "Ave10Min_tslist_d01.nc"]:
+        with xr.open_dataset(full_dir / name) as expected:
+            with xr.open_dataset(outdir / name) as actual:
+                xr.testing.assert_identical(actual, expected)
+
+
+def test_tslist_processing_incremental_new_station(tmp_path):
+    # a location that was not selected in the first call is merged completely in the next call.
+    indir = []
+    for directory in sorted((test_res_path / "model_data").glob("tsfiles*")):
+        newdir = tmp_path / directory.name
+        shutil.copytree(directory, newdir)
+        indir.append(str(newdir))
+        for fiile in directory.glob("FINO.*"):
+            shutil.copy(fiile, newdir / fiile.name.replace("FINO", "TEST"))
+
+    full_dir = tmp_path / "full"
+    full_dir.mkdir()
+    merge_tslist_files(indir, full_dir, None, None, "WRFTAMER_TEST", "TEST1")
+
+    outdir = tmp_path / "out"
+    outdir.mkdir()
+    merge_tslist_files(indir, outdir, "FINO", None, "WRFTAMER_TEST", "TEST1", incremental=True)
+    changed = merge_tslist_files(indir, outdir, None, None, "WRFTAMER_TEST", "TEST1", incremental=True)
+    assert changed == {f"{outdir}/raw_tslist_d01.nc": np.datetime64("2020-05-17T00:00:03")}
+    assert merge_tslist_files(indir, outdir, None, None, "WRFTAMER_TEST", "TEST1", incremental=True) == {}
+
+    coords = ["lat", "lon", "station_elevation"]
+    with xr.open_dataset(full_dir / "raw_tslist_d01.nc") as expected:
+        with xr.open_dataset(outdir / "raw_tslist_d01.nc") as actual:
+            assert list(actual.station_name.values) == ["FINO", "TEST"]
+            xr.testing.assert_equal(actual.drop_vars(coords), expected.drop_vars(coords))
+
+
+def test_tslist_processing_encoding(tmp_path):
+    indir = [str(item) for item in sorted((test_res_path / "model_data").glob("tsfiles*"))]
+
+    encoding = {"complevel": 0, "variables": {"U": {"float32": True, "complevel": 4, "chunks": {"time": 1000}}}}
+    merge_tslist_files(indir, tmp_path, None, None, "WRFTAMER_TEST", "TEST1", encoding=encoding)
+    average_ts_files(str(tmp_path / "raw_tslist_d01.nc"), [10], encoding=encoding)
+
+    with xr.open_dataset(tmp_path / "raw_tslist_d01.nc") as raw:
+        assert raw.U.dtype == np.float32
+        assert raw.U.encoding["zlib"] and raw.U.encoding["chunksizes"] == (1, 1000, raw.sizes["model_level"])
+        assert raw.V.dtype == np.float64 and not raw.V.encoding["zlib"]
+        assert raw.V.encoding["chunksizes"] == (1, 8192, raw.sizes["model_level"])
+
+    with xr.open_dataset(tmp_path / "Ave10Min_tslist_d01.nc") as ave:
+        assert ave.U.dtype == np.float32 and ave.U.encoding["chunksizes"][ave.U.dims.index("station_name")] == 1
+
+
+def test_tslist_processing_zarr(tmp_path):
+    pytest.importorskip("zarr")
+    segments = sorted((test_res_path / "model_data").glob("tsfiles*"))
+
+    full_dir = tmp_path / "full"
+    full_dir.mkdir()
+    merge_tslist_files([str(item) for item in segments], full_dir, None, None, "WRFTAMER_TEST", "TEST1")
+    average_ts_files(str(full_dir / "raw_tslist_d01.nc"), [5, 10])
+
+    # new segments are appended to the zarr stores.
+    outdir = tmp_path / "out"
+    outdir.mkdir()
+    for segment in segments:
+        shutil.copytree(segment, outdir / segment.name)
+        changed = merge_tslist_files(
+            sorted(outdir.glob("tsfiles*")), outdir, None, None, "WRFTAMER_TEST", "TEST1", incremental=True,
+            backend="zarr"
+        )
+        assert list(changed) == [f"{outdir}/raw_tslist_d01.zarr"]
+        for rawfile, since in changed.items():
+            average_ts_files(rawfile, [5, 10], since=since)
+
+    for name in ["raw_tslist_d01", "Ave5Min_tslist_d01", "Ave10Min_tslist_d01"]:
+        with xr.open_dataset(full_dir / f"{name}.nc") as expected:
+            with xr.open_dataset(outdir / f"{name}.zarr", engine="zarr") as actual:
+                assert dict(zip(actual.U.dims, actual.U.encoding["chunks"]))["station_name"] == 1
+                assert list(actual.station_name.values) == list(expected.station_name.values)
+                xr.testing.assert_equal(actual.drop_vars("station_name"), expected.drop_vars("station_name"))
+
+
+def test_average_ts_files(tmp_path):
+    # 3-second data with missing values and a gap of 20 minutes, starting on the edge of a window.
+    time = pd.date_range("2020-05-17 00:00:00", periods=6000, freq="3s")
+    time = time[(time < "2020-05-17 02:00:00") | (time > "2020-05-17 02:20:00")]
+    rng = np.random.default_rng(0)
+    uu = rng.normal(size=(1, len(time), 3))
+    uu[0, ::7, 1] = np.nan
+    raw = xr.Dataset(
+        {"U": (("station_name", "time", "model_level"), uu), "U10": (("station_name", "time"), uu[:, :, 0])},
+        coords={"station_name": ["FINO"], "time": time, "model_level": [1, 2, 3]},
+    )
+    rawfile = tmp_path / "raw_tslist_d01.nc"
+    raw.to_netcdf(rawfile)
+
+    # blocks of 500 time steps are aligned to 10 minute windows for [5, 10], so the gap lies between two blocks.
+    for timeavg, chunks in [([5, 7, 10, 30], None), ([5, 10], 500)]:
+        average_ts_files(str(rawfile), timeavg, chunks=chunks)
+
+        for time in timeavg:
+            expected = raw.resample(time=f"{time}Min", label="left", closed="right").mean()
+            with xr.open_dataset(tmp_path / f"Ave{time}Min_tslist_d01.nc") as actual:
+                xr.testing.assert_allclose(actual, expected, rtol=1e-12, atol=1e-12)
+
+
+def _read_files_pandas(fiile, var_element):
+    # reference: the generic pandas parser, as used before the fixed width parser was introduced.
+    use_cols = [1, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14] if var_element == "TS" else None
+    names = ["Time", "T2", "Q2", "U10", "V10", "PSFC", "GLW", "GSW", "HFX", "LH", "TSK"]
+    names = names if var_element == "TS" else None
+
+    with open(fiile, "r") as myfile:
+        head = myfile.readline().rstrip("\n")
+        startdate = dt.datetime.strptime(head.split(" ")[-1] + "-+0000", "%Y-%m-%d_%H:%M:%S-%z")
+        data = pd.read_csv(myfile, sep=r"\s+", header=None, index_col=0, usecols=use_cols, names=names)
+
+    seconds = np.round(data.index * 3600 + startdate.timestamp()).astype(int)
+    data.index = seconds.to_numpy().astype("datetime64[s]")
+    data.index.name = None
+
+    return data
+
+
+def test_read_files():
+    tsdir = test_res_path / "model_data/tsfiles_20211206_094418"
+
+    for var_element in ["UU", "VV", "PH", "WW", "TH", "TS", "PR", "QV"]:
+        tsfile = tsdir / f"FINO.d01.{var_element}"
+        pd.testing.assert_frame_equal(read_files(tsfile, var_element, "new"), _read_files_pandas(tsfile, var_element),
+                                      check_exact=True)
+
+
+def test_read_files_fallback(tmp_path):
+    # files that do not have the fixed width layout of WRF are read with the generic parser.
+    with open(test_res_path / "model_data/tsfiles_20211206_094418/FINO.d01.UU", "r") as f:
+        lines = f.readlines()
+
+    lines[5] = lines[5][:13] + "NaN".rjust(14) + lines[5][27:]
+    tsfile = tmp_path / "FINO.d01.UU"
+    with open(tsfile, "w") as f:
+        f.writelines(lines)
+
+    data = read_files(tsfile, "UU", "new")
+    pd.testing.assert_frame_equal(data, _read_files_pandas(tsfile, "UU"), check_exact=True)
+    assert np.isnan(data.iloc[4, 0])
+
+
+def test_read_files_cache(tmp_path):
+    tsdir = tmp_path / "tsfiles_20211206_094418"
+    tsdir.mkdir()
+    fiile = tsdir / "FINO.d01.TS"
+    shutil.copy(test_res_path / "model_data/tsfiles_20211206_094418/FINO.d01.TS", fiile)
+    cache_dir = tmp_path / ".tscache"
+
+    expected = read_files(fiile, "TS", "new")
+    pd.testing.assert_frame_equal(read_files(fiile, "TS", "new", cache_dir=cache_dir), expected)
+    assert len(list(cache_dir.glob("*.npy"))) == 1
+    pd.testing.assert_frame_equal(read_files(fiile, "TS", "new", cache_dir=cache_dir), expected)
+    assert len(list(cache_dir.glob("*.npy"))) == 1
+
+    # a changed file is parsed again and replaces the old entry.
+    old_entry = list(cache_dir.glob("*.npy"))
+    lines = fiile.read_text().splitlines(keepends=True)
+    fiile.write_text("".join(lines[:-10]))
+    pd.testing.assert_frame_equal(read_files(fiile, "TS", "new", cache_dir=cache_dir), expected.iloc[:-10])
+    assert len(list(cache_dir.glob("*.npy"))) == 1 and not old_entry[0].exists()
+
+
+@pytest.mark.slow
+def test_read_files_speed(tmp_path):
+    # Benchmark with a tslist file of about 70 MB (14400 * 30 lines).
+    with open(test_res_path / "model_data/tsfiles_20211206_094418/FINO.d01.UU", "r") as f:
+        lines = f.readlines()
+
+    tsfile = tmp_path / "FINO.d01.UU"
+    with open(tsfile, "w") as f:
+        f.write(lines[0])
+        for _ in range(30):
+            f.writelines(lines[1:])
+
+    timings = dict()
+    for name, reader in [("pandas", _read_files_pandas), ("fixed width", lambda x, y: read_files(x, y, "new"))]:
+        start = time.perf_counter()
+        for _ in range(3):
+            reader(tsfile, "UU")
+        timings[name] = (time.perf_counter() - start) / 3
+
+    print(f"read_files: {timings['fixed width']:.3f} s, pandas: {timings['pandas']:.3f} s")
+    assert timings["fixed width"] * 1.5 < timings["pandas"]
@@ -3,8 +3,9 @@ import os
 from pathlib import Path
 import shutil
 import pandas as pd
-from wrftamer.main import Project, list_projects, reassociate
-from wrftamer import test_res_path
+from wrftamer.main import Project, list_projects, reassociate, db_path
+from wrftamer.experiment_db import convert_db
+from wrftamer import test_res_path, cfg
 
 # works
 
@@ -323,8 +324,18 @@ def experiment_checks(proj_name1, exp_name1):
 
     proj.exp_get_maxdom_from_config(exp_name1)
 
-    # Updating the database should work
-    proj.update_csv()
+    # Updating the database should work. Experiments that did not change are skipped the second time.
+    assert sorted(proj.update_csv()) == [exp_name2, exp_name3]
+    assert proj.update_csv() == []
+    workdir = proj.get_workdir(exp_name2)
+    with open(workdir / "out/new_file", "w") as f:
+        f.write("data")
+    assert proj.update_csv() == [exp_name2]
+    # files in out that grow in place, i.e. tslist products of incremental post-processing.
+    with open(workdir / "out/new_file", "a") as f:
+        f.write("more data")
+    assert proj.update_csv() == [exp_name2]
+    assert sorted(proj.update_csv(force=True)) == [exp_name2, exp_name3]
 
     # Removing an experiment should work
     proj.exp_remove(exp_name1, force=True)
@@ -369,6 +380,29 @@ def test_experiment_with_project2(testprojects):
     experiment_checks(proj_name1, exp_name1)
 
 
+def test_experiment_sqlite_db(testprojects, monkeypatch):
+    testproject1, testproject2 = testprojects
+    configfile = test_res_path / 'configure_test.yaml'
+    testproject2.exp_create("TEST1", "First Experiment", configfile, verbose=False)
+
+    # the experiments of the csv files are imported into the sqlite database.
+    monkeypatch.setitem(cfg, "wrftamer_db_backend", "sqlite")
+    convert_db(db_path, "csv", "sqlite", verbose=False)
+    proj = Project(testproject2.name)
+    assert proj.list_exp(verbose=False) == ["TEST1"]
+    assert proj.exp_get_status("TEST1") == "created"
+
+    experiment_checks(testproject1.name, "TEST1")
+
+    proj.exp_create("TEST4", "Fourth Experiment", configfile, verbose=False)
+    reassociate(proj, Project(testproject1.name), "TEST4")
+    assert proj.list_exp(verbose=False) == ["TEST1"]
+
+    # and exported again.
+    convert_db(db_path, "sqlite", "csv", verbose=False)
+    assert testproject1.list_exp(verbose=False) == Project(testproject1.name).list_exp(verbose=False)
+
+
 def test_postprocessing(test_env2):
     test_proj, exp_name1 = test_env2
 
@@ -1,5 +1,12 @@
+import os
+import math
+import multiprocessing
 import numpy as np
-from wrftamer.statistics import statistics, Statistics_xarray
+import pandas as pd
+import xarray as xr
+import pytest
+from wrftamer.statistics import (statistics, Statistics_xarray, StatAccumulator, StatisticsCache, wind_sector,
+                                 _stat_calc, _stat_calc_dir)
 
 
 def test_stats1(statistics_pd):
@@ -102,3 +109,342 @@ def test_xa_stats5(statistics_xa):
     for item in diff:
         if np.max(abs(diff[item])) > 1e-10:
             raise ValueError
+
+
+def test_xa_stats_vectorized():
+    # several models and stations with missing values and zeros in the model data.
+    rng = np.random.default_rng(0)
+    obs = rng.gamma(2, 3, (4, 500))
+    obs[rng.random(obs.shape) < 0.05] = np.nan
+    obs[0, :] = np.nan
+    mod = obs + rng.normal(size=(3, 4, 500))
+    mod[rng.random(mod.shape) < 0.05] = np.nan
+    mod[rng.random(mod.shape) < 0.01] = 0
+
+    for var, stat_calc in [('wsp', _stat_calc), ('dir', _stat_calc_dir)]:
+        scale = 30 if var == 'dir' else 1
+        test_xa = xr.Dataset(
+            {'Obs': (['station_name', 'time'], np.mod(obs * scale, 360))},
+            coords={'station_name': ['S1', 'S2', 'S3', 'S4'], 'time': np.arange(500)},
+        )
+        for mm in range(3):
+            test_xa[f'model{mm}'] = (['station_name', 'time'], np.mod(mod[mm] * scale, 360))
+        test_xa.attrs = {'var': var}
+
+        res = Statistics_xarray(test_xa)
+        for mm in range(3):
+            for ss in range(4):
+                expect = stat_calc(test_xa.Obs.values[ss], test_xa[f'model{mm}'].values[ss])
+                actual = [res[item].values[mm, ss] for item in ['bias', 'std', 'mae', 'CorCo', 'mape', 'rmse']]
+                np.testing.assert_allclose(actual, expect, rtol=1e-12)
+
+
+def test_xa_stats_chunks(tmp_path):
+    rng = np.random.default_rng(1)
+    obs = rng.gamma(2, 3, (3, 1000))
+    obs[rng.random(obs.shape) < 0.05] = np.nan
+    test_xa = xr.Dataset(
+        {
+            'Obs': (['station_name', 'time'], obs),
+            'model1': (['station_name', 'time'], obs + rng.normal(size=obs.shape)),
+            'model2': (['station_name', 'time'], obs + rng.normal(size=obs.shape)),
+            'ramp_marker': (['station_name', 'time'], rng.random(obs.shape) < 0.5),
+        },
+        coords={'station_name': ['S1', 'S2', 'S3'], 'time': np.arange(1000)},
+    )
+    test_xa.attrs = {'var': 'wsp'}
+    test_xa.to_netcdf(tmp_path / 'stats.nc')
+
+    # blocks of 300 time steps, read from the file.
+    for calc_for_ramp in [0, 1]:
+        expect = Statistics_xarray(test_xa, calc_for_ramp)
+        with xr.open_dataset(tmp_path / 'stats.nc') as test_file:
+            res = Statistics_xarray(test_file, calc_for_ramp, chunks=300, workers=2)
+        xr.testing.assert_allclose(res, expect, rtol=1e-12)
+
+
+def test_stat_accumulator():
+    # pressure-like data, split into three restart segments that are accumulated separately and merged.
+    rng = np.random.default_rng(2)
+    obs = 1000 + rng.normal(size=(2, 900))
+    obs[rng.random(obs.shape) < 0.05] = np.nan
+    mod = obs + 0.1 * rng.normal(size=(3, 2, 900))
+    mod[rng.random(mod.shape) < 0.05] = np.nan
+
+    segments = [StatAccumulator().update(obs[:, part], mod[:, :, part]) for part in np.array_split(np.arange(900), 3)]
+    merged = segments[2].merge(segments[0]).merge(segments[1]).result()
+
+    streamed = StatAccumulator()
+    for part in np.array_split(np.arange(900), 7):
+        streamed.update(obs[:, part], mod[:, :, part])
+
+    for mm in range(3):
+        for ss in range(2):
+            expect = _stat_calc(obs[ss], mod[mm, ss])
+            np.testing.assert_allclose(merged[:, mm, ss], expect, rtol=1e-12)
+            np.testing.assert_allclose(streamed.result()[:, mm, ss], expect, rtol=1e-12)
+
+
+def test_stat_accumulator_merge_bins():
+    # two halves with different distributions. The default bins of the quantiles differ, so they are not merged.
+    rng = np.random.default_rng(8)
+    obs = np.concatenate([rng.normal(5, 1, (1, 2000)), rng.normal(15, 3, (1, 2000))], axis=1)
+    mod = obs + 0.2 + 0.1 * rng.normal(size=(1, 1, 4000))
+    halves = [slice(0, 2000), slice(2000, 4000)]
+
+    first, second = [StatAccumulator(metrics=['quantiles']).update(obs[:, part], mod[:, :, part]) for part in halves]
+    with pytest.raises(ValueError):
+        first.merge(second)
+
+    metrics = {'quantiles': {'bins': np.linspace(-10, 40, 5001)}}
+    single = StatAccumulator(metrics=metrics).update(obs, mod)
+    first, second = [StatAccumulator(metrics=metrics).update(obs[:, part], mod[:, :, part]) for part in halves]
+    merged = first.merge(second)
+    for name, values in single.metrics().items():
+        np.testing.assert_allclose(merged.metrics()[name], values, rtol=1e-12)
+    np.testing.assert_allclose(merged.metrics()['P50_err'], np.median(mod) - np.median(obs), atol=0.02)
+
+
+def test_stats_dir_wrapped():
+    # differences across north are wrapped for all statistics, including the rmse.
+    obs = np.array([350.0, 10.0, np.nan, 180.0])
+    mod = np.array([10.0, 350.0, 90.0, 200.0])
+
+    bias, std_err, mae, r, mape, rmse = _stat_calc_dir(obs, mod)
+    np.testing.assert_allclose([bias, mae, rmse], [20 / 3, 20, 20])
+    assert np.isnan(r) and np.isnan(mape)
+
+    test_xa = xr.Dataset(
+        {'Obs': (['station_name', 'time'], obs[None, :]), 'model': (['station_name', 'time'], mod[None, :])},
+        coords={'station_name': ['S1'], 'time': np.arange(4)},
+    )
+    test_xa.attrs = {'var': 'dir'}
+    np.testing.assert_allclose(Statistics_xarray(test_xa).rmse.values, [[20]])
+
+
+def test_xa_stats_grouped(tmp_path):
+    rng = np.random.default_rng(3)
+    times = pd.date_range('2021-01-01', periods=2000, freq='h')
+    obs = rng.gamma(2, 3, (2, 2000))
+    obs[rng.random(obs.shape) < 0.05] = np.nan
+    test_xa = xr.Dataset(
+        {
+            'Obs': (['station_name', 'time'], obs),
+            'model1': (['station_name', 'time'], obs + rng.normal(size=obs.shape)),
+            'model2': (['station_name', 'time'], obs + rng.normal(size=obs.shape)),
+            'stability': (['station_name', 'time'], rng.choice([-1.0, 0.0, 1.0, np.nan], obs.shape)),
+        },
+        coords={'station_name': ['S1', 'S2'], 'time': times},
+    )
+    test_xa.attrs = {'var': 'wsp'}
+    direction = xr.DataArray(rng.uniform(0, 360, 2000), coords={'time': times})
+
+    groupby = {'month': 'time.month', 'sector': wind_sector(direction, 4), 'stability': 'stability'}
+    res = Statistics_xarray(test_xa, groupby=groupby)
+    if res.bias.dims != ('mod_name', 'station_name', 'month', 'sector', 'stability'):
+        raise ValueError
+    np.testing.assert_array_equal(res.sector.values, [0, 90, 180, 270])
+    np.testing.assert_array_equal(res.mod_name.values, ['model1', 'model2'])
+
+    # each group is the same as the statistics of the time steps of this group only.
+    sector = wind_sector(direction, 4)
+    for month, sec, stab in [(1, 0, -1), (2, 270, 1), (3, 90, 0)]:
+        mask = (test_xa.time.dt.month == month) & (sector == sec) & (test_xa.stability == stab)
+        subset = test_xa[['Obs', 'model1', 'model2']].where(mask)
+        expect = Statistics_xarray(subset)
+        got = res.sel(month=month, sector=sec, stability=stab, drop=True)
+        xr.testing.assert_allclose(got, expect, rtol=1e-12)
+
+    test_xa.to_netcdf(tmp_path / 'stats.nc')
+    with xr.open_dataset(tmp_path / 'stats.nc') as test_file:
+        chunked = Statistics_xarray(test_file, chunks=300, workers=2, groupby=groupby)
+    xr.testing.assert_allclose(chunked, res, rtol=1e-12)
+
+
+def test_xa_stats_bootstrap():
+    rng = np.random.default_rng(4)
+    obs = rng.gamma(2, 3, (2, 2400))
+    obs[rng.random(obs.shape) < 0.05] = np.nan
+    test_xa = xr.Dataset(
+        {
+            'Obs': (['station_name', 'time'], obs),
+            'model1': (['station_name', 'time'], obs + 0.5 + rng.normal(size=obs.shape)),
+            'model2': (['station_name', 'time'], obs + rng.normal(size=obs.shape)),
+        },
+        coords={'station_name': ['S1', 'S2'], 'time': np.arange(2400)},
+    )
+    test_xa.attrs = {'var': 'wsp'}
+
+    settings = {'n_resamples': 300, 'block_length': 24, 'seed': 0}
+    res = Statistics_xarray(test_xa, bootstrap=settings)
+    xr.testing.assert_allclose(res[['bias', 'std', 'mae', 'CorCo', 'mape', 'rmse']], Statistics_xarray(test_xa))
+
+    # the intervals enclose the point estimates and separate the biased model.
+    for name in ['bias', 'std', 'mae', 'CorCo', 'mape', 'rmse']:
+        if not ((res[f'{name}_ci'].sel(bound='lower') <= res[name]).all()
+                and (res[name] <= res[f'{name}_ci'].sel(bound='upper')).all()):
+            raise ValueError
+    lower, upper = res.bias_ci.sel(bound='lower'), res.bias_ci.sel(bound='upper')
+    if not (lower.sel(mod_name='model1') > upper.sel(mod_name='model2')).all():
+        raise ValueError
+
+    # the standard error of the bias of independent errors is 1 / sqrt(n).
+    width = (upper - lower).values
+    np.testing.assert_allclose(width, 2 * 1.96 / np.sqrt(0.95 * 2400), rtol=0.25)
+
+    # the resamples do not depend on the number of processes.
+    again = Statistics_xarray(test_xa, bootstrap=dict(settings, processes=2))
+    xr.testing.assert_identical(again, res)
+
+    df = test_xa.sel(station_name='S1').to_dataframe()[['Obs', 'model1', 'model2']]
+    res_pd = statistics(df, 'proj', 'S1', 'WSP', '10', 'cup', ['model1', 'model2'], ['Obs'], bootstrap=settings)
+    np.testing.assert_allclose(res_pd['BIAS_lower'], res.bias_ci.sel(station_name='S1', bound='lower'))
+
+    # the default blocks are one day long, which requires dates.
+    with pytest.raises(ValueError):
+        Statistics_xarray(test_xa, bootstrap={'seed': 0})
+    dated = test_xa.assign_coords(time=pd.date_range('2020-05-17', periods=2400, freq='10min'))
+    xr.testing.assert_identical(Statistics_xarray(dated, bootstrap={'n_resamples': 300, 'seed': 0}).bias_ci,
+                                Statistics_xarray(dated, bootstrap=dict(settings, block_length=144)).bias_ci)
+
+
+def test_statistics_cache(tmp_path):
+    rng = np.random.default_rng(5)
+    obs = rng.gamma(2, 3, 500)
+    df = pd.DataFrame({'Obs': obs, 'exp1': obs + rng.normal(size=500), 'exp2': obs + rng.normal(size=500)})
+    files = {}
+    for name in df:
+        files[name] = [tmp_path / f'{name}.nc']
+        files[name][0].write_text(name)
+
+    loaded = []
+
+    def load(exp_names):
+        loaded.append(exp_names)
+        return df
+
+    cache = StatisticsCache(tmp_path / 'statistics.csv')
+    args = ('proj', 'S1', 'WSP', '10', 'cup', ['exp1', 'exp2'], ['Obs'], files)
+    expect = statistics(df, *args[:-1])
+
+    res = cache.statistics(load, *args, timeavg=10)
+    pd.testing.assert_frame_equal(res, expect)
+    res = cache.statistics(load, *args, timeavg=10)
+    pd.testing.assert_frame_equal(res, expect)
+    if loaded != [['exp1', 'exp2']]:
+        raise ValueError
+
+    # only the experiment with a changed file and the new averaging window are computed.
+    stat = os.stat(files['exp2'][0])
+    os.utime(files['exp2'][0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cache.statistics(load, *args, timeavg=10)
+    cache.statistics(load, *args, timeavg=5)
+    if loaded[1:] != [['exp2'], ['exp1', 'exp2']] or len(cache.read()) != 4:
+        raise ValueError
+
+    # statistics without overlapping data are NaN, and are not computed again.
+    df['exp3'] = np.nan
+    files['exp3'] = [tmp_path / 'exp3.nc']
+    files['exp3'][0].write_text('exp3')
+    args = ('proj', 'S1', 'WSP', '10', 'cup', ['exp3'], ['Obs'], files)
+    assert cache.statistics(load, *args, timeavg=10)['BIAS'].isna().all()
+    cache.statistics(load, *args, timeavg=10)
+    if loaded[3:] != [['exp3']]:
+        raise ValueError
+
+
+def _cache_statistics(filename, df, files, loc):
+    cache = StatisticsCache(filename)
+    for timeavg in range(5):
+        cache.statistics(df, 'proj', loc, 'WSP', '10', 'cup', ['exp1'], ['Obs'], files, timeavg=timeavg)
+
+
+def test_statistics_cache_concurrent(tmp_path):
+    rng = np.random.default_rng(9)
+    obs = rng.gamma(2, 3, 500)
+    df = pd.DataFrame({'Obs': obs, 'exp1': obs + rng.normal(size=500)})
+    files = {name: [tmp_path / f'{name}.nc'] for name in df}
+    for name in df:
+        files[name][0].write_text(name)
+
+    # no row of one process may be lost by the others.
+    processes = [multiprocessing.Process(target=_cache_statistics, args=(tmp_path / 'statistics.csv', df, files, loc))
+                 for loc in ['S1', 'S2', 'S3']]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    table = StatisticsCache(tmp_path / 'statistics.csv').read()
+    assert len(table) == 15 and list(tmp_path.glob('*.tmp')) == []
+
+
+def test_xa_stats_metrics(tmp_path):
+    rng = np.random.default_rng(6)
+    obs = 8 * rng.weibull(2, (2, 3000))
+    obs[rng.random(obs.shape) < 0.05] = np.nan
+    mod = np.stack([obs + 0.5 * rng.normal(size=obs.shape), 1.2 * obs])
+    mod[rng.random(mod.shape) < 0.05] = np.nan
+    test_xa = xr.Dataset(
+        {'Obs': (['station_name', 'time'], obs), 'model1': (['station_name', 'time'], mod[0]),
+         'model2': (['station_name', 'time'], mod[1])},
+        coords={'station_name': ['S1', 'S2'], 'time': np.arange(3000)},
+    )
+    test_xa.attrs = {'var': 'wsp'}
+
+    res = Statistics_xarray(test_xa, metrics=['quantiles', 'weibull', 'hit_rate'])
+    xr.testing.assert_allclose(res[['bias', 'std', 'mae', 'CorCo', 'mape', 'rmse']], Statistics_xarray(test_xa))
+
+    def weibull(x):
+        k = (np.std(x) / np.mean(x)) ** -1.086
+        return k, np.mean(x) / math.gamma(1 + 1 / k)
+
+    for mm, mod_name in enumerate(['model1', 'model2']):
+        for ss, station_name in enumerate(['S1', 'S2']):
+            got = res.sel(mod_name=mod_name, station_name=station_name)
+            valid = ~np.isnan(obs[ss]) & ~np.isnan(mod[mm, ss])
+            o, m = obs[ss][valid], mod[mm, ss][valid]
+
+            # the resolution of the quantiles is the width of the bins, about 1/1000 of the range.
+            for q in [10, 50, 90]:
+                expect = np.quantile(m, q / 100) - np.quantile(o, q / 100)
+                np.testing.assert_allclose(got[f'P{q}_err'], expect, atol=0.05)
+            np.testing.assert_allclose(got.weibull_k_diff, weibull(m)[0] - weibull(o)[0], atol=1e-10)
+            np.testing.assert_allclose(got.weibull_A_diff, weibull(m)[1] - weibull(o)[1], atol=1e-10)
+            bins = np.arange(0.0, 51.0)
+            np.testing.assert_allclose(got.hit_rate, np.mean(np.digitize(o, bins) == np.digitize(m, bins)) * 100)
+
+    np.testing.assert_allclose(res.P50_err.sel(mod_name='model2'), 0.2 * np.nanmedian(obs, axis=1), rtol=0.02)
+
+    # the same in blocks read from a file.
+    test_xa.to_netcdf(tmp_path / 'stats.nc')
+    with xr.open_dataset(tmp_path / 'stats.nc') as test_file:
+        chunked = Statistics_xarray(test_file, chunks=700, metrics=['quantiles', 'weibull', 'hit_rate'])
+    xr.testing.assert_allclose(chunked, res, rtol=1e-10)
+
+
+def test_stats_dir_circular():
+    rng = np.random.default_rng(7)
+    obs = np.mod(rng.vonmises(0, 2, 2000) * 180 / np.pi, 360)
+    mod = np.mod(obs + rng.normal(0, 20, 2000), 360)
+    obs[::17] = np.nan
+    test_xa = xr.Dataset(
+        {'Obs': (['station_name', 'time'], obs[None, :]), 'model': (['station_name', 'time'], mod[None, :])},
+        coords={'station_name': ['S1'], 'time': np.arange(2000)},
+    )
+    test_xa.attrs = {'var': 'dir'}
+
+    a, b = np.deg2rad(obs[~np.isnan(obs)]), np.deg2rad(mod[~np.isnan(obs)])
+    mean_a, mean_b = np.angle(np.exp(1j * a).sum()), np.angle(np.exp(1j * b).sum())
+    expect = np.sum(np.sin(a - mean_a) * np.sin(b - mean_b)) / np.sqrt(
+        np.sum(np.sin(a - mean_a) ** 2) * np.sum(np.sin(b - mean_b) ** 2)) * 100
+
+    res = Statistics_xarray(test_xa, metrics=['circular'])
+    np.testing.assert_allclose(res.CorCo.values, [[expect]], rtol=1e-10)
+    if not np.isnan(Statistics_xarray(test_xa).CorCo.values).all():
+        raise ValueError
+
+    df = test_xa.sel(station_name='S1').to_dataframe()[['Obs', 'model']]
+    res_pd = statistics(df, 'proj', 'S1', 'DIR', '10', 'vane', ['model'], ['Obs'], metrics=['circular'])
+    np.testing.assert_allclose(res_pd.CorCo, [expect], rtol=1e-10)